@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark Suite
+Measures retrieval, context assembly, the end-to-end RAG pipeline and Langfuse span overhead, with tracing on and off.
+
+Everything runs offline: the LLM is the in-process mock server with zero
+latency, and traces are exported to the mock Langfuse sink. Results are
+written as JSON so runs can be compared.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --compare bench.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from histogram import LatencyHistogram
+from mock_servers import OpenAIMockConfig, start_mock_servers
+from tracing import NoopSpan
+
+CORPUS_SIZES = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+QUICK_CORPUS_SIZES = (10, 1_000, 10_000)
+DOCUMENT_COUNTS = (1, 3, 10, 30, 100, 300, 1000)
+
+STARTUP_MODULES = ("simple_chat_demo", "rag_demo", "langchain_demo", "run_all_demos")
+# Documented cold-start budget: import time of any demo module, interpreter startup excluded
+STARTUP_TARGET_MS = 50.0
+# Packages that must not load at import time; they are deferred until first use
+DEFERRED_IMPORTS = ("langfuse", "openai", "httpx", "numpy", "opentelemetry", "asyncio", "dotenv")
+
+BENCH_QUERIES = [
+    "What is Kubernetes and how does it help with container orchestration?",
+    "How can I implement observability in my microservices architecture?",
+    "What are the key principles of DevOps?",
+    "Explain the benefits and challenges of microservices architecture",
+    "Which tools are used for distributed tracing and logging?",
+]
+
+
+class NoopClient(NoopSpan):
+    """
+    Client whose spans are all NoopSpans: tracing off, including the root span
+    """
+
+    def flush(self):
+        pass
+
+
+def measure(fn: Callable[[int], Any], iterations: int, warmup: int = 3, max_seconds: float = 10.0) -> Dict[str, Any]:
+    """
+    Time fn(i) per call; stops early after max_seconds so large cases stay bounded
+    """
+    for i in range(warmup):
+        fn(i)
+    histogram = LatencyHistogram()
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(i)
+        histogram.record((time.perf_counter() - t0) * 1000)
+        if time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+    result = histogram.summary((50, 90, 99))
+    result["ops_per_sec"] = round(histogram.total / elapsed, 1) if elapsed else 0.0
+    return result
+
+
+def synthetic_corpus(size: int, seed: int = 0) -> List[str]:
+    """
+    Passages drawn from a Zipf-like vocabulary mixed with real knowledge base terms
+    """
+    import rag_demo
+    rng = random.Random(seed)
+    base_words = sorted({w.strip(".,").lower() for docs in rag_demo.KNOWLEDGE_BASE.values() for d in docs for w in d.split()})
+    vocabulary = base_words + [f"term{i}" for i in range(50_000)]
+    # Cumulative weights once, rather than choices() re-accumulating all ~50k weights for every passage
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+    return [" ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(15, 40))) for _ in range(size)]
+
+
+def bench_retrieval(sizes, modes, iterations: int, tracing: Dict[str, Any]) -> List[Dict[str, Any]]:
+    import rag_demo
+    from retrieval import InvertedIndex, open_dense_index
+
+    results = []
+    for size in sizes:
+        corpus = synthetic_corpus(size)
+        for mode in modes:
+            build_start = time.perf_counter()
+            if mode == "dense":
+                if size > 200_000:
+                    continue
+                index = open_dense_index(corpus, f".rag_index/bench_{size}")
+                rag_demo._dense_index = index
+            else:
+                index = InvertedIndex()
+                index.add_many(("synthetic", text) for text in corpus)
+                index.search("warm up")
+                rag_demo._knowledge_index = index
+            build_ms = (time.perf_counter() - build_start) * 1000
+
+            for label, trace in tracing.items():
+                stats = measure(
+                    lambda i: rag_demo.retrieve_relevant_documents(BENCH_QUERIES[i % len(BENCH_QUERIES)], 3, trace, mode),
+                    iterations
+                )
+                results.append({"corpus_size": size, "mode": mode, "tracing": label, "build_ms": round(build_ms, 1), **stats})
+                print(f"  retrieval  size={size:<8} mode={mode:<7} tracing={label:<4} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+            if mode == "dense":
+                index.close()
+
+    rag_demo._knowledge_index = None
+    rag_demo._dense_index = None
+    return results
+
+
+def bench_context_assembly(counts, iterations: int, tracing: Dict[str, Any]) -> List[Dict[str, Any]]:
+    import rag_demo
+
+    results = []
+    corpus = synthetic_corpus(max(counts), seed=1)
+    for count in counts:
+        documents = corpus[:count]
+        for label, trace in tracing.items():
+            stats = measure(lambda i: rag_demo.assemble_context(documents, BENCH_QUERIES[0], trace), iterations)
+            results.append({"documents": count, "tracing": label, **stats})
+            print(f"  context    docs={count:<8} tracing={label:<4} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+    return results
+
+
+def bench_pipeline(iterations: int, tracing_client, noop_client) -> List[Dict[str, Any]]:
+    import rag_demo
+    from contextlib import redirect_stdout
+
+    results = []
+    original = rag_demo.get_langfuse
+    try:
+        for label, client in (("on", tracing_client), ("off", noop_client)):
+            rag_demo.get_langfuse = lambda: client
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                stats = measure(lambda i: rag_demo.rag_pipeline(BENCH_QUERIES[i % len(BENCH_QUERIES)]), iterations)
+            results.append({"tracing": label, **stats})
+            print(f"  pipeline   tracing={label:<4} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+    finally:
+        rag_demo.get_langfuse = original
+    return results
+
+
+def bench_span_overhead(iterations: int, tracing_client) -> List[Dict[str, Any]]:
+    """
+    Caller-side cost of each Langfuse call used by the demos (export happens on a background thread)
+    """
+    from langfuse import Langfuse
+
+    disabled_client = Langfuse(tracing_enabled=False)
+    payload = {"documents": BENCH_QUERIES, "query": BENCH_QUERIES[0]}
+    results = []
+    for label, client in (("on", tracing_client), ("disabled", disabled_client), ("off", NoopClient())):
+        root = client.start_span(name="span_overhead_benchmark")
+        operations = {
+            "start_span+end": lambda i: root.start_span(name="bench_span").end(),
+            "start_observation+end": lambda i: root.start_observation(
+                name="bench_generation", model="gpt-3.5-turbo", input=BENCH_QUERIES[0], as_type="generation").end(),
+            "start_span+update+end": lambda i: root.start_span(name="bench_span", input=payload).update(
+                output=BENCH_QUERIES[1], metadata={"doc_count": 3}).end(),
+        }
+        for operation, fn in operations.items():
+            stats = measure(fn, iterations)
+            results.append({"operation": operation, "tracing": label, **stats})
+            print(f"  span       op={operation:<22} tracing={label:<8} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+        root.end()
+    return results
+
+
+def parse_importtime(stderr: str, module: str) -> Dict[str, Any]:
+    """
+    Cumulative import time of module and its slowest direct imports from -X importtime output
+    """
+    total_us = 0
+    children = []
+    loaded = set()
+    subtree = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative_us, name = line.split("|")
+        if not cumulative_us.strip().isdigit():
+            continue
+        package = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth > 0:
+            subtree.append((depth, int(cumulative_us), package))
+            continue
+        # A top-level line closes the subtree printed just before it
+        if package == module:
+            total_us = int(cumulative_us)
+            children = [(us, child) for child_depth, us, child in subtree if child_depth == 1]
+            loaded = {child.split(".")[0] for _, _, child in subtree}
+        subtree = []
+    children.sort(reverse=True)
+    return {
+        "import_ms": total_us / 1000,
+        "slowest": [{"module": name, "ms": round(us / 1000, 2)} for us, name in children[:5]],
+        "deferred_loaded": sorted(loaded.intersection(DEFERRED_IMPORTS))
+    }
+
+
+def bench_startup(modules, runs: int) -> List[Dict[str, Any]]:
+    """
+    Fresh-interpreter import cost of each demo module, measured with python -X importtime
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in modules:
+        import_ms = LatencyHistogram()
+        process_ms = LatencyHistogram()
+        parsed = {}
+        for _ in range(runs):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                       capture_output=True, text=True, cwd=root)
+            process_ms.record((time.perf_counter() - started) * 1000)
+            if completed.returncode != 0:
+                raise RuntimeError(f"importing {module} failed:\n{completed.stderr[-2000:]}")
+            parsed = parse_importtime(completed.stderr, module)
+            import_ms.record(parsed["import_ms"])
+        p50 = round(import_ms.percentile(50), 2)
+        results.append({
+            "module": module,
+            "p50_ms": p50,
+            "process_p50_ms": round(process_ms.percentile(50), 2),
+            "target_ms": STARTUP_TARGET_MS,
+            "within_target": p50 <= STARTUP_TARGET_MS,
+            "slowest_imports": parsed["slowest"],
+            "deferred_loaded": parsed["deferred_loaded"]
+        })
+        marker = "✅" if p50 <= STARTUP_TARGET_MS and not parsed["deferred_loaded"] else "⚠️ "
+        eager = f" eagerly loads {','.join(parsed['deferred_loaded'])}" if parsed["deferred_loaded"] else ""
+        print(f"{marker} startup    module={module:<17} import p50={p50}ms (target {STARTUP_TARGET_MS}ms) "
+              f"process p50={results[-1]['process_p50_ms']}ms{eager}")
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    """
+    Print p50 ratios against a previous run for every matching case
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(case: Dict[str, Any]) -> tuple:
+        return tuple(sorted((k, v) for k, v in case.items() if isinstance(v, str) or k in ("corpus_size", "documents")))
+
+    print(f"\n📊 Comparison against {baseline_path} (p50, lower is better)")
+    for section, cases in current["results"].items():
+        previous = {key(case): case for case in baseline.get("results", {}).get(section, [])}
+        for case in cases:
+            old = previous.get(key(case))
+            if old and old.get("p50_ms") and case.get("p50_ms") is not None:
+                ratio = case["p50_ms"] / old["p50_ms"]
+                marker = "🔺" if ratio > 1.1 else ("🔻" if ratio < 0.9 else "  ")
+                label = " ".join(f"{k}={v}" for k, v in key(case))
+                print(f"{marker} {section:<16} {label:<60} {old['p50_ms']:>9}ms -> {case['p50_ms']:>9}ms ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for retrieval, context assembly, the RAG pipeline and tracing")
+    parser.add_argument("--quick", action="store_true", help="Small corpora and fewer iterations")
+    parser.add_argument("--sizes", help="Comma-separated corpus sizes (default 10..1M)")
+    parser.add_argument("--modes", default="keyword", help="Retrieval modes to benchmark: keyword,dense")
+    parser.add_argument("--iterations", type=int, default=None)
+    parser.add_argument("--only", help="Comma-separated subset: retrieval,context,pipeline,spans,startup")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    iterations = args.iterations or (50 if args.quick else 500)
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else (QUICK_CORPUS_SIZES if args.quick else CORPUS_SIZES)
+    sections = set(args.only.split(",")) if args.only else {"retrieval", "context", "pipeline", "spans", "startup"}
+
+    # Offline: zero-latency LLM stub and a local trace sink, with the response and retrieval caches out of the way
+    servers = start_mock_servers(OpenAIMockConfig(seed=0, time_scale=0.0))
+    os.environ.update(servers.environment())
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["RETRIEVAL_CACHE_ENABLED"] = "false"
+
+    from clients import get_langfuse, shutdown
+    tracing_client = get_langfuse()
+    tracing = {"on": tracing_client.start_span(name="benchmark"), "off": None}
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "results": {}
+    }
+
+    print("⏱️  Benchmark Suite")
+    print("=" * 50)
+    if "startup" in sections:
+        # First, before this process has warmed the OS file cache for the other sections
+        report["results"]["startup"] = bench_startup(STARTUP_MODULES, 5 if args.quick else 20)
+    try:
+        if "retrieval" in sections:
+            report["results"]["retrieval"] = bench_retrieval(sizes, args.modes.split(","), iterations, tracing)
+        if "context" in sections:
+            counts = [c for c in DOCUMENT_COUNTS if not args.quick or c <= 100]
+            report["results"]["context_assembly"] = bench_context_assembly(counts, iterations, tracing)
+        if "pipeline" in sections:
+            report["results"]["rag_pipeline"] = bench_pipeline(max(10, iterations // 5), tracing_client, NoopClient())
+        if "spans" in sections:
+            report["results"]["span_overhead"] = bench_span_overhead(iterations * 4, tracing_client)
+    finally:
+        tracing["on"].end()
+        shutdown()
+        report["spans_exported"] = servers.langfuse_state.stats["spans"]
+        servers.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Results written to {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Shared Clients
+One lazily created Langfuse client and one OpenAI client per process, over pooled keep-alive HTTP connections.
+
+Nothing is constructed at import time: the first get_langfuse() or
+get_openai() call builds the client from the environment, so importing a
+demo module starts no threads and opens no connections. The langfuse,
+openai and httpx packages are imported on that first call too, which keeps
+them off the startup path. shutdown() flushes pending traces and closes the
+pools of the Langfuse, OpenAI and per-loop AsyncOpenAI clients; it runs at
+most once, either when called explicitly or at interpreter exit.
+"""
+
+import atexit
+import os
+import threading
+from typing import Any, Callable, Dict
+
+_lock = threading.Lock()
+_env_loaded = False
+_langfuse = None
+# Langfuse does not close an httpx client it was handed, so shutdown() does
+_langfuse_http = None
+_openai = None
+_async_openai: Dict[Any, Any] = {}
+_atexit_registered = False
+_shut_down = False
+
+# How long shutdown() waits for an AsyncOpenAI client to close on a loop running in another thread
+ASYNC_CLOSE_TIMEOUT_SECONDS = 5.0
+
+
+def load_env() -> None:
+    """
+    Load a .env file from the working directory or the demo directory, once
+
+    python-dotenv is only imported when such a file exists, so deployments
+    that configure everything through the environment skip it entirely.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    for directory in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+
+
+def http_limits():
+    """
+    Connection pool limits shared by every client, from HTTP_* environment variables
+    """
+    import httpx
+
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+    )
+
+
+def http_timeout():
+    import httpx
+
+    return httpx.Timeout(float(os.getenv("HTTP_TIMEOUT_SECONDS", "60")), connect=5.0)
+
+
+def _register_shutdown() -> None:
+    # Called with _lock held
+    global _atexit_registered
+    if not _atexit_registered:
+        atexit.register(shutdown)
+        _atexit_registered = True
+
+
+def get_langfuse():
+    """
+    The process-wide Langfuse client, created on first use
+    """
+    global _langfuse, _langfuse_http
+    with _lock:
+        if _langfuse is None:
+            import httpx
+            from langfuse import Langfuse
+            from tracing import get_tracer_provider
+
+            # Sampling and payload limits come from tracing.py
+            _langfuse_http = httpx.Client(limits=http_limits(), timeout=http_timeout())
+            _langfuse = Langfuse(
+                public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
+                host=os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com"),
+                tracer_provider=get_tracer_provider(),
+                httpx_client=_langfuse_http
+            )
+            _register_shutdown()
+        return _langfuse
+
+
+def get_openai():
+    """
+    The process-wide OpenAI client, created on first use
+    """
+    global _openai
+    with _lock:
+        if _openai is None:
+            import openai
+
+            # Retries belong to rate_limiter.py, which backs off across callers and traces each attempt
+            _openai = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=openai.DefaultHttpxClient(limits=http_limits(), timeout=http_timeout())
+            )
+            _register_shutdown()
+        return _openai
+
+
+def get_async_openai():
+    """
+    The AsyncOpenAI client for the running event loop
+
+    Async connections belong to the loop that opened them, so there is one
+    client per loop; close_async_openai() releases it before the loop ends.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_openai.get(loop)
+        if client is None:
+            import openai
+
+            client = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(limits=http_limits(), timeout=http_timeout())
+            )
+            _async_openai[loop] = client
+            _register_shutdown()
+        return client
+
+
+async def close_async_openai() -> None:
+    import asyncio
+
+    with _lock:
+        client = _async_openai.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+def _close_async_clients(clients) -> None:
+    """
+    Close AsyncOpenAI clients left open on their own loops; a closed loop already took its connections with it
+    """
+    import asyncio
+
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+    for loop, client in clients:
+        # Closing on the loop that called shutdown() would have to block the loop it needs
+        if loop.is_closed() or loop is current:
+            continue
+        try:
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.close(), loop).result(ASYNC_CLOSE_TIMEOUT_SECONDS)
+            else:
+                loop.run_until_complete(client.close())
+        except Exception as e:
+            print(f"⚠️  Could not close an async OpenAI client: {e}")
+
+
+def prewarm(*hooks: Callable[[], Any]) -> None:
+    """
+    Create the shared clients, then run each hook (e.g. an index build), before the first request arrives
+    """
+    get_langfuse()
+    get_openai()
+    for hook in hooks:
+        hook()
+
+
+def flush() -> None:
+    """
+    Export pending traces without shutting down; a no-op if no Langfuse client was created
+    """
+    with _lock:
+        langfuse = _langfuse
+    if langfuse is not None:
+        langfuse.flush()
+
+
+def shutdown() -> None:
+    """
+    Flush pending traces and close connection pools; later calls do nothing
+    """
+    global _shut_down
+    with _lock:
+        if _shut_down:
+            return
+        _shut_down = True
+        langfuse, langfuse_http, client = _langfuse, _langfuse_http, _openai
+        async_clients = list(_async_openai.items())
+        _async_openai.clear()
+
+    if langfuse is not None:
+        # Langfuse.shutdown() flushes the span exporter and score queues before stopping
+        langfuse.shutdown()
+        # With a span spool the flush only reached local disk; give the shipper a bounded head start
+        from span_spool import shutdown_spool
+        shutdown_spool()
+    if langfuse_http is not None:
+        langfuse_http.close()
+    if client is not None:
+        client.close()
+    _close_async_clients(async_clients)
@@ -0,0 +1,182 @@
+"""
+Single-Flight Request Coalescing
+Concurrent identical chat completions share one upstream call, for threaded and asyncio callers alike.
+
+The first caller for a key becomes the leader and makes the call; callers
+that arrive while it is in flight become followers and receive the leader's
+result (or its exception). If the leader is cancelled or interrupted instead,
+the followers retry and one of them leads the next call. Only the leader's
+generation carries token usage; each follower's generation is tagged with
+the leader's trace and observation IDs instead.
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class FlightAbandoned(Exception):
+    """
+    The leader stopped before producing a result (e.g. its stream was closed early); followers should call upstream themselves
+    """
+
+
+class Flight:
+    """
+    One in-flight upstream call that any number of threads or event loops can wait on
+    """
+
+    def __init__(self, generation=None):
+        self.trace_id = getattr(generation, "trace_id", None)
+        self.observation_id = getattr(generation, "id", None)
+        self.followers = 0
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[Any, Any]] = []
+        self._result = None
+        self._error: Optional[BaseException] = None
+
+    def link(self) -> Dict[str, Any]:
+        """
+        Metadata pointing a follower's generation at the leader's
+        """
+        return {"coalesced": True, "leader_trace_id": self.trace_id, "leader_observation_id": self.observation_id}
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._result, self._error = result, error
+            self._done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._settle, future)
+
+    def _settle(self, future) -> None:
+        if future.done():
+            return
+        if self._error is not None:
+            future.set_exception(self._error)
+        else:
+            future.set_result(self._result)
+
+    def wait(self) -> Any:
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    async def wait_async(self) -> Any:
+        import asyncio
+
+        with self._lock:
+            if not self._done.is_set():
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            else:
+                future = None
+        if future is not None:
+            return await future
+        return self.wait()
+
+
+class SingleFlight:
+    """
+    Registry of in-flight calls keyed by request hash
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str, generation=None) -> Tuple[Flight, bool]:
+        """
+        Return (flight, is_leader); the leader must call finish() exactly once
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+            flight = Flight(generation)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key: str, flight: Flight, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.resolve(result, error)
+
+    def do(self, key: str, fn: Callable[[], Any], generation=None) -> Tuple[Any, Flight, bool]:
+        """
+        Run fn once per concurrent key; returns (result, flight, is_leader)
+        """
+        flight, leader = self.join(key, generation)
+        if not leader:
+            try:
+                return flight.wait(), flight, False
+            except FlightAbandoned:
+                return self.do(key, fn, generation)
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        except BaseException:
+            self.finish(key, flight, error=FlightAbandoned("leader was interrupted"))
+            raise
+        self.finish(key, flight, result)
+        return result, flight, True
+
+    async def ado(self, key: str, fn: Callable[[], Any], generation=None) -> Tuple[Any, Flight, bool]:
+        """
+        Async variant of do(); fn returns an awaitable
+        """
+        flight, leader = self.join(key, generation)
+        if not leader:
+            try:
+                return await flight.wait_async(), flight, False
+            except FlightAbandoned:
+                return await self.ado(key, fn, generation)
+        try:
+            result = await fn()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        except BaseException:
+            # Cancellation, KeyboardInterrupt or GeneratorExit belong to the leader, not to its followers
+            self.finish(key, flight, error=FlightAbandoned("leader was interrupted"))
+            raise
+        self.finish(key, flight, result)
+        return result, flight, True
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.leaders + self.followers
+        return {
+            "upstream_calls": self.leaders,
+            "coalesced": self.followers,
+            "coalesced_rate": round(self.followers / calls, 4) if calls else 0.0,
+            "in_flight": len(self._flights)
+        }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """
+    Process-wide coalescer, or None when LLM_COALESCE_ENABLED=false
+    """
+    global _single_flight
+    if os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "false":
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
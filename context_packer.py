@@ -0,0 +1,159 @@
+"""
+Token-Budget-Aware Context Packer
+Chooses the best subset of ranked documents that fits the model's context window and builds the prompt in one join.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to an estimate
+    tiktoken = None
+
+# Context window sizes in tokens; unknown models use DEFAULT_CONTEXT_WINDOW
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+CONTEXT_HEADER = "Relevant information:\n\n"
+CONTEXT_INSTRUCTION = "Please answer the question based on the provided information. If the information doesn't contain enough details, say so."
+
+# Passages whose word shingles overlap at least this much are treated as duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=8)
+def _encoder(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Token count for text, memoized so repeated passages are only tokenized once
+
+    Uses tiktoken when installed; otherwise estimates from word and
+    punctuation counts, which tracks BPE counts closely for English prose.
+    """
+    encoder = _encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return len(_ESTIMATE_PATTERN.findall(text))
+
+
+def default_token_budget(model: str = "gpt-3.5-turbo", max_tokens: int = 600, reserved: int = 0) -> int:
+    """
+    Prompt tokens available once the completion and any fixed prompt parts are reserved
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(0, window - max_tokens - reserved)
+
+
+def _shingles(text: str, size: int = 3) -> Set[tuple]:
+    words = text.lower().split()
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _is_near_duplicate(shingles: Set[tuple], owners: Dict[tuple, List[int]], sizes: List[int]) -> bool:
+    """
+    Jaccard check against every chosen passage, counting overlaps through a
+    shingle -> passages map so the cost tracks shared shingles, not n^2 pairs
+    """
+    overlap = Counter()
+    for shingle in shingles:
+        for doc in owners.get(shingle, ()):
+            overlap[doc] += 1
+    size = len(shingles)
+    for doc, shared in overlap.items():
+        if shared / (size + sizes[doc] - shared) >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+@dataclass
+class PackedContext:
+    prompt: str
+    documents: List[str]
+    tokens_used: int
+    token_budget: int
+    dropped_duplicates: int = 0
+    dropped_over_budget: int = 0
+    dropped: List[int] = field(default_factory=list)
+
+    @property
+    def dropped_count(self) -> int:
+        return self.dropped_duplicates + self.dropped_over_budget
+
+
+def pack_context(documents: List[str], query: str, token_budget: Optional[int] = None,
+                 model: str = "gpt-3.5-turbo") -> PackedContext:
+    """
+    Pack ranked documents into a prompt without exceeding token_budget
+
+    Documents are taken in rank order, skipping near-duplicates of passages
+    already chosen and any passage that no longer fits, so a long passage
+    does not stop shorter lower-ranked ones from filling the remaining space.
+    """
+    if token_budget is None:
+        token_budget = default_token_budget(model)
+
+    question = f"Question: {query}\n\n"
+    used = count_tokens(CONTEXT_HEADER, model) + count_tokens(question, model) + count_tokens(CONTEXT_INSTRUCTION, model)
+
+    chosen: List[str] = []
+    shingle_owners: Dict[tuple, List[int]] = {}
+    shingle_counts: List[int] = []
+    dropped: List[int] = []
+    duplicates = over_budget = 0
+
+    for rank, doc in enumerate(documents):
+        shingles = _shingles(doc)
+        if _is_near_duplicate(shingles, shingle_owners, shingle_counts):
+            duplicates += 1
+            dropped.append(rank)
+            continue
+
+        # "N. " prefix and the blank line after each passage
+        cost = count_tokens(doc, model) + 3
+        if used + cost > token_budget:
+            over_budget += 1
+            dropped.append(rank)
+            continue
+
+        for shingle in shingles:
+            shingle_owners.setdefault(shingle, []).append(len(chosen))
+        shingle_counts.append(len(shingles))
+        chosen.append(doc)
+        used += cost
+
+    parts = [CONTEXT_HEADER]
+    parts.extend(f"{i}. {doc}\n\n" for i, doc in enumerate(chosen, 1))
+    parts.append(question)
+    parts.append(CONTEXT_INSTRUCTION)
+
+    return PackedContext(
+        prompt="".join(parts),
+        documents=chosen,
+        tokens_used=used,
+        token_budget=token_budget,
+        dropped_duplicates=duplicates,
+        dropped_over_budget=over_budget,
+        dropped=dropped
+    )
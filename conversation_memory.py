@@ -0,0 +1,163 @@
+"""
+Bounded Conversation Memory
+Keeps multi-turn prompts within a token budget using a sliding window, a rolling summary, or both.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+from context_packer import count_tokens
+from llm import chat_completion
+
+POLICIES = ("window", "summary", "hybrid")
+
+SUMMARY_SYSTEM_PROMPT = "You maintain a concise running summary of a conversation. Keep facts, decisions and open questions; drop pleasantries."
+
+# Per-message overhead of the chat format (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo") -> int:
+    return sum(count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def llm_summarize(previous_summary: str, messages: List[Dict[str, str]], trace=None) -> str:
+    """
+    Fold evicted messages into the running summary with a deterministic (cacheable) LLM call
+    """
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = f"Current summary:\n{previous_summary or '(empty)'}\n\nNew messages:\n{transcript}\n\nReturn the updated summary."
+    span = trace.start_observation(name="memory_summarization", model="gpt-3.5-turbo", input=prompt, as_type="generation") if trace else None
+    try:
+        summary = chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            max_tokens=200,
+            generation=span
+        )
+        if span:
+            span.update(output=summary)
+        return summary
+    except Exception as e:
+        if span:
+            span.update(output=f"Summarization error: {str(e)}", level="ERROR")
+        # Keep the old summary; the evicted messages are lost rather than blocking the conversation
+        return previous_summary
+    finally:
+        if span:
+            span.end()
+
+
+class ConversationMemory:
+    """
+    Conversation history bounded by max_history_tokens
+
+    Policies:
+    - "window":  keep the most recent messages that fit; drop older ones
+    - "summary": keep only the last keep_last_turns exchanges verbatim and
+                 fold everything older into a rolling summary
+    - "hybrid":  keep as many recent messages as fit and fold evicted ones
+                 into the rolling summary
+
+    Summaries are updated incrementally on a background thread. Until an
+    update lands, the messages it covers are still sent verbatim, so nothing
+    drops out of the prompt while the summary catches up. The system prompt
+    and summary always lead the message list as a stable prefix, which lets
+    provider-side prompt caching reuse it across turns.
+    """
+
+    def __init__(self, system_prompt: str, policy: str = "hybrid", max_history_tokens: int = 600,
+                 keep_last_turns: int = 1, summarize: Optional[Callable] = None, trace=None,
+                 model: str = "gpt-3.5-turbo"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown memory policy {policy!r}; expected one of {POLICIES}")
+        self.system_prompt = system_prompt
+        self.policy = policy
+        self.max_history_tokens = max_history_tokens
+        self.keep_last_turns = keep_last_turns
+        self.summarize = summarize or llm_summarize
+        self.trace = trace
+        self.model = model
+
+        self.summary = ""
+        self.summarized_messages = 0
+        self._window: List[Dict[str, str]] = []
+        self._pending: List[Dict[str, str]] = []
+        self._full_history: List[Dict[str, str]] = []
+        self._lock = threading.Lock()
+        # concurrent.futures pulls in logging; import it when a memory is created, not at module load
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+
+    def build_messages(self, user_message: str) -> List[Dict[str, str]]:
+        """
+        Messages to send for the next turn: stable prefix, recent history, then the new message
+        """
+        with self._lock:
+            messages = [{"role": "system", "content": self.system_prompt}]
+            if self.summary:
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+            messages.extend(self._pending)
+            messages.extend(self._window)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def naive_messages(self, user_message: str) -> List[Dict[str, str]]:
+        """
+        What an unbounded history would send, for measuring savings
+        """
+        return ([{"role": "system", "content": self.system_prompt}] + self._full_history +
+                [{"role": "user", "content": user_message}])
+
+    def turn_stats(self, messages: List[Dict[str, str]], user_message: str) -> Dict[str, int]:
+        prompt_tokens = message_tokens(messages, self.model)
+        naive_tokens = message_tokens(self.naive_messages(user_message), self.model)
+        return {
+            "memory_policy": self.policy,
+            "prompt_tokens": prompt_tokens,
+            "naive_prompt_tokens": naive_tokens,
+            "prompt_tokens_saved": naive_tokens - prompt_tokens,
+            "summarized_messages": self.summarized_messages
+        }
+
+    def add_turn(self, user_message: str, assistant_message: str) -> None:
+        """
+        Record a completed exchange and evict older messages according to the policy
+        """
+        turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+        self._full_history.extend(turn)
+
+        with self._lock:
+            self._window.extend(turn)
+            evicted = []
+            if self.policy == "summary":
+                keep = 2 * self.keep_last_turns
+                if len(self._window) > keep:
+                    evicted = self._window[:len(self._window) - keep]
+                    self._window = self._window[len(self._window) - keep:]
+            else:
+                # Evict whole exchanges from the front until the window fits
+                while len(self._window) > 2 and message_tokens(self._window, self.model) > self.max_history_tokens:
+                    evicted.extend(self._window[:2])
+                    self._window = self._window[2:]
+
+            if evicted and self.policy != "window":
+                self._pending.extend(evicted)
+                self._executor.submit(self._fold, evicted)
+
+    def _fold(self, evicted: List[Dict[str, str]]) -> None:
+        summary = self.summarize(self.summary, evicted, self.trace)
+        with self._lock:
+            self.summary = summary
+            self.summarized_messages += len(evicted)
+            self._pending = self._pending[len(evicted):]
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop the summarizer; with wait, let queued summaries finish first
+        """
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,305 @@
+"""
+Embedding Service
+Batches, dedupes and caches embeddings in front of any embedder, in memory and in a memory-mapped float16 file.
+
+Texts are keyed by the SHA-256 of the embedder name, dimension and text, so
+a passage or query is embedded once no matter how often it is indexed or
+asked. The disk tier appends (key, float16 vector) records to
+<dir>/<embedder>-<dim>.f16 and reads them back through a memory map, so
+worker processes share both the file and the page cache. Misses from
+concurrent callers are collected for up to EMBEDDING_BATCH_WAIT_MS, or until
+EMBEDDING_BATCH_SIZE texts are waiting, and embedded in one call.
+
+The service has the embedder interface (name, dim, embed()), so it can be
+passed anywhere an embedder is expected, e.g. retrieval.open_dense_index().
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+KEY_BYTES = 32
+
+
+class EmbeddingCache:
+    """
+    Content-hash keyed float16 vectors: an LRU dict in memory over an append-only memory-mapped file
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, max_memory_entries: int = 10000):
+        self.dim = dim
+        self.path = f"{path}.f16" if path else None
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        # One record per vector, key first, so a single append write keeps both in step across processes
+        self.record = np.dtype([("key", f"V{KEY_BYTES}"), ("vector", "<f2", (dim,))])
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._rows: Dict[bytes, int] = {}
+        self._records = None
+        self._file = None
+        self._lock = threading.Lock()
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "ab", buffering=0)
+        size = os.path.getsize(self.path)
+        rows = size // self.record.itemsize
+        if size % self.record.itemsize:
+            # A torn record from a crash mid-append; drop it so later rows stay aligned
+            os.truncate(self.path, rows * self.record.itemsize)
+        if rows:
+            keys = np.memmap(self.path, dtype=self.record, mode="r", shape=(rows,))["key"]
+            self._rows = {bytes(key): row for row, key in enumerate(keys)}
+
+    def _disk_row(self, row: int) -> np.ndarray:
+        # Remap only when the file has grown past the current map
+        if self._records is None or row >= self._records.shape[0]:
+            rows = os.path.getsize(self.path) // self.record.itemsize
+            self._records = np.memmap(self.path, dtype=self.record, mode="r", shape=(rows,))
+        return np.array(self._records[row]["vector"])
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            row = self._rows.get(key)
+            if row is not None:
+                vector = self._disk_row(row)
+                self._remember(key, vector)
+                self.hits += 1
+                return vector
+            self.misses += 1
+            return None
+
+    def put(self, items: List[Tuple[bytes, np.ndarray]]) -> None:
+        with self._lock:
+            new = []
+            for key, vector in items:
+                vector = vector.astype(np.float16)
+                self._remember(key, vector)
+                if key not in self._rows:
+                    new.append((key, vector))
+            if self._file is None or not new:
+                return
+            records = np.zeros(len(new), dtype=self.record)
+            for i, (key, vector) in enumerate(new):
+                records[i]["key"] = key
+                records[i]["vector"] = vector
+            # One unbuffered O_APPEND write: the offset afterwards is the end of these records, wherever other writers are
+            self._file.write(records.tobytes())
+            first = self._file.tell() // self.record.itemsize - len(new)
+            for i, (key, _) in enumerate(new):
+                self._rows[key] = first + i
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._rows)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self._records = None
+
+
+class _Pending:
+    """
+    Texts one caller is waiting on, filled in by the batcher thread
+    """
+
+    def __init__(self, items: List[Tuple[bytes, str]]):
+        self.items = items
+        self.vectors: Dict[bytes, np.ndarray] = {}
+        self.batch_sizes: List[int] = []
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class EmbeddingService:
+    """
+    Cache-first embedder that dedupes each request and batches misses across callers
+    """
+
+    def __init__(self, embedder, cache: EmbeddingCache = None, max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.embedder = embedder
+        self.name = embedder.name
+        self.dim = embedder.dim
+        self.cache = cache or EmbeddingCache(embedder.dim)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.embedded = 0
+        self._queue: List[_Pending] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.name}:{self.dim}\0{text}".encode("utf-8")).digest()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embed_with_stats(texts)[0]
+
+    def embed_with_stats(self, texts: Sequence[str]) -> Tuple[np.ndarray, Dict[str, object]]:
+        """
+        Embed texts as float32 rows; the stats give cache hits and misses and the sizes of the batches the misses went into
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        found: Dict[bytes, np.ndarray] = {}
+        missing: Dict[bytes, str] = {}
+        keys = [self.key(text) for text in texts]
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+
+        batch_sizes: List[int] = []
+        if missing:
+            items = list(missing.items())
+            if len(items) >= self.max_batch:
+                # Bulk requests (index builds) fill batches on their own; waiting would only add latency
+                for start in range(0, len(items), self.max_batch):
+                    chunk = items[start:start + self.max_batch]
+                    found.update(self._embed_batch(chunk))
+                    batch_sizes.append(len(chunk))
+            else:
+                pending = self._submit(items)
+                found.update(pending.vectors)
+                batch_sizes = pending.batch_sizes
+
+        for row, key in enumerate(keys):
+            vectors[row] = found[key]
+        stats = {
+            "texts": len(texts),
+            "unique": len(found),
+            "hits": len(found) - len(missing),
+            "misses": len(missing),
+            "batch_sizes": batch_sizes
+        }
+        return vectors, stats
+
+    def _embed_batch(self, items: List[Tuple[bytes, str]]) -> Dict[bytes, np.ndarray]:
+        """
+        Embed one batch and cache it; vectors come back float16-rounded, exactly as a later cache hit returns them
+        """
+        result = self.embedder.embed([text for _, text in items])
+        self.batches += 1
+        self.embedded += len(items)
+        vectors = {key: vector.astype(np.float16) for (key, _), vector in zip(items, result)}
+        self.cache.put(list(vectors.items()))
+        return vectors
+
+    def _submit(self, items: List[Tuple[bytes, str]]) -> _Pending:
+        pending = _Pending(items)
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._queue.append(pending)
+            self._condition.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                # Hold the first request up to max_wait for others to join its batch
+                deadline = time.monotonic() + self.max_wait
+                while sum(len(p.items) for p in self._queue) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                requests, self._queue = self._queue, []
+
+            # Callers deduped their own texts; dedupe across callers too
+            unique: Dict[bytes, str] = {}
+            for pending in requests:
+                unique.update(pending.items)
+            items = list(unique.items())
+            try:
+                vectors: Dict[bytes, np.ndarray] = {}
+                sizes = []
+                for start in range(0, len(items), self.max_batch):
+                    chunk = items[start:start + self.max_batch]
+                    vectors.update(self._embed_batch(chunk))
+                    sizes.append(len(chunk))
+                for pending in requests:
+                    pending.vectors = {key: vectors[key] for key, _ in pending.items}
+                    pending.batch_sizes = sizes
+            except BaseException as e:
+                for pending in requests:
+                    pending.error = e
+            for pending in requests:
+                pending.done.set()
+
+    def stats(self) -> Dict[str, object]:
+        stats = self.cache.stats()
+        stats.update({
+            "batches": self.batches,
+            "embedded": self.embedded,
+            "mean_batch_size": round(self.embedded / self.batches, 2) if self.batches else 0.0
+        })
+        return stats
+
+
+_services: Dict[Tuple[str, int], EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(embedder=None) -> EmbeddingService:
+    """
+    Process-wide service for an embedder (default: the local hashing embedder), configured from EMBEDDING_* variables
+    """
+    if embedder is None:
+        from retrieval import HashingEmbedder
+        embedder = HashingEmbedder()
+    with _services_lock:
+        service = _services.get((embedder.name, embedder.dim))
+        if service is None:
+            directory = os.getenv("EMBEDDING_CACHE_DIR", ".rag_index/embeddings")
+            cache = EmbeddingCache(
+                embedder.dim,
+                path=os.path.join(directory, f"{embedder.name}-{embedder.dim}") if directory else None,
+                max_memory_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+            )
+            service = _services[(embedder.name, embedder.dim)] = EmbeddingService(
+                embedder,
+                cache,
+                max_batch=int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+                max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+            )
+        return service
@@ -0,0 +1,282 @@
+"""
+Hedged LLM Requests
+Opt-in duplicate requests that cut tail latency: a second attempt starts when the first is slower than the recent p95, and the loser is cancelled.
+
+Attempts race as asyncio tasks, so the loser is really cancelled and its
+HTTP request closed. Async callers race on their own event loop; sync
+callers race on a background loop owned by the hedger, through that loop's
+AsyncOpenAI client. A non-streamed request is hedged when no response
+arrives within the threshold, a streamed one when no first token does. The
+threshold is LLM_HEDGE_PERCENTILE of the last LLM_HEDGE_WINDOW latencies per
+model, each timed from the primary's start so a hedged request still counts
+as at least as slow as its primary had been, or LLM_HEDGE_INITIAL_DELAY_MS until LLM_HEDGE_MIN_SAMPLES have been
+seen. Hedges are capped at LLM_HEDGE_BUDGET times the number of requests and
+are skipped while the rate limiter has no free concurrency.
+
+Each attempt is an llm_request span under the caller's generation, with its
+role (primary or hedge) and outcome (won, cancelled or failed); the
+generation gets hedged, hedge_delay_ms and hedge_winner metadata.
+"""
+
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+
+class Hedger:
+    """
+    Adaptive hedging thresholds, the hedge budget, and the race between attempts
+    """
+
+    def __init__(self, percentile: float = 95.0, initial_delay_ms: float = 3000, min_delay_ms: float = 50,
+                 budget: float = 0.1, window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.initial_delay = initial_delay_ms / 1000
+        self.min_delay = min_delay_ms / 1000
+        self.budget = budget
+        self.window = window
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    @classmethod
+    def from_env(cls) -> "Hedger":
+        return cls(
+            percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+            initial_delay_ms=float(os.getenv("LLM_HEDGE_INITIAL_DELAY_MS", "3000")),
+            min_delay_ms=float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", "50")),
+            budget=float(os.getenv("LLM_HEDGE_BUDGET", "0.1")),
+            window=int(os.getenv("LLM_HEDGE_WINDOW", "200")),
+            min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        )
+
+    def delay(self, model: str, kind: str) -> float:
+        """
+        Seconds to wait for a response ("response") or first token ("first_token") before hedging
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get((model, kind), ()))
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        rank = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay, samples[rank])
+
+    def observe(self, model: str, kind: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._latencies.get((model, kind))
+            if samples is None:
+                samples = self._latencies[(model, kind)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def _admit(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def _allow_hedge(self) -> bool:
+        from rate_limiter import get_scheduler
+
+        concurrency = get_scheduler().concurrency
+        if concurrency.in_flight >= int(concurrency.limit):
+            # A hedge would only queue behind the calls it is meant to overtake
+            return False
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    @staticmethod
+    def _attempt_observation(generation, role: str, delay: float):
+        if not generation:
+            return None
+        return generation.start_observation(name="llm_request", as_type="span", metadata={
+            "hedge_role": role,
+            "hedge_delay_ms": round(delay * 1000, 1)
+        })
+
+    async def arace(self, model: str, kind: str, attempt: Callable[[Any], Awaitable[Any]], generation=None,
+                    discard: Callable[[Any], Any] = None) -> Any:
+        """
+        Run attempt(observation), starting a second one if the first is slower than the threshold; return the first success
+
+        A loser that is still running is cancelled; one that finished
+        successfully anyway is handed to discard. The first error is raised
+        only when every attempt failed.
+        """
+        import asyncio
+
+        self._admit()
+        delay = self.delay(model, kind)
+        tasks: Dict[Any, Tuple[str, Any]] = {}
+
+        def start(role: str) -> None:
+            observation = self._attempt_observation(generation, role, delay)
+            tasks[asyncio.ensure_future(attempt(observation))] = (role, observation)
+
+        started = time.perf_counter()
+        start("primary")
+        winner = None
+        error = None
+        try:
+            done, pending = await asyncio.wait(set(tasks), timeout=delay)
+            if not done and self._allow_hedge():
+                start("hedge")
+                pending = set(tasks)
+            while True:
+                for task in done:
+                    role, observation = tasks[task]
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        if observation:
+                            observation.update(level="ERROR", status_message=str(task.exception()),
+                                               metadata={"hedge_outcome": "failed"})
+                    elif winner is None:
+                        winner = task
+                        # Timed from the primary's start: when the hedge wins, this is a lower bound on the
+                        # cancelled primary's latency, so slow primaries still pull the threshold up
+                        self.observe(model, kind, time.perf_counter() - started)
+                        if observation:
+                            observation.update(metadata={"hedge_outcome": "won"})
+                    elif discard is not None:
+                        # Both finished in the same tick; the second result is not used
+                        result = discard(task.result())
+                        if inspect.isawaitable(result):
+                            await result
+                if winner is not None or not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            losers = [task for task in tasks if task is not winner and not task.done()]
+            for task in losers:
+                task.cancel()
+                observation = tasks[task][1]
+                if observation:
+                    observation.update(metadata={"hedge_outcome": "cancelled"})
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+            for _, observation in tasks.values():
+                if observation:
+                    observation.end()
+
+        hedged = len(tasks) > 1
+        if generation:
+            generation.update(metadata={
+                "hedged": hedged,
+                "hedge_delay_ms": round(delay * 1000, 1),
+                "hedge_winner": tasks[winner][0] if winner is not None else None
+            })
+        if winner is None:
+            raise error
+        if hedged and tasks[winner][0] == "hedge":
+            with self._lock:
+                self.hedge_wins += 1
+        return winner.result()
+
+    # Sync callers
+
+    def _event_loop(self):
+        import asyncio
+
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-hedging", daemon=True).start()
+            return self._loop
+
+    def race(self, model: str, kind: str, attempt: Callable[[Any], Awaitable[Any]], generation=None,
+             discard: Callable[[Any], Any] = None) -> Any:
+        """
+        Blocking arace() on the hedger's own event loop; attempt must use that loop's clients
+        """
+        import asyncio
+
+        future = asyncio.run_coroutine_threadsafe(self.arace(model, kind, attempt, generation, discard),
+                                                  self._event_loop())
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stream(self, model: str, open_attempt: Callable[[Any], AsyncIterator[Any]], generation=None) -> Iterator[Any]:
+        """
+        Race streamed attempts to their first item, then yield the winner's items to a sync consumer
+
+        open_attempt(observation) returns an async iterator that yields
+        nothing until the response has real content. Closing this iterator
+        early closes the winning stream.
+        """
+        import asyncio
+        import queue
+
+        items: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+        async def first_item(observation):
+            iterator = open_attempt(observation)
+            try:
+                return iterator, await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, None
+            except BaseException:
+                await iterator.aclose()
+                raise
+
+        async def pump():
+            iterator = None
+            try:
+                iterator, first = await self.arace(model, "first_token", first_item, generation,
+                                                   discard=lambda result: result[0].aclose())
+                if first is not None:
+                    items.put(("item", first))
+                    async for item in iterator:
+                        items.put(("item", item))
+                items.put(("end", None))
+            except BaseException as e:
+                items.put(("error", e))
+            finally:
+                if iterator is not None:
+                    await iterator.aclose()
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._event_loop())
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins
+        }
+
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Optional[Hedger]:
+    """
+    Process-wide hedger, or None unless LLM_HEDGE_ENABLED=true
+    """
+    global _hedger
+    if os.getenv("LLM_HEDGE_ENABLED", "false").lower() != "true":
+        return None
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger.from_env()
+        return _hedger
@@ -0,0 +1,95 @@
+"""
+HDR-Style Latency Histogram
+Log-linear buckets with bounded relative error, cheap to record into and to merge.
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in milliseconds with fixed relative precision
+
+    Values are bucketed in microseconds: each power-of-two range is split
+    into 2**(sub_bucket_bits - 1) linear sub-buckets, so a recorded value is
+    off by at most 1 / 2**(sub_bucket_bits - 1) (under 1% with the default
+    of 8 bits) no matter how large it is. Memory is a dict of non-empty
+    buckets.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum_ms = 0.0
+        self.min_ms = math.inf
+        self.max_ms = 0.0
+
+    def _index(self, micros: int) -> int:
+        if micros < self.sub_bucket_count:
+            return micros
+        exponent = micros.bit_length() - self.sub_bucket_bits
+        return (exponent << self.sub_bucket_bits) + (micros >> exponent)
+
+    def _value(self, index: int) -> float:
+        """
+        Upper edge of a bucket, in milliseconds
+        """
+        exponent, sub = divmod(index, self.sub_bucket_count)
+        if exponent == 0:
+            return (index + 1) / 1000
+        return ((sub + 1) << exponent) / 1000
+
+    def record(self, value_ms: float, count: int = 1) -> None:
+        index = self._index(max(0, int(value_ms * 1000)))
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.sum_ms += value_ms * count
+        self.min_ms = min(self.min_ms, value_ms)
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("Cannot merge histograms with different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_ms += other.sum_ms
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Value at percentile p (0-100), or None if nothing was recorded
+        """
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._value(index), self.max_ms)
+        return self.max_ms
+
+    def cumulative(self, bounds_ms: Iterable[float]) -> List[int]:
+        """
+        Count of values at or below each bound, for Prometheus-style buckets
+        """
+        ordered = sorted(self.counts.items())
+        result = []
+        for bound in bounds_ms:
+            result.append(sum(count for index, count in ordered if self._value(index) <= bound))
+        return result
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 99, 99.9)) -> Dict[str, float]:
+        summary = {"count": self.total}
+        if self.total:
+            summary["mean_ms"] = round(self.sum_ms / self.total, 2)
+            summary["min_ms"] = round(self.min_ms, 2)
+            summary["max_ms"] = round(self.max_ms, 2)
+            for p in percentiles:
+                summary[f"p{p:g}_ms"] = round(self.percentile(p), 2)
+        return summary
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Streaming Knowledge Base Ingestion
+Streams text, Markdown and JSONL files through a chunker into a segmented BM25 index, re-indexing only changed passages.
+
+Files are read line by line and pass through generators (parse, normalize,
+chunk), so only one segment's worth of passages is ever held in memory.
+Every passage is keyed by the SHA-256 of its topic and normalized text. A
+SQLite manifest records where each key lives, so re-ingesting a source skips
+unchanged passages, indexes new ones, and tombstones passages that
+disappeared from it. New passages are cut into segments that worker
+processes build and write to disk. A background thread merges small
+segments and swaps the merged index in, so queries never wait on ingestion
+or merging.
+
+Usage:
+    python ingest.py docs/ faq.jsonl --index-dir .rag_index/segments --workers 4
+    python ingest.py --stats --index-dir .rag_index/segments
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import deque
+from itertools import islice
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+TEXT_EXTENSIONS = (".txt", ".md")
+LOOKUP_WINDOW = 1000
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+class Passage(NamedTuple):
+    source: str
+    topic: str
+    text: str
+    key: str
+
+
+def iter_documents(paths: Iterable[str], sources: Optional[Set[str]] = None) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yield (source, topic, text) from files or directories, reading each file as a stream
+
+    JSONL lines are {"topic": ..., "text": ...} or {"topic": ..., "passages": [...]};
+    text and Markdown files yield one document per blank-line separated
+    paragraph, with the file name as topic. Every file opened is added to
+    sources, including files that yield nothing.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path) for name in names
+                if name.endswith(TEXT_EXTENSIONS + (".jsonl",))
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            source = os.path.abspath(file_path)
+            default_topic = os.path.splitext(os.path.basename(file_path))[0]
+            with open(file_path, encoding="utf-8") as f:
+                if sources is not None:
+                    sources.add(source)
+                if file_path.endswith(".jsonl"):
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        topic = record.get("topic") or default_topic
+                        for text in record.get("passages") or [record.get("text", "")]:
+                            yield source, topic, text
+                else:
+                    paragraph = []
+                    for line in f:
+                        if line.strip():
+                            paragraph.append(line)
+                        elif paragraph:
+                            yield source, default_topic, "".join(paragraph)
+                            paragraph = []
+                    if paragraph:
+                        yield source, default_topic, "".join(paragraph)
+
+
+def normalize(text: str) -> str:
+    """
+    NFKC-normalize and collapse whitespace, so formatting-only edits keep a passage's hash
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def chunk(text: str, max_words: int = 120) -> Iterator[str]:
+    """
+    Split text into passages of whole sentences, up to max_words each
+
+    A single sentence longer than max_words is cut at word boundaries.
+    """
+    words_in_chunk = 0
+    sentences: List[str] = []
+    for sentence in SENTENCE_PATTERN.split(text):
+        words = sentence.split()
+        if not words:
+            continue
+        if len(words) > max_words:
+            if sentences:
+                yield " ".join(sentences)
+                sentences, words_in_chunk = [], 0
+            for start in range(0, len(words), max_words):
+                yield " ".join(words[start:start + max_words])
+            continue
+        if words_in_chunk + len(words) > max_words and sentences:
+            yield " ".join(sentences)
+            sentences, words_in_chunk = [], 0
+        sentences.append(sentence)
+        words_in_chunk += len(words)
+    if sentences:
+        yield " ".join(sentences)
+
+
+def passage_key(topic: str, text: str) -> str:
+    return hashlib.sha256(f"{topic}\0{text}".encode("utf-8")).hexdigest()
+
+
+def iter_passages(paths: Iterable[str], max_words: int = 120, sources: Optional[Set[str]] = None) -> Iterator[Passage]:
+    for source, topic, text in iter_documents(paths, sources):
+        for piece in chunk(normalize(text), max_words):
+            yield Passage(source, topic, piece, passage_key(topic, piece))
+
+
+def build_segment(path: str, passages: List[Tuple[str, str]]) -> int:
+    """
+    Worker-process entry point: index (topic, text) pairs and write the segment to path
+    """
+    from retrieval import InvertedIndex, save_index
+
+    index = InvertedIndex()
+    index.add_many(passages)
+    save_index(index, path)
+    return len(passages)
+
+
+class IndexStore:
+    """
+    Segment files plus a SQLite manifest in one directory, and the live SegmentedIndex built from them
+
+    current() returns the live index without blocking; ingest() and the
+    background merge publish a new SegmentedIndex by swapping one reference,
+    so a search in progress keeps using the snapshot it started with.
+    """
+
+    def __init__(self, directory: str, max_segments: int = 8, max_merge_documents: int = 200000,
+                 refresh_seconds: float = 5.0):
+        self.directory = directory
+        self.max_segments = max_segments
+        self.max_merge_documents = max_merge_documents
+        self.refresh_seconds = refresh_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._index = None
+        self._segments: Dict[str, object] = {}
+        self._merge_lock = threading.Lock()
+        self._jobs_lock = threading.Lock()
+        self._checked = 0.0
+        self._background: Dict[str, threading.Thread] = {}
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY, documents INTEGER)")
+            # Live passages only; a deleted passage leaves a tombstone for its (segment, doc) slot
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS passages (key TEXT PRIMARY KEY, segment TEXT, doc INTEGER, source TEXT, run INTEGER)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS tombstones (segment TEXT, doc INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS passages_source ON passages (source, run)")
+            db.execute("CREATE INDEX IF NOT EXISTS passages_segment ON passages (segment, doc)")
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0), ('next_segment', 0), ('run', 0)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        A manifest connection that commits on success, rolls back on error and is always closed
+        """
+        db = sqlite3.connect(os.path.join(self.directory, "manifest.sqlite"), timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.idx")
+
+    @staticmethod
+    def _meta(db: sqlite3.Connection, name: str) -> int:
+        return db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
+
+    def version(self) -> int:
+        with self._connect() as db:
+            return self._meta(db, "version")
+
+    # Serving
+
+    def current(self):
+        """
+        The live SegmentedIndex; loads it on first use and picks up other processes' commits in the background
+        """
+        if self._index is None:
+            self.reload()
+        elif time.monotonic() - self._checked > self.refresh_seconds:
+            self._checked = time.monotonic()
+            if self.version() != self._index.version:
+                self._in_background("reload", self.reload)
+        return self._index
+
+    def reload(self) -> None:
+        """
+        Build a SegmentedIndex from the manifest, reusing segments already in memory
+        """
+        from retrieval import SegmentedIndex, load_index
+
+        with self._reload_lock:
+            with self._connect() as db:
+                version = self._meta(db, "version")
+                names = [row[0] for row in db.execute("SELECT name FROM segments ORDER BY name")]
+                deleted = db.execute("SELECT segment, doc FROM tombstones").fetchall()
+            segments = {name: self._segments.get(name) or load_index(self._segment_path(name)) for name in names}
+            for name, doc in deleted:
+                if name in segments and not segments[name].is_deleted(doc):
+                    segments[name].delete(doc)
+            self._segments = segments
+            self._index = SegmentedIndex([segments[name] for name in names], version)
+            self._checked = time.monotonic()
+
+    def _in_background(self, job: str, target) -> None:
+        # At most one thread per job; a request while it runs is covered by the running one
+        with self._jobs_lock:
+            thread = self._background.get(job)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=target, name=f"index-{job}", daemon=True)
+            self._background[job] = thread
+            thread.start()
+
+    def wait(self) -> None:
+        """
+        Wait for background reloads and merges to finish
+        """
+        for thread in list(self._background.values()):
+            thread.join()
+
+    # Ingestion
+
+    def ingest(self, paths: Iterable[str], workers: int = None, segment_size: int = 5000, max_words: int = 120,
+               merge: bool = True) -> Dict[str, int]:
+        """
+        Stream passages from paths into new segments; returns counts of added, unchanged and deleted passages
+
+        At most 2 * workers segments are queued for the pool at a time, which
+        bounds memory to about that many segments' worth of passages.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+        counts = {"added": 0, "unchanged": 0, "deleted": 0, "segments": 0}
+        built: List[str] = []
+        with self._write_lock, self._connect() as db:
+            run = self._meta(db, "run") + 1
+            next_segment = self._meta(db, "next_segment")
+            sources = set()
+            pending = deque()
+            batch: List[Tuple[str, str]] = []
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+            def submit() -> None:
+                nonlocal batch, next_segment
+                name = f"seg-{next_segment:06d}"
+                next_segment += 1
+                built.append(name)
+                pending.append((name, len(batch), pool.submit(build_segment, self._segment_path(name), batch)))
+                batch = []
+                while len(pending) >= 2 * workers:
+                    collect()
+
+            def collect() -> None:
+                name, documents, future = pending.popleft()
+                future.result()
+                db.execute("INSERT INTO segments VALUES (?, ?)", (name, documents))
+                counts["segments"] += 1
+
+            try:
+                # An emptied file yields no passages but is still a source whose old passages must go
+                passages = iter_passages(paths, max_words, sources)
+                while True:
+                    # Look keys up a window at a time rather than one query per passage
+                    window = list(islice(passages, LOOKUP_WINDOW))
+                    if not window:
+                        break
+                    keys = [passage.key for passage in window]
+                    seen_runs = dict(db.execute(
+                        f"SELECT key, run FROM passages WHERE key IN ({','.join('?' * len(keys))})", keys
+                    ))
+                    unchanged, added = [], []
+                    for passage in window:
+                        seen_run = seen_runs.get(passage.key)
+                        if seen_run is not None:
+                            if seen_run != run:
+                                unchanged.append((run, passage.source, passage.key))
+                                seen_runs[passage.key] = run
+                            continue
+                        seen_runs[passage.key] = run
+                        added.append((passage.key, f"seg-{next_segment:06d}", len(batch), passage.source, run))
+                        batch.append((passage.topic, passage.text))
+                        if len(batch) >= segment_size:
+                            submit()
+                    db.executemany("UPDATE passages SET run = ?, source = ? WHERE key = ?", unchanged)
+                    db.executemany("INSERT INTO passages VALUES (?, ?, ?, ?, ?)", added)
+                    counts["unchanged"] += len(unchanged)
+                    counts["added"] += len(added)
+                if batch:
+                    submit()
+                while pending:
+                    collect()
+            except BaseException:
+                for _, _, future in pending:
+                    future.cancel()
+                pool.shutdown(wait=True)
+                for name in built:
+                    if os.path.exists(self._segment_path(name)):
+                        os.remove(self._segment_path(name))
+                raise
+            pool.shutdown(wait=True)
+
+            # Passages a re-ingested source no longer contains
+            for source in sources:
+                db.execute("INSERT INTO tombstones SELECT segment, doc FROM passages WHERE source = ? AND run != ?",
+                           (source, run))
+                counts["deleted"] += db.execute("DELETE FROM passages WHERE source = ? AND run != ?",
+                                                (source, run)).rowcount
+            db.execute("UPDATE meta SET value = ? WHERE name = 'run'", (run,))
+            db.execute("UPDATE meta SET value = ? WHERE name = 'next_segment'", (next_segment,))
+            if counts["added"] or counts["deleted"]:
+                db.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+
+        if self._index is not None:
+            self.reload()
+        if merge:
+            self._in_background("merge", self.merge_all)
+        counts["version"] = self.version()
+        return counts
+
+    # Merging
+
+    def _merge_candidates(self, db: sqlite3.Connection) -> List[str]:
+        """
+        The smallest segments, enough to bring the count back to max_segments, within max_merge_documents
+        """
+        rows = db.execute("SELECT name, documents FROM segments ORDER BY documents, name").fetchall()
+        if len(rows) <= self.max_segments:
+            return []
+        chosen, documents = [], 0
+        for name, size in rows[:len(rows) - self.max_segments + 1]:
+            if chosen and documents + size > self.max_merge_documents:
+                break
+            chosen.append(name)
+            documents += size
+        return chosen if len(chosen) > 1 else []
+
+    def merge(self) -> Optional[str]:
+        """
+        Merge the smallest segments into one, dropping deleted passages; returns the new segment's name
+
+        The merged segment is built without holding the write lock, so
+        ingestion carries on meanwhile. Passages deleted while it was being
+        built are tombstoned in it before the swap.
+        """
+        from retrieval import load_index, merge_indexes, save_index
+
+        with self._merge_lock:
+            with self._connect() as db:
+                names = self._merge_candidates(db)
+                if not names:
+                    return None
+                placeholders = ",".join("?" * len(names))
+                live = db.execute(
+                    f"SELECT key, segment, doc FROM passages WHERE segment IN ({placeholders}) ORDER BY segment, doc",
+                    names
+                ).fetchall()
+
+            # Live docs per segment, in (segment, doc) order, so the merged doc ids follow the same order
+            docs_by_segment: Dict[str, List[int]] = {}
+            for _, name, doc in live:
+                docs_by_segment.setdefault(name, []).append(doc)
+            merged = merge_indexes([
+                (self._segments.get(name) or load_index(self._segment_path(name)), docs)
+                for name, docs in docs_by_segment.items()
+            ])
+
+            with self._write_lock, self._connect() as db:
+                next_segment = self._meta(db, "next_segment")
+                target = f"seg-{next_segment:06d}"
+                still_live = set(db.execute(
+                    f"SELECT key, segment, doc FROM passages WHERE segment IN ({placeholders})", names
+                ))
+                updates, tombstones = [], []
+                for new_doc, row in enumerate(live):
+                    if row in still_live:
+                        updates.append((target, new_doc, row[0]))
+                    else:
+                        # Deleted, or deleted and re-added elsewhere, while merging
+                        merged.delete(new_doc)
+                        tombstones.append((target, new_doc))
+                db.executemany("UPDATE passages SET segment = ?, doc = ? WHERE key = ?", updates)
+                db.executemany("INSERT INTO tombstones VALUES (?, ?)", tombstones)
+                save_index(merged, self._segment_path(target))
+                db.execute(f"DELETE FROM segments WHERE name IN ({placeholders})", names)
+                db.execute(f"DELETE FROM tombstones WHERE segment IN ({placeholders})", names)
+                db.execute("INSERT INTO segments VALUES (?, ?)", (target, len(merged)))
+                db.execute("UPDATE meta SET value = ? WHERE name = 'next_segment'", (next_segment + 1,))
+                db.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+
+            if self._index is not None:
+                self.reload()
+            for name in names:
+                os.remove(self._segment_path(name))
+            return target
+
+    def merge_all(self) -> int:
+        """
+        Merge until at most max_segments remain; returns the number of merges
+        """
+        merges = 0
+        while self.merge():
+            merges += 1
+        return merges
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as db:
+            segments, documents = db.execute("SELECT COUNT(*), COALESCE(SUM(documents), 0) FROM segments").fetchone()
+            live = db.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+            deleted = db.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+            return {"version": self._meta(db, "version"), "segments": segments, "documents": documents,
+                    "live_passages": live, "deleted_passages": deleted}
+
+
+_stores: Dict[str, IndexStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_index_store(directory: str) -> IndexStore:
+    """
+    One IndexStore per directory per process
+    """
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = IndexStore(
+                directory,
+                max_segments=int(os.getenv("RAG_INDEX_MAX_SEGMENTS", "8")),
+                refresh_seconds=float(os.getenv("RAG_INDEX_REFRESH_SECONDS", "5"))
+            )
+        return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest text, Markdown and JSONL files into the RAG index")
+    parser.add_argument("paths", nargs="*", help="Files or directories to ingest")
+    parser.add_argument("--index-dir", default=os.getenv("RAG_INDEX_DIR", ".rag_index/segments"))
+    parser.add_argument("--workers", type=int, default=None, help="Segment build processes (default: CPU count)")
+    parser.add_argument("--segment-size", type=int, default=5000, help="Passages per new segment")
+    parser.add_argument("--max-words", type=int, default=120, help="Words per passage")
+    parser.add_argument("--stats", action="store_true", help="Print the index manifest summary and exit")
+    args = parser.parse_args()
+
+    store = get_index_store(args.index_dir)
+    if args.stats or not args.paths:
+        print(json.dumps(store.stats(), indent=2))
+        return
+
+    start = time.perf_counter()
+    counts = store.ingest(args.paths, args.workers, args.segment_size, args.max_words, merge=False)
+    print(f"📥 Added {counts['added']}, unchanged {counts['unchanged']}, deleted {counts['deleted']} passages "
+          f"in {counts['segments']} new segments ({time.perf_counter() - start:.1f}s)")
+    # A one-shot run merges in the foreground; long-lived processes merge in the background
+    store.merge_all()
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,21 +5,17 @@ This demonstrates how to use Langfuse with LangChain for more complex workflows.
 """
 
 import os
-from dotenv import load_dotenv
-from langfuse import Langfuse
-import openai
+from clients import get_langfuse, load_env, shutdown
+from tracing import start_trace
+from conversation_memory import ConversationMemory
+from llm import chat_completion, print_token, streaming_enabled
+from workflow import Workflow
 import time
 import random
+from typing import List
 
 # Load environment variables
-load_dotenv()
-
-# Initialize Langfuse
-langfuse = Langfuse(
-    public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
-    host=os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")
-)
+load_env()
 
 def simple_llm_chain_demo():
     """
@@ -40,7 +36,7 @@ def simple_llm_chain_demo():
         print(f"\n📝 Explaining {topic} to {audience}...")
         
         # Start span for explanation chain
-        trace = langfuse.start_span(name="explanation_chain", input={"topic": topic, "audience": audience})
+        trace = start_trace(get_langfuse(), "explanation_chain", input={"topic": topic, "audience": audience})
         
         try:
             # Add delay for realistic demo
@@ -58,23 +54,29 @@ def simple_llm_chain_demo():
             )
             
             try:
-                # Call OpenAI API
-                response = openai.chat.completions.create(
+                # Call OpenAI API, streaming tokens to the terminal if enabled
+                streaming = streaming_enabled()
+                if streaming:
+                    print("🤖 Response: ", end="", flush=True)
+                result = chat_completion(
                     model="gpt-3.5-turbo",
                     messages=[
                         {"role": "system", "content": "You are a helpful technical expert who explains complex topics clearly."},
                         {"role": "user", "content": prompt}
                     ],
                     temperature=0.7,
-                    max_tokens=400
+                    max_tokens=400,
+                    generation=generation,
+                    on_token=print_token if streaming else None
                 )
-                
-                result = response.choices[0].message.content
                 generation.update(output=result)
                 generation.end()
                 trace.update(name="explanation_chain", output=result)
                 
-                print(f"🤖 Response: {result}")
+                if streaming:
+                    print()
+                else:
+                    print(f"🤖 Response: {result}")
             except Exception as e:
                 error_msg = f"Error: {str(e)}"
                 generation.update(output=error_msg, level="ERROR")
@@ -94,7 +96,7 @@ def conversation_chain_demo():
     print("=" * 45)
     
     # Start main conversation span
-    conversation_trace = langfuse.start_span(name="conversation_chain")
+    conversation_trace = start_trace(get_langfuse(), "conversation_chain")
     
     try:
         # Sample conversation
@@ -105,7 +107,14 @@ def conversation_chain_demo():
             "What tools would you recommend for a Kubernetes environment?"
         ]
         
-        conversation_history = []
+        # Bounded history: sliding token window plus a rolling summary of older turns
+        memory = ConversationMemory(
+            system_prompt="You are a helpful cloud-native expert. Continue the conversation naturally based on the previous context.",
+            policy=os.getenv("CONVERSATION_MEMORY_POLICY", "hybrid"),
+            max_history_tokens=int(os.getenv("CONVERSATION_MEMORY_TOKENS", "600")),
+            trace=conversation_trace
+        )
+        tokens_saved = 0
         
         for i, message in enumerate(conversation_steps, 1):
             print(f"\n👤 User: {message}")
@@ -117,30 +126,34 @@ def conversation_chain_demo():
             turn_span = conversation_trace.start_span(name=f"conversation_turn_{i}", input=message)
             
             try:
-                # Build context with conversation history
-                context_messages = [
-                    {"role": "system", "content": "You are a helpful cloud-native expert. Continue the conversation naturally based on the previous context."}
-                ]
-                context_messages.extend(conversation_history)
-                context_messages.append({"role": "user", "content": message})
+                # Build context from the bounded conversation memory
+                context_messages = memory.build_messages(message)
+                memory_stats = memory.turn_stats(context_messages, message)
+                tokens_saved += memory_stats["prompt_tokens_saved"]
+                turn_span.update(metadata=memory_stats)
                 
                 try:
-                    # Get response
-                    response = openai.chat.completions.create(
+                    # Get response, streaming tokens to the terminal if enabled
+                    streaming = streaming_enabled()
+                    if streaming:
+                        print("🤖 Assistant: ", end="", flush=True)
+                    result = chat_completion(
                         model="gpt-3.5-turbo",
                         messages=context_messages,
                         temperature=0.7,
-                        max_tokens=300
+                        max_tokens=300,
+                        generation=turn_span,
+                        on_token=print_token if streaming else None
                     )
-                    
-                    result = response.choices[0].message.content
                     turn_span.update(output=result)
                     
-                    # Add to conversation history
-                    conversation_history.append({"role": "user", "content": message})
-                    conversation_history.append({"role": "assistant", "content": result})
+                    # Add to conversation memory (older turns are summarized in the background)
+                    memory.add_turn(message, result)
                     
-                    print(f"🤖 Assistant: {result}")
+                    if streaming:
+                        print()
+                    else:
+                        print(f"🤖 Assistant: {result}")
                 except Exception as e:
                     error_msg = f"Error: {str(e)}"
                     turn_span.update(output=error_msg, level="ERROR")
@@ -150,18 +163,78 @@ def conversation_chain_demo():
             
             print("-" * 30)
         
+        # Let any in-flight summary finish before the conversation span closes
+        memory.close()
+        
         # Update conversation trace
         conversation_trace.update(
             name="conversation_chain",
             output=f"Completed conversation with {len(conversation_steps)} turns",
-            metadata={"total_turns": len(conversation_steps)}
+            metadata={
+                "total_turns": len(conversation_steps),
+                "memory_policy": memory.policy,
+                "prompt_tokens_saved": tokens_saved
+            }
         )
     finally:
         conversation_trace.end()
 
-def multi_step_workflow_demo():
+def analyze_problem(problem: str, span=None) -> str:
+    """
+    Workflow step 1: identify the key challenges of a problem
+    """
+    return chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You are a cloud-native expert. Analyze problems and identify key challenges and potential solutions."},
+            {"role": "user", "content": f"Analyze this cloud-native problem: {problem}. Identify the key challenges and potential solutions."}
+        ],
+        temperature=0.3,
+        max_tokens=400,
+        generation=span
+    )
+
+def generate_solution(problem: str, analysis: str, span=None) -> str:
+    """
+    Workflow step 2: turn an analysis into an implementation plan
+    """
+    return chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You are a cloud-native expert. Provide detailed implementation plans with specific tools and steps."},
+            {"role": "user", "content": f"Based on this analysis: {analysis}\n\nFor the original problem: {problem}\n\nProvide a detailed implementation plan with specific tools and steps."}
+        ],
+        temperature=0.3,
+        max_tokens=500,
+        generation=span
+    )
+
+def build_problem_workflow(problems: List[str], parallelism: int = 4) -> Workflow:
+    """
+    One dependency graph holding an analysis -> solution chain per problem
+    """
+    workflow = Workflow(name="multi_step_workflow", parallelism=parallelism)
+    for i, problem in enumerate(problems, 1):
+        workflow.add(
+            f"problem_analysis_{i}",
+            lambda inputs, span, problem=problem: analyze_problem(problem, span),
+            input=problem
+        )
+        workflow.add(
+            f"solution_generation_{i}",
+            lambda inputs, span, problem=problem, i=i: generate_solution(problem, inputs[f"problem_analysis_{i}"], span),
+            deps=[f"problem_analysis_{i}"],
+            input={"problem": problem}
+        )
+    return workflow
+
+def multi_step_workflow_demo(parallelism: int = None):
     """
     Multi-step workflow demo with Langfuse tracing
+
+    Each problem is an analysis -> solution chain in one dependency graph, so
+    the analysis of problem N+1 runs while the solution for problem N is
+    being generated.
     """
     print("\n🔄 Multi-Step Workflow Demo")
     print("=" * 35)
@@ -173,78 +246,45 @@ def multi_step_workflow_demo():
         "Our application logs are scattered across multiple services and hard to correlate"
     ]
     
-    for problem in problems:
-        print(f"\n🔍 Problem: {problem}")
+    if parallelism is None:
+        parallelism = int(os.getenv("WORKFLOW_PARALLELISM", "4"))
+    
+    workflow = build_problem_workflow(problems, parallelism)
+    
+    # Start workflow span
+    workflow_trace = start_trace(get_langfuse(), "multi_step_workflow", input=problems)
+    
+    try:
+        print(f"📊 Analyzing {len(problems)} problems and generating solutions (parallelism={parallelism})...")
+        results = workflow.run(parent=workflow_trace)
         
-        # Start workflow span
-        workflow_trace = langfuse.start_span(name="multi_step_workflow", input=problem)
+        for i, problem in enumerate(problems, 1):
+            print(f"\n🔍 Problem: {problem}")
+            for step_name, label in ((f"problem_analysis_{i}", "Analysis"), (f"solution_generation_{i}", "Solution")):
+                result = results[step_name]
+                if result.status == "ok":
+                    print(f"{label}: {result.output}")
+                else:
+                    print(f"❌ {label} {result.status}: {result.error}")
+            print("-" * 50)
         
-        try:
-            # Step 1: Analysis
-            print("📊 Step 1: Analyzing problem...")
-            time.sleep(random.uniform(2, 3))
-            
-            analysis_span = workflow_trace.start_span(name="problem_analysis", input=problem)
-            try:
-                analysis_response = openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a cloud-native expert. Analyze problems and identify key challenges and potential solutions."},
-                        {"role": "user", "content": f"Analyze this cloud-native problem: {problem}. Identify the key challenges and potential solutions."}
-                    ],
-                    temperature=0.3,
-                    max_tokens=400
-                )
-                
-                analysis = analysis_response.choices[0].message.content
-                analysis_span.update(output=analysis)
-                print(f"Analysis: {analysis}")
-            except Exception as e:
-                error_msg = f"Analysis error: {str(e)}"
-                analysis_span.update(output=error_msg, level="ERROR")
-                print(f"❌ {error_msg}")
-                analysis_span.end()
-                workflow_trace.end()
-                continue
-            finally:
-                analysis_span.end()
-            
-            # Step 2: Solution
-            print("\n💡 Step 2: Generating solution...")
-            time.sleep(random.uniform(2, 3))
-            
-            solution_span = workflow_trace.start_span(name="solution_generation", input={"problem": problem, "analysis": analysis})
-            try:
-                solution_response = openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a cloud-native expert. Provide detailed implementation plans with specific tools and steps."},
-                        {"role": "user", "content": f"Based on this analysis: {analysis}\n\nFor the original problem: {problem}\n\nProvide a detailed implementation plan with specific tools and steps."}
-                    ],
-                    temperature=0.3,
-                    max_tokens=500
-                )
-                
-                solution = solution_response.choices[0].message.content
-                solution_span.update(output=solution)
-                print(f"Solution: {solution}")
-            except Exception as e:
-                error_msg = f"Solution error: {str(e)}"
-                solution_span.update(output=error_msg, level="ERROR")
-                print(f"❌ {error_msg}")
-            finally:
-                solution_span.end()
-            
-            # Update workflow trace
-            workflow_trace.update(
-                name="multi_step_workflow",
-                output=f"Completed analysis and solution for: {problem}",
-                metadata={"problem": problem}
-            )
-        finally:
-            workflow_trace.end()
+        failed = [name for name, result in results.items() if result.status != "ok"]
         
-        print("-" * 50)
+        # Update workflow trace
+        workflow_trace.update(
+            name="multi_step_workflow",
+            output=f"Completed analysis and solution for {len(problems)} problems",
+            level="WARNING" if failed else None,
+            metadata={
+                "problems": problems,
+                "parallelism": parallelism,
+                "failed_steps": failed,
+                "steps": {name: {"status": r.status, "queue_wait_ms": round(r.queue_wait_ms, 1), "run_ms": round(r.run_ms, 1)}
+                          for name, r in results.items()}
+            }
+        )
+    finally:
+        workflow_trace.end()
 
 def run_langchain_demo():
     """
@@ -272,10 +312,9 @@ def run_langchain_demo():
         
     except Exception as e:
         print(f"❌ Error running demo: {e}")
-    
-    finally:
-        # Flush any remaining traces
-        langfuse.flush()
 
 if __name__ == "__main__":
     run_langchain_demo()
+    
+    # Flush any remaining traces
+    shutdown()
@@ -0,0 +1,402 @@
+"""
+Shared Chat Completion Helpers
+Every demo sends its chat completions through here, so caching, coalescing, streaming, rate limiting and hedging apply to all call sites.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from clients import get_openai
+from coalescing import FlightAbandoned, get_single_flight
+from hedging import get_hedger
+from llm_cache import ResponseCache, get_response_cache
+from rate_limiter import get_scheduler
+
+
+_usage_lock = threading.Lock()
+_usage_totals: Counter = Counter()
+# Whether the latest completion in this thread or task went to the model, rather than the cache or another caller's request
+_served_upstream: ContextVar[bool] = ContextVar("llm_served_upstream", default=True)
+
+
+def streaming_enabled() -> bool:
+    """
+    Whether the demos should stream tokens to the terminal (LLM_STREAMING=true)
+    """
+    return os.getenv("LLM_STREAMING", "false").lower() == "true"
+
+
+def print_token(token: str) -> None:
+    print(token, end="", flush=True)
+
+
+def _usage_dict(response) -> Optional[Dict[str, int]]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return {
+        "input": usage.prompt_tokens,
+        "output": usage.completion_tokens,
+        "total": usage.total_tokens
+    }
+
+
+def _tally_usage(usage: Optional[Dict[str, int]]) -> None:
+    with _usage_lock:
+        _usage_totals["calls"] += 1
+        for name, tokens in (usage or {}).items():
+            _usage_totals[name] += tokens or 0
+
+
+def usage_totals() -> Dict[str, int]:
+    """
+    Upstream calls and token usage made by this process; cache hits and coalesced followers add nothing
+    """
+    with _usage_lock:
+        return {"calls": _usage_totals["calls"], "input": _usage_totals["input"],
+                "output": _usage_totals["output"], "total": _usage_totals["total"]}
+
+
+def served_upstream() -> bool:
+    """
+    Whether the latest completion in this thread or task was answered by a model call; False for cache hits and coalesced followers
+    """
+    return _served_upstream.get()
+
+
+def _cache_lookup(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int, generation=None):
+    """
+    Return (cache, key, entry); key is None when the request is not cacheable
+    """
+    _served_upstream.set(True)
+    cache = get_response_cache()
+    if cache is None or not cache.cacheable(temperature):
+        return cache, None, None
+
+    key = cache.key(model, messages, temperature, max_tokens)
+    entry = cache.get(key)
+    _served_upstream.set(entry is None)
+    if generation:
+        if entry is not None:
+            generation.update(metadata={
+                "cache_hit": True,
+                "cache_tier": entry["tier"],
+                "latency_saved_ms": round(entry["latency_ms"], 1)
+            })
+        else:
+            generation.update(metadata={"cache_hit": False})
+    return cache, key, entry
+
+
+def _finish_response(response, scheduler, estimated_tokens: int, start: float, generation, cache, key) -> str:
+    """
+    Settle the token reservation, record usage on the generation and cache a non-streamed response
+    """
+    result = response.choices[0].message.content
+    usage = _usage_dict(response)
+    _tally_usage(usage)
+    scheduler.settle_tokens(estimated_tokens, (usage or {}).get("total"))
+    if generation and usage:
+        generation.update(usage_details=usage)
+    if key is not None:
+        cache.set(key, result, (time.perf_counter() - start) * 1000, usage)
+    return result
+
+
+def _tally_discarded(response) -> None:
+    """
+    Count a hedged attempt that completed but lost the race; its tokens were still spent
+    """
+    _tally_usage(_usage_dict(response))
+
+
+async def _stream_attempt(messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int,
+                          estimated_tokens: int, observation) -> AsyncIterator:
+    """
+    One hedged streaming attempt on the hedger's event loop; chunks before the first content token are dropped
+    """
+    from clients import get_async_openai
+
+    stream, slot = await get_scheduler().acall(lambda: get_async_openai().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    ), estimated_tokens, observation, hold=True)
+    # The concurrency slot is held until the stream is consumed or closed
+    error = None
+    try:
+        started = False
+        async for chunk in stream:
+            if not started and chunk.usage is None and not (chunk.choices and chunk.choices[0].delta.content):
+                continue
+            started = True
+            yield chunk
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        try:
+            await stream.close()
+        finally:
+            slot.release(error)
+
+
+def _record_followers(generation, flight) -> None:
+    if generation and flight.followers:
+        generation.update(metadata={"coalesced_followers": flight.followers})
+
+
+def _record_coalescing(generation, flight, leader: bool) -> None:
+    """
+    Tag the leader with its follower count and each follower with a link to the leader, which holds the usage
+    """
+    if leader:
+        _record_followers(generation, flight)
+        return
+    _served_upstream.set(False)
+    if generation:
+        generation.update(metadata=flight.link())
+
+
+def stream_chat_completion(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo", temperature: float = 0.7,
+                           max_tokens: int = 500, generation=None, client=None,
+                           record_output: bool = True) -> Iterator[str]:
+    """
+    Streaming chat completion that yields content tokens as they arrive
+
+    When the stream closes (fully consumed, closed early or failed) the
+    generation gets completion_start_time, usage and time-to-first-token,
+    inter-token latency and tokens/sec metadata. With record_output the final
+    text is recorded as the generation output exactly once, on a clean close.
+    A caller that joins an identical in-flight stream waits for it and gets
+    the whole text as a single chunk.
+    """
+    cache, key, entry = _cache_lookup(model, messages, temperature, max_tokens, generation)
+    if entry is not None:
+        if generation and record_output:
+            generation.update(output=entry["content"])
+        yield entry["content"]
+        return
+
+    flights = get_single_flight()
+    if flights is None:
+        yield from _stream_upstream(messages, model, temperature, max_tokens, generation, client, record_output,
+                                    cache, key)
+        return
+
+    flight_key = key or ResponseCache.key(model, messages, temperature, max_tokens)
+    flight, leader = flights.join(flight_key, generation)
+    if not leader:
+        try:
+            result = flight.wait()
+        except FlightAbandoned:
+            yield from _stream_upstream(messages, model, temperature, max_tokens, generation, client,
+                                        record_output, cache, key)
+            return
+        _served_upstream.set(False)
+        if generation:
+            update = {"metadata": dict(flight.link(), streamed=True)}
+            if record_output:
+                update["output"] = result
+            generation.update(**update)
+        yield result
+        return
+
+    parts = []
+    error = FlightAbandoned("leader stream closed before completing")
+    try:
+        for token in _stream_upstream(messages, model, temperature, max_tokens, generation, client,
+                                      record_output, cache, key):
+            parts.append(token)
+            yield token
+        error = None
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        flights.finish(flight_key, flight, "".join(parts) if error is None else None, error)
+        _record_followers(generation, flight)
+
+
+def _stream_upstream(messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, generation,
+                     client, record_output: bool, cache, key) -> Iterator[str]:
+    start = time.perf_counter()
+    first_token_at = None
+    last_token_at = None
+    gaps = []
+    parts = []
+    usage = None
+    completed = False
+    scheduler = get_scheduler()
+    estimated_tokens = scheduler.estimate_tokens(messages, model, max_tokens)
+
+    hedger = get_hedger()
+    # Hedged attempts hold their own slots in _stream_attempt; otherwise the slot is held until the stream ends
+    slot = None
+    error = None
+
+    try:
+        # Only opening the stream is retried; once tokens have been yielded a failure propagates
+        if hedger is not None and client is None:
+            stream = hedger.stream(model, lambda observation: _stream_attempt(
+                messages, model, temperature, max_tokens, estimated_tokens, observation
+            ), generation)
+        else:
+            stream, slot = scheduler.call(lambda: (client or get_openai()).chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            ), estimated_tokens, generation, hold=True)
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = _usage_dict(chunk)
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if not token:
+                continue
+
+            now = time.perf_counter()
+            if first_token_at is None:
+                first_token_at = now
+                if generation:
+                    generation.update(completion_start_time=datetime.now(timezone.utc))
+            else:
+                gaps.append(now - last_token_at)
+            last_token_at = now
+            parts.append(token)
+            yield token
+        completed = True
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        end = time.perf_counter()
+        if slot is not None:
+            slot.release(error)
+        result = "".join(parts)
+        scheduler.settle_tokens(estimated_tokens, (usage or {}).get("total"))
+        if completed or usage:
+            _tally_usage(usage)
+        if generation:
+            output_tokens = (usage or {}).get("output") or len(parts)
+            metadata = {"streamed": True, "stream_completed": completed, "streamed_chunks": len(parts)}
+            if first_token_at is not None:
+                metadata["time_to_first_token_ms"] = round((first_token_at - start) * 1000, 1)
+                if gaps:
+                    metadata["inter_token_latency_ms"] = round(sum(gaps) / len(gaps) * 1000, 2)
+                    metadata["max_inter_token_latency_ms"] = round(max(gaps) * 1000, 2)
+                if end > first_token_at:
+                    metadata["tokens_per_second"] = round(output_tokens / (end - first_token_at), 1)
+            update = {"metadata": metadata}
+            if usage:
+                update["usage_details"] = usage
+            if record_output and completed:
+                update["output"] = result
+            generation.update(**update)
+        if completed and key is not None:
+            cache.set(key, result, (end - start) * 1000, usage)
+
+
+def chat_completion(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo", temperature: float = 0.7,
+                    max_tokens: int = 500, generation=None, client=None,
+                    on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Chat completion through the response cache; returns the message content
+
+    Passing on_token switches to streaming: each token is handed to the
+    callback as it arrives and the full text is still returned. The caller
+    records the output, as in the non-streaming case.
+    """
+    if on_token is not None:
+        parts = []
+        for token in stream_chat_completion(messages, model, temperature, max_tokens, generation, client,
+                                            record_output=False):
+            on_token(token)
+            parts.append(token)
+        return "".join(parts)
+
+    cache, key, entry = _cache_lookup(model, messages, temperature, max_tokens, generation)
+    if entry is not None:
+        return entry["content"]
+
+    def complete() -> str:
+        scheduler = get_scheduler()
+        estimated_tokens = scheduler.estimate_tokens(messages, model, max_tokens)
+        start = time.perf_counter()
+        hedger = get_hedger()
+        if hedger is not None and client is None:
+            # Hedged attempts run on the hedger's event loop, where the loser can be cancelled mid-request
+            from clients import get_async_openai
+            response = hedger.race(model, "response", lambda observation: scheduler.acall(
+                lambda: get_async_openai().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                ), estimated_tokens, observation
+            ), generation, discard=_tally_discarded)
+        else:
+            response = scheduler.call(lambda: (client or get_openai()).chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            ), estimated_tokens, generation)
+        return _finish_response(response, scheduler, estimated_tokens, start, generation, cache, key)
+
+    flights = get_single_flight()
+    if flights is None:
+        return complete()
+    flight_key = key or ResponseCache.key(model, messages, temperature, max_tokens)
+    result, flight, leader = flights.do(flight_key, complete, generation)
+    _record_coalescing(generation, flight, leader)
+    return result
+
+
+async def async_chat_completion(messages: List[Dict[str, str]], client, model: str = "gpt-3.5-turbo",
+                                temperature: float = 0.7, max_tokens: int = 500, generation=None) -> str:
+    """
+    Async chat completion through the response cache, using an AsyncOpenAI client
+    """
+    cache, key, entry = _cache_lookup(model, messages, temperature, max_tokens, generation)
+    if entry is not None:
+        return entry["content"]
+
+    async def complete() -> str:
+        scheduler = get_scheduler()
+        estimated_tokens = scheduler.estimate_tokens(messages, model, max_tokens)
+        start = time.perf_counter()
+        create = lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        hedger = get_hedger()
+        if hedger is not None:
+            response = await hedger.arace(model, "response",
+                                          lambda observation: scheduler.acall(create, estimated_tokens, observation),
+                                          generation, discard=_tally_discarded)
+        else:
+            response = await scheduler.acall(create, estimated_tokens, generation)
+        return _finish_response(response, scheduler, estimated_tokens, start, generation, cache, key)
+
+    flights = get_single_flight()
+    if flights is None:
+        return await complete()
+    flight_key = key or ResponseCache.key(model, messages, temperature, max_tokens)
+    result, flight, leader = await flights.ado(flight_key, complete, generation)
+    _record_coalescing(generation, flight, leader)
+    return result
@@ -0,0 +1,142 @@
+"""
+Response Cache for Chat Completions
+In-memory LRU tier with a TTL, backed by an optional SQLite tier that survives restarts.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class ResponseCache:
+    """
+    Two-tier cache of chat completion responses keyed by (model, messages, temperature, max_tokens)
+
+    Only requests at or below max_temperature are cached; the default of 0.0
+    caches deterministic requests and leaves sampled ones alone.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, path: Optional[str] = None,
+                 max_temperature: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        """
+        Stable hash of the request parameters that determine the response
+        """
+        payload = json.dumps([model, messages, temperature, max_tokens], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cacheable(self, temperature: float) -> bool:
+        return temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a response, returning the entry with a "tier" field, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry["created"] <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry, tier="memory")
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if now - row[1] <= self.ttl_seconds:
+                        entry = dict(json.loads(row[0]), created=row[1])
+                        self._remember(key, entry)
+                        self.hits += 1
+                        return dict(entry, tier="disk")
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, content: str, latency_ms: float, usage: Optional[Dict[str, int]] = None) -> None:
+        """
+        Store a response with the upstream latency it cost, so hits can report the time saved
+        """
+        entry = {"content": content, "latency_ms": latency_ms, "usage": usage, "created": time.time()}
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                value = json.dumps({"content": content, "latency_ms": latency_ms, "usage": usage})
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                    (key, value, entry["created"])
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory)
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Process-wide cache configured from LLM_CACHE_* environment variables, or None when disabled
+    """
+    global _response_cache
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() == "false":
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+                    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600")),
+                    path=os.getenv("LLM_CACHE_PATH") or None,
+                    max_temperature=float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.0"))
+                )
+    return _response_cache
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Open-Loop Load Generator
+Replays a JSONL workload of chat, RAG and workflow queries at a target arrival rate and reports latency per pipeline.
+
+Requests are fired on a precomputed arrival schedule whether or not earlier
+ones have finished, and latency is measured from each request's scheduled
+start. A slow system therefore shows up as higher latency instead of as a
+lower request rate (no coordinated omission).
+
+Usage:
+    python load_test.py --qps 2 --duration 60
+    python load_test.py --ramp 1:20:1 --stage-duration 30 --slo-ms 8000 --output report.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List
+
+from clients import get_langfuse, shutdown
+from histogram import LatencyHistogram
+from metrics import get_metrics
+from tracing import start_trace
+
+PIPELINES = ("chat", "rag", "workflow")
+
+
+def load_workload(path: str) -> List[Dict[str, str]]:
+    """
+    Read {"pipeline": ..., "query": ...} records, one per line
+    """
+    workload = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("pipeline") not in PIPELINES or not record.get("query"):
+                raise ValueError(f"{path}:{line_number}: expected a pipeline in {PIPELINES} and a query")
+            workload.append(record)
+    if not workload:
+        raise ValueError(f"{path}: workload is empty")
+    return workload
+
+
+def run_chat(query: str) -> None:
+    import simple_chat_demo
+    result = simple_chat_demo.chat_with_llm(query)
+    if result.startswith(simple_chat_demo.CHAT_ERROR_PREFIX):
+        raise RuntimeError(result)
+
+
+def run_rag(query: str) -> None:
+    import rag_demo
+    result = rag_demo.rag_pipeline(query)
+    if result["answer"].startswith(rag_demo.ANSWER_ERROR_PREFIX):
+        raise RuntimeError(result["answer"])
+
+
+def run_workflow(query: str) -> None:
+    import langchain_demo
+    workflow = langchain_demo.build_problem_workflow([query], parallelism=2)
+    trace = start_trace(get_langfuse(), "multi_step_workflow", input=[query])
+    try:
+        results = workflow.run(parent=trace)
+        failed = [name for name, result in results.items() if result.status != "ok"]
+        trace.update(output=f"Completed workflow for: {query}", metadata={"failed_steps": failed})
+    finally:
+        trace.end()
+    if failed:
+        raise RuntimeError(results[failed[0]].error)
+
+
+PIPELINE_RUNNERS: Dict[str, Callable[[str], None]] = {
+    "chat": run_chat,
+    "rag": run_rag,
+    "workflow": run_workflow,
+}
+
+
+class PipelineStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = Counter()
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency_ms: float, error: str = None) -> None:
+        with self.lock:
+            self.completed += 1
+            self.histogram.record(latency_ms)
+            if error:
+                self.errors[error] += 1
+
+    def report(self, elapsed: float) -> Dict[str, object]:
+        errors = sum(self.errors.values())
+        report = self.histogram.summary()
+        report.update({
+            "throughput_rps": round(self.completed / elapsed, 3) if elapsed else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / self.completed, 4) if self.completed else 0.0,
+            "error_types": dict(self.errors.most_common(5))
+        })
+        return report
+
+
+def arrival_schedule(qps: float, duration: float, arrival: str, rng: random.Random) -> List[float]:
+    """
+    Request start offsets in seconds: Poisson arrivals by default, or evenly spaced
+    """
+    offsets = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(qps) if arrival == "poisson" else 1.0 / qps
+        if t >= duration:
+            return offsets
+        offsets.append(t)
+
+
+def run_stage(workload: List[Dict[str, str]], qps: float, duration: float, max_workers: int = 256,
+              arrival: str = "poisson", seed: int = 0) -> Dict[str, object]:
+    """
+    Fire the workload at qps for duration seconds and collect per-pipeline statistics
+    """
+    rng = random.Random(seed)
+    offsets = arrival_schedule(qps, duration, arrival, rng)
+    stats = {name: PipelineStats() for name in PIPELINES}
+    overall = PipelineStats()
+    max_dispatch_lag = 0.0
+    latencies = [0.0] * len(offsets)
+
+    def execute(index: int, record: Dict[str, str], scheduled: float) -> None:
+        error = None
+        try:
+            PIPELINE_RUNNERS[record["pipeline"]](record["query"])
+        except Exception as e:
+            error = type(e).__name__ if not str(e) else str(e)[:80]
+        latency_ms = (time.perf_counter() - scheduled) * 1000
+        latencies[index] = latency_ms
+        stats[record["pipeline"]].record(latency_ms, error)
+        overall.record(latency_ms, error)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="load")
+    start = time.perf_counter() + 0.05
+    for i, offset in enumerate(offsets):
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            max_dispatch_lag = max(max_dispatch_lag, -delay)
+        # Latency is measured from the scheduled time, so time spent waiting
+        # for a free worker counts against the system under test
+        pool.submit(execute, i, workload[i % len(workload)], scheduled)
+    pool.shutdown(wait=True)
+    elapsed = max(duration, time.perf_counter() - start)
+
+    # Under saturation a queue builds up, so later arrivals wait longer than early ones
+    quarter = len(latencies) // 4
+    if quarter:
+        early = sorted(latencies[:quarter])[quarter // 2]
+        late = sorted(latencies[-quarter:])[quarter // 2]
+        latency_growth = late / early if early else 1.0
+    else:
+        latency_growth = 1.0
+
+    return {
+        "offered_qps": qps,
+        "duration_s": round(elapsed, 2),
+        "requests": len(offsets),
+        "max_dispatch_lag_ms": round(max_dispatch_lag * 1000, 2),
+        "latency_growth": round(latency_growth, 2),
+        "overall": overall.report(elapsed),
+        "pipelines": {name: s.report(elapsed) for name, s in stats.items() if s.completed}
+    }
+
+
+def is_saturated(stage: Dict[str, object], slo_ms: float, max_error_rate: float) -> bool:
+    """
+    A stage is saturated when a queue builds up (late arrivals wait 2x longer
+    than early ones), p99 breaks the SLO or errors climb
+    """
+    overall = stage["overall"]
+    queueing = stage["latency_growth"] > 2.0
+    slow = slo_ms and overall.get("p99_ms", 0) > slo_ms
+    failing = overall["error_rate"] > max_error_rate
+    return bool(queueing or slow or failing)
+
+
+def print_stage(stage: Dict[str, object]) -> None:
+    print(f"\n📈 Offered {stage['offered_qps']} QPS for {stage['duration_s']}s ({stage['requests']} requests)")
+    print(f"{'pipeline':<10} {'count':>6} {'rps':>8} {'err%':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9} {'max':>9}")
+    rows = list(stage["pipelines"].items()) + [("overall", stage["overall"])]
+    for name, r in rows:
+        if not r["count"]:
+            continue
+        print(f"{name:<10} {r['count']:>6} {r['throughput_rps']:>8.2f} {r['error_rate'] * 100:>5.1f}% "
+              f"{r['p50_ms']:>8.0f}ms {r['p90_ms']:>7.0f}ms {r['p99_ms']:>7.0f}ms {r['p99.9_ms']:>7.0f}ms {r['max_ms']:>7.0f}ms")
+    print(f"Latency growth (late/early median): {stage['latency_growth']}x")
+    if stage["max_dispatch_lag_ms"] > 10:
+        print(f"⚠️  Load generator fell behind schedule by up to {stage['max_dispatch_lag_ms']}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test for the demo pipelines")
+    parser.add_argument("--workload", default="workload.jsonl", help="JSONL file of {pipeline, query} records")
+    parser.add_argument("--qps", type=float, default=1.0, help="Target arrival rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per stage")
+    parser.add_argument("--ramp", help="START:STOP:STEP QPS ramp to find the saturation point")
+    parser.add_argument("--stage-duration", type=float, help="Seconds per ramp stage (defaults to --duration)")
+    parser.add_argument("--slo-ms", type=float, default=0, help="p99 latency SLO used to detect saturation")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="Error rate that counts as saturated")
+    parser.add_argument("--no-stop", action="store_true", help="Keep ramping past the saturation point")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--max-workers", type=int, default=256, help="Upper bound on in-flight requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the full report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="Show the demos' own output")
+    parser.add_argument("--prewarm", action="store_true", help="Create clients and the retrieval index before the first request")
+    args = parser.parse_args()
+
+    from run_all_demos import check_environment
+    if not check_environment():
+        sys.exit(1)
+
+    workload = load_workload(args.workload)
+    # Starts the /metrics endpoint when METRICS_PORT is set, so it can be scraped from the first request
+    metrics = get_metrics()
+    if args.prewarm:
+        from rag_demo import prewarm_rag_demo
+        prewarm_rag_demo()
+    if args.ramp:
+        start, stop, step = (float(x) for x in args.ramp.split(":"))
+        rates = []
+        while start <= stop + 1e-9:
+            rates.append(round(start, 6))
+            start += step
+        duration = args.stage_duration or args.duration
+    else:
+        rates = [args.qps]
+        duration = args.duration
+
+    print("🎯 Open-Loop Load Test")
+    print("=" * 50)
+    print(f"Workload: {args.workload} ({len(workload)} records), stages: {rates} QPS x {duration}s")
+
+    stages = []
+    saturation_qps = None
+    for i, qps in enumerate(rates):
+        with open(os.devnull, "w") as devnull, redirect_stdout(sys.stdout if args.verbose else devnull):
+            stage = run_stage(workload, qps, duration, args.max_workers, args.arrival, args.seed + i)
+        stage["saturated"] = is_saturated(stage, args.slo_ms, args.max_error_rate)
+        stages.append(stage)
+        print_stage(stage)
+        if stage["saturated"]:
+            print(f"🚧 Saturated at {qps} QPS")
+            if saturation_qps is None:
+                saturation_qps = qps
+            if not args.no_stop:
+                break
+
+    shutdown()
+
+    report = {"workload": args.workload, "arrival": args.arrival, "stages": stages, "saturation_qps": saturation_qps,
+              "stage_latency": metrics.summary()}
+    if os.getenv("TRACE_SPOOL_DIR"):
+        from span_spool import get_shipper
+        report["span_spool"] = get_shipper().stats()
+        print(f"🗄️  Span spool: {report['span_spool']['queue_depth_records']} batches queued, "
+              f"lag {report['span_spool']['lag_seconds']}s")
+    if args.ramp:
+        sustained = [s["offered_qps"] for s in stages if not s["saturated"]]
+        report["max_sustained_qps"] = max(sustained) if sustained else None
+        print(f"\n📊 Max sustained: {report['max_sustained_qps']} QPS, saturation: {saturation_qps} QPS")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
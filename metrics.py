@@ -0,0 +1,253 @@
+"""
+Pipeline Stage Metrics
+Per-stage latency histograms and error counters, exposed in Prometheus text format on an optional local /metrics endpoint.
+
+Recording is independent of Langfuse sampling, so stage timings are
+complete even when most traces are dropped. Each thread records into its
+own LatencyHistogram shard without taking a lock; a scrape snapshots and
+merges the shards. Token, call, cache, coalescing and retry counters are
+read from their own modules at scrape time, so the hot path pays nothing
+for them.
+
+    METRICS_PORT=9464 python load_test.py --qps 5
+    curl -s localhost:9464/metrics
+"""
+
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from histogram import LatencyHistogram
+
+# Prometheus histogram bucket bounds, in seconds
+BUCKETS_SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class _Shard:
+    """
+    One thread's histograms and error counts; only its owner thread writes to it
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.errors: Dict[str, int] = {}
+
+
+def _snapshot(histogram: LatencyHistogram) -> LatencyHistogram:
+    # Copy before merging: the owner thread may record while a scrape iterates
+    copy = LatencyHistogram(histogram.sub_bucket_bits)
+    copy.counts = dict(histogram.counts)
+    copy.total = sum(copy.counts.values())
+    copy.sum_ms = histogram.sum_ms
+    copy.min_ms = histogram.min_ms
+    copy.max_ms = histogram.max_ms
+    return copy
+
+
+class StageMetrics:
+    """
+    Registry of per-stage latency histograms and error counters
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def record(self, stage: str, seconds: float, error: bool = False) -> None:
+        shard = self._shard()
+        histogram = shard.histograms.get(stage)
+        if histogram is None:
+            histogram = shard.histograms[stage] = LatencyHistogram()
+        histogram.record(seconds * 1000)
+        if error:
+            shard.errors[stage] = shard.errors.get(stage, 0) + 1
+
+    def collect(self) -> Tuple[Dict[str, LatencyHistogram], Dict[str, int]]:
+        """
+        Merged histograms and error counts across all threads
+        """
+        with self._lock:
+            shards = list(self._shards)
+        histograms: Dict[str, LatencyHistogram] = {}
+        errors: Dict[str, int] = {}
+        for shard in shards:
+            for stage, histogram in list(shard.histograms.items()):
+                merged = histograms.setdefault(stage, LatencyHistogram(histogram.sub_bucket_bits))
+                merged.merge(_snapshot(histogram))
+            for stage, count in list(shard.errors.items()):
+                errors[stage] = errors.get(stage, 0) + count
+        return histograms, errors
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        histograms, errors = self.collect()
+        result = {}
+        for stage, histogram in sorted(histograms.items()):
+            result[stage] = histogram.summary((50, 99))
+            result[stage]["errors"] = errors.get(stage, 0)
+        return result
+
+
+def _format(value: float) -> str:
+    return f"{value:.6g}"
+
+
+def _counter_lines(name: str, help_text: str, samples: Dict[str, float], label: str = None) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for key, value in samples.items():
+        labels = f'{{{label}="{key}"}}' if label else ""
+        lines.append(f"{name}{labels} {_format(value)}")
+    return lines
+
+
+def _gauge_lines(name: str, help_text: str, value: float) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format(value)}"]
+
+
+def render_prometheus(metrics: "StageMetrics") -> str:
+    """
+    Stage histograms and quantiles plus LLM, cache, coalescing and rate limiter counters in text format 0.0.4
+    """
+    histograms, errors = metrics.collect()
+    lines = [
+        "# HELP pipeline_stage_duration_seconds Latency of each pipeline stage",
+        "# TYPE pipeline_stage_duration_seconds histogram"
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        bounds_ms = [bound * 1000 for bound in BUCKETS_SECONDS]
+        for bound, count in zip(BUCKETS_SECONDS, histogram.cumulative(bounds_ms)):
+            lines.append(f'pipeline_stage_duration_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+        lines.append(f'pipeline_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.total}')
+        lines.append(f'pipeline_stage_duration_seconds_sum{{stage="{stage}"}} {_format(histogram.sum_ms / 1000)}')
+        lines.append(f'pipeline_stage_duration_seconds_count{{stage="{stage}"}} {histogram.total}')
+
+    lines += [
+        "# HELP pipeline_stage_duration_quantile_seconds Stage latency quantiles since start, within 1% relative error",
+        "# TYPE pipeline_stage_duration_quantile_seconds gauge"
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        for quantile in QUANTILES:
+            value = histogram.percentile(quantile * 100) / 1000
+            lines.append(f'pipeline_stage_duration_quantile_seconds{{stage="{stage}",quantile="{quantile:g}"}} '
+                         f'{_format(value)}')
+
+    lines += _counter_lines("pipeline_stage_errors_total", "Failed executions of each pipeline stage",
+                            {stage: errors.get(stage, 0) for stage in sorted(histograms)}, "stage")
+
+    from llm import usage_totals
+    usage = usage_totals()
+    lines += _counter_lines("llm_upstream_calls_total", "Chat completions sent upstream", {"": usage["calls"]})
+    lines += _counter_lines("llm_tokens_total", "Tokens used by upstream chat completions",
+                            {"input": usage["input"], "output": usage["output"]}, "kind")
+
+    from llm_cache import get_response_cache
+    cache = get_response_cache()
+    if cache is not None:
+        stats = cache.stats()
+        lines += _counter_lines("llm_cache_lookups_total", "Response cache lookups",
+                                {"hit": stats["hits"], "miss": stats["misses"]}, "result")
+
+    from retrieval_cache import get_retrieval_cache
+    retrieval_cache = get_retrieval_cache()
+    if retrieval_cache is not None:
+        stats = retrieval_cache.stats()
+        lines += _counter_lines("retrieval_cache_lookups_total", "Retrieval and context cache lookups",
+                                {"hit": stats["hits"], "miss": stats["misses"]}, "result")
+
+    from coalescing import get_single_flight
+    flights = get_single_flight()
+    if flights is not None:
+        lines += _counter_lines("llm_coalesced_requests_total", "Requests served by another request's upstream call",
+                                {"": flights.followers})
+
+    from rate_limiter import get_scheduler
+    scheduler = get_scheduler().stats()
+    lines += _counter_lines("llm_retries_total", "Retried chat completion attempts", {"": scheduler["retries"]})
+    lines += _counter_lines("llm_rate_limited_total", "Attempts rejected with HTTP 429", {"": scheduler["rate_limited"]})
+    from hedging import get_hedger
+    hedger = get_hedger()
+    if hedger is not None:
+        hedging = hedger.stats()
+        lines += _counter_lines("llm_hedged_requests_total", "Requests that sent a hedge attempt",
+                                {"": hedging["hedges"]})
+        lines += _counter_lines("llm_hedge_wins_total", "Hedged requests answered by the hedge attempt",
+                                {"": hedging["hedge_wins"]})
+    from routing import get_router
+    routing = get_router().stats()
+    lines += _counter_lines("llm_routed_requests_total", "Requests answered by each model after routing and escalation",
+                            routing["answered"], "model")
+    lines += _counter_lines("llm_escalations_total", "Answers rejected by the verifier and retried on a stronger model",
+                            {"": routing["escalations"]})
+    lines += _gauge_lines("llm_concurrency_limit", "Current adaptive concurrency limit", scheduler["concurrency_limit"])
+    lines += _gauge_lines("llm_in_flight", "Chat completions in flight", scheduler["in_flight"])
+
+    if os.getenv("TRACE_SPOOL_DIR"):
+        from span_spool import get_shipper
+        spool = get_shipper().stats()
+        lines += _gauge_lines("span_spool_queue_records", "Span batches waiting to be shipped", spool["queue_depth_records"])
+        lines += _gauge_lines("span_spool_lag_seconds", "Age of the oldest unshipped span batch", spool["lag_seconds"])
+
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics: "StageMetrics", port: int, host: str = "127.0.0.1"):
+    """
+    Serve GET /metrics from a daemon thread; returns the server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus(metrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_metrics = None
+_server = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> StageMetrics:
+    """
+    Process-wide registry; the first call starts the /metrics server when METRICS_PORT is set
+    """
+    global _metrics, _server
+    if _metrics is not None:
+        return _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            metrics = StageMetrics()
+            port = int(os.getenv("METRICS_PORT", "0") or 0)
+            if port:
+                _server = start_metrics_server(metrics, port, os.getenv("METRICS_HOST", "127.0.0.1"))
+            _metrics = metrics
+        return _metrics
+
+
+def record_stage(stage: str, seconds: float, error: bool = False) -> None:
+    get_metrics().record(stage, seconds, error)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Local Mock Servers for Offline Benchmarking
+An OpenAI-compatible chat completions server and a Langfuse-compatible trace sink, both reproducible from a seed.
+
+Point the demos at them through the usual environment variables:
+
+    python mock_servers.py --seed 42
+    export OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+    export LANGFUSE_HOST=http://127.0.0.1:3000
+    export OPENAI_API_KEY=mock LANGFUSE_PUBLIC_KEY=pk-lf-mock LANGFUSE_SECRET_KEY=sk-lf-mock
+    python rag_demo.py
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+MOCK_VOCABULARY = (
+    "kubernetes cluster service deployment pod container observability tracing metrics logs latency "
+    "throughput scaling rollout pipeline monitoring prometheus grafana jaeger resilience availability "
+    "configuration network storage security policy workload node controller operator"
+).split()
+
+
+@dataclass
+class OpenAIMockConfig:
+    seed: int = 0
+    # Time to first token: lognormal around the median
+    ttft_median_ms: float = 300.0
+    ttft_sigma: float = 0.5
+    # Generation speed, with per-request lognormal jitter
+    tokens_per_second: float = 60.0
+    tokens_per_second_sigma: float = 0.2
+    # Completion length as a fraction of max_tokens
+    min_completion_ratio: float = 0.3
+    max_completion_ratio: float = 0.9
+    error_rate_429: float = 0.0
+    error_rate_5xx: float = 0.0
+    retry_after_seconds: float = 1.0
+    # Scale every delay, e.g. 0 for a zero-latency stub
+    time_scale: float = 1.0
+    # Extra per-model delay factor, e.g. {"gpt-4o": 2.5} for a slower strong model
+    model_time_scales: Dict[str, float] = field(default_factory=dict)
+
+
+class OpenAIMockState:
+    """
+    Per-server counters and a deterministic RNG per request
+
+    Each request's RNG is seeded from the server seed, a hash of the request
+    body and how many times that body has been seen, so a replayed workload
+    gets the same latencies, errors and completions regardless of how
+    concurrent requests interleave.
+    """
+
+    def __init__(self, config: OpenAIMockConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.seen: Counter = Counter()
+        self.stats: Counter = Counter()
+
+    def rng_for(self, body: bytes) -> random.Random:
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            occurrence = self.seen[digest]
+            self.seen[digest] += 1
+        return random.Random(f"{self.config.seed}:{digest}:{occurrence}")
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text.split()) * 4 // 3)
+
+
+def plan_completion(request: Dict[str, Any], config: OpenAIMockConfig, rng: random.Random) -> Dict[str, Any]:
+    """
+    Decide the outcome, timing and text of one mock completion
+    """
+    roll = rng.random()
+    if roll < config.error_rate_429:
+        return {"error": 429}
+    if roll < config.error_rate_429 + config.error_rate_5xx:
+        return {"error": rng.choice((500, 502, 503))}
+
+    max_tokens = int(request.get("max_tokens") or 256)
+    ratio = rng.uniform(config.min_completion_ratio, config.max_completion_ratio)
+    completion_tokens = max(1, int(max_tokens * ratio))
+    prompt_text = " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+    prompt_words = [w.strip(".,?!:;").lower() for w in prompt_text.split() if len(w) > 3]
+    words = [rng.choice(prompt_words) if prompt_words and rng.random() < 0.3 else rng.choice(MOCK_VOCABULARY)
+             for _ in range(completion_tokens)]
+    tokens = [(" " if i else "") + word for i, word in enumerate(words)]
+
+    ttft = config.ttft_median_ms / 1000 * math.exp(rng.gauss(0, config.ttft_sigma))
+    rate = config.tokens_per_second * math.exp(rng.gauss(0, config.tokens_per_second_sigma))
+    time_scale = config.time_scale * config.model_time_scales.get(request.get("model"), 1.0)
+    return {
+        "tokens": tokens,
+        "ttft": ttft * time_scale,
+        "token_interval": (1.0 / max(rate, 1e-3)) * time_scale,
+        "usage": {
+            "prompt_tokens": _approx_tokens(prompt_text),
+            "completion_tokens": completion_tokens,
+            "total_tokens": _approx_tokens(prompt_text) + completion_tokens
+        }
+    }
+
+
+class OpenAIMockHandler(BaseHTTPRequestHandler):
+    state: OpenAIMockState = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "owned_by": "mock"} for model in ("gpt-3.5-turbo", "gpt-4o-mini", "gpt-4o")
+            ]})
+        elif self.path.startswith("/mock/stats"):
+            with self.state.lock:
+                self._send_json(200, dict(self.state.stats))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        state = self.state
+        config = state.config
+        request = json.loads(raw or b"{}")
+        plan = plan_completion(request, config, state.rng_for(raw))
+        state.count("requests")
+
+        if "error" in plan:
+            status = plan["error"]
+            state.count(f"errors_{status}")
+            headers = {"Retry-After": f"{config.retry_after_seconds:g}"} if status == 429 else {}
+            error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+            self._send_json(status, {"error": {"message": f"Mock {status}", "type": error_type, "code": error_type}}, headers)
+            return
+
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get("model", "gpt-3.5-turbo")
+        state.count("completion_tokens", plan["usage"]["completion_tokens"])
+        state.count("prompt_tokens", plan["usage"]["prompt_tokens"])
+
+        if not request.get("stream"):
+            time.sleep(plan["ttft"] + plan["token_interval"] * len(plan["tokens"]))
+            try:
+                self._send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(plan["tokens"])},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": plan["usage"]
+                })
+            except (BrokenPipeError, ConnectionResetError):
+                # Client cancelled the request, e.g. the losing side of a hedged request
+                state.count("cancelled_requests")
+                self.close_connection = True
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices: List[Dict[str, Any]], usage: Optional[Dict[str, int]] = None) -> None:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": choices, "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            time.sleep(plan["ttft"])
+            event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i, token in enumerate(plan["tokens"]):
+                if i:
+                    time.sleep(plan["token_interval"])
+                event([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event([], plan["usage"])
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            state.count("cancelled_streams")
+
+
+class LangfuseMockState:
+    """
+    Counts and keeps (up to max_spans) the spans received over OTLP or the ingestion API
+    """
+
+    def __init__(self, max_spans: int = 100000):
+        self.lock = threading.Lock()
+        self.spans: deque = deque(maxlen=max_spans)
+        self.stats: Counter = Counter()
+
+    def add(self, spans: List[Dict[str, Any]], payload_bytes: int, source: str) -> None:
+        with self.lock:
+            self.spans.extend(spans)
+            self.stats["requests"] += 1
+            self.stats["spans"] += len(spans)
+            self.stats["bytes"] += payload_bytes
+            self.stats[f"{source}_requests"] += 1
+
+
+def decode_otlp_spans(body: bytes) -> List[Dict[str, Any]]:
+    """
+    Flatten an OTLP ExportTraceServiceRequest (protobuf) into span dicts
+    """
+    from google.protobuf.json_format import MessageToDict
+    from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+    request = ExportTraceServiceRequest.FromString(body)
+    spans = []
+    for resource_spans in request.resource_spans:
+        for scope_spans in resource_spans.scope_spans:
+            for span in scope_spans.spans:
+                spans.append({
+                    "name": span.name,
+                    "trace_id": span.trace_id.hex(),
+                    "span_id": span.span_id.hex(),
+                    "parent_span_id": span.parent_span_id.hex() or None,
+                    "start_time_unix_nano": span.start_time_unix_nano,
+                    "end_time_unix_nano": span.end_time_unix_nano,
+                    "attributes": {a["key"]: next(iter(a["value"].values()), None)
+                                   for a in MessageToDict(span).get("attributes", [])}
+                })
+    return spans
+
+
+class LangfuseMockHandler(BaseHTTPRequestHandler):
+    state: LangfuseMockState = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/api/public/health"):
+            self._send_json(200, {"status": "OK", "version": "mock"})
+        elif self.path.startswith("/mock/stats"):
+            with self.state.lock:
+                self._send_json(200, dict(self.state.stats))
+        elif self.path.startswith("/mock/spans"):
+            with self.state.lock:
+                self._send_json(200, list(self.state.spans))
+        elif self.path.startswith("/api/public/projects"):
+            self._send_json(200, {"data": [{"id": "mock-project", "name": "mock"}]})
+        else:
+            self._send_json(404, {"message": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        encoding = (self.headers.get("Content-Encoding") or "").lower()
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+
+        if self.path.startswith("/api/public/otel/v1/traces"):
+            try:
+                spans = decode_otlp_spans(body)
+            except ImportError:
+                # opentelemetry-proto not installed: count the request, not its spans
+                spans = []
+            self.state.add(spans, length, "otlp")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path.startswith("/api/public/ingestion"):
+            batch = json.loads(body or b"{}").get("batch", [])
+            self.state.add(batch, length, "ingestion")
+            self._send_json(207, {"successes": [{"id": e.get("id"), "status": 201} for e in batch], "errors": []})
+        else:
+            self._send_json(404, {"message": f"Unknown path {self.path}"})
+
+
+class MockServers:
+    """
+    Both mock servers running on background threads
+    """
+
+    def __init__(self, openai_server: ThreadingHTTPServer, langfuse_server: ThreadingHTTPServer,
+                 openai_state: OpenAIMockState, langfuse_state: LangfuseMockState):
+        self.openai_server = openai_server
+        self.langfuse_server = langfuse_server
+        self.openai_state = openai_state
+        self.langfuse_state = langfuse_state
+        self._threads = [threading.Thread(target=s.serve_forever, daemon=True) for s in (openai_server, langfuse_server)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def openai_base_url(self) -> str:
+        host, port = self.openai_server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def langfuse_host(self) -> str:
+        host, port = self.langfuse_server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> Dict[str, str]:
+        """
+        Environment variables that point the demos at these servers
+        """
+        return {
+            "OPENAI_BASE_URL": self.openai_base_url,
+            "OPENAI_API_KEY": "mock",
+            "LANGFUSE_HOST": self.langfuse_host,
+            "LANGFUSE_PUBLIC_KEY": "pk-lf-mock",
+            "LANGFUSE_SECRET_KEY": "sk-lf-mock"
+        }
+
+    def stop(self) -> None:
+        for server in (self.openai_server, self.langfuse_server):
+            server.shutdown()
+            server.server_close()
+
+
+def _make_handler(base, state):
+    return type(base.__name__, (base,), {"state": state})
+
+
+def start_mock_servers(config: Optional[OpenAIMockConfig] = None, host: str = "127.0.0.1",
+                       openai_port: int = 0, langfuse_port: int = 0) -> MockServers:
+    """
+    Start both servers in-process; port 0 picks a free port
+    """
+    openai_state = OpenAIMockState(config or OpenAIMockConfig())
+    langfuse_state = LangfuseMockState()
+    openai_server = ThreadingHTTPServer((host, openai_port), _make_handler(OpenAIMockHandler, openai_state))
+    langfuse_server = ThreadingHTTPServer((host, langfuse_port), _make_handler(LangfuseMockHandler, langfuse_state))
+    openai_server.daemon_threads = True
+    langfuse_server.daemon_threads = True
+    return MockServers(openai_server, langfuse_server, openai_state, langfuse_state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI- and Langfuse-compatible mock servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=8001)
+    parser.add_argument("--langfuse-port", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ttft-median-ms", type=float, default=300.0)
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="Lognormal sigma of time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply all delays (0 = no latency)")
+    args = parser.parse_args()
+
+    config = OpenAIMockConfig(
+        seed=args.seed,
+        ttft_median_ms=args.ttft_median_ms,
+        ttft_sigma=args.ttft_sigma,
+        tokens_per_second=args.tokens_per_second,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        retry_after_seconds=args.retry_after,
+        time_scale=args.time_scale
+    )
+    servers = start_mock_servers(config, args.host, args.openai_port, args.langfuse_port)
+
+    print("🧪 Mock servers running")
+    print(f"   OpenAI:   {servers.openai_base_url}  (stats: {servers.openai_base_url[:-3]}/mock/stats)")
+    print(f"   Langfuse: {servers.langfuse_host}  (stats: {servers.langfuse_host}/mock/stats)")
+    print("\nPoint the demos at them with:")
+    for name, value in servers.environment().items():
+        print(f"   export {name}={value}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servers.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,24 +5,23 @@ This demonstrates a more complex LLM pipeline with document retrieval and genera
 """
 
 import os
-from dotenv import load_dotenv
-from langfuse import Langfuse
-import openai
+from clients import close_async_openai, get_async_openai, get_langfuse, load_env, prewarm, shutdown
+from tracing import start_trace
 import time
 import random
-from typing import List, Dict
+from typing import TYPE_CHECKING, List, Dict, Tuple, Union
+from context_packer import count_tokens, default_token_budget, pack_context
+from llm import async_chat_completion, chat_completion, print_token, streaming_enabled
+from metrics import record_stage
+from routing import get_router, retrieval_confidence
 
-# Load environment variables
-load_dotenv()
+if TYPE_CHECKING:
+    from retrieval import DenseIndex, InvertedIndex, SegmentedIndex
 
-# Initialize Langfuse
-langfuse = Langfuse(
-    public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
-    host=os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")
-)
+# Load environment variables
+load_env()
 
-# Sample knowledge base (in a real app, this would be a vector database)
+# Sample knowledge base, indexed lazily by get_knowledge_index()
 KNOWLEDGE_BASE = {
     "kubernetes": [
         "Kubernetes is an open-source container orchestration platform that automates the deployment, scaling, and management of containerized applications.",
@@ -46,95 +45,230 @@ KNOWLEDGE_BASE = {
     ]
 }
 
-def retrieve_relevant_documents(query: str, top_k: int = 3, trace=None) -> List[str]:
+# Retrieval mode: "keyword" (BM25 inverted index) or "dense" (memory-mapped embeddings)
+RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "keyword")
+DENSE_INDEX_PATH = os.getenv("RAG_DENSE_INDEX_PATH", ".rag_index/knowledge")
+
+# Optional segmented index maintained by ingest.py; empty = index KNOWLEDGE_BASE in memory
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", "")
+
+# Optional cap on prompt tokens for retrieved context (0 = model window minus completion)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "0"))
+
+_knowledge_index = None
+_dense_index = None
+
+def get_knowledge_index() -> "Union[InvertedIndex, SegmentedIndex]":
+    """
+    The ingested segmented index when RAG_INDEX_DIR holds one, else an index over KNOWLEDGE_BASE built on first use
+    """
+    global _knowledge_index
+    if INDEX_DIR:
+        from ingest import get_index_store
+        index = get_index_store(INDEX_DIR).current()
+        if index.segments:
+            return index
+    if _knowledge_index is None:
+        # NumPy comes in with retrieval; importing it here keeps it off the startup path
+        from retrieval import build_index
+        _knowledge_index = build_index(KNOWLEDGE_BASE)
+    return _knowledge_index
+
+def get_dense_index(embedder=None) -> "DenseIndex":
+    """
+    Open the memory-mapped dense index, building it on disk if missing or stale
+
+    The default embedder is the cached embedding service, so a rebuild only embeds passages it has not seen.
+    """
+    global _dense_index
+    if _dense_index is None:
+        from embeddings import get_embedding_service
+        from retrieval import open_dense_index
+        passages = [doc for docs in KNOWLEDGE_BASE.values() for doc in docs]
+        _dense_index = open_dense_index(passages, DENSE_INDEX_PATH, embedder or get_embedding_service())
+    return _dense_index
+
+def prewarm_rag_demo():
+    """
+    Pre-warm hook: create the shared clients and load the retrieval index before the first query
+    """
+    prewarm(get_dense_index if RETRIEVAL_MODE == "dense" else get_knowledge_index)
+
+def retrieve_relevant_documents(query: str, top_k: int = 3, trace=None, mode: str = None) -> List[str]:
+    """
+    Retrieve the top_k passages for a query, by BM25 keyword search or dense similarity
     """
-    Simulate document retrieval from a knowledge base
+    return retrieve_with_confidence(query, top_k, trace, mode)[0]
+
+def retrieve_with_confidence(query: str, top_k: int = 3, trace=None, mode: str = None) -> Tuple[List[str], float]:
     """
+    Retrieve the top_k passages along with the retrieval confidence the model router uses
+    """
+    from retrieval import timed_search
+    from retrieval_cache import get_retrieval_cache
+    mode = mode or RETRIEVAL_MODE
+    started = time.perf_counter()
+    
     # Create a span for document retrieval
     retrieval_span = trace.start_span(name="document_retrieval", input=query) if trace else None
     
-    query_lower = query.lower()
-    relevant_docs = []
-    
-    # Simple keyword matching (in reality, you'd use vector similarity)
-    for topic, docs in KNOWLEDGE_BASE.items():
-        if any(keyword in query_lower for keyword in topic.split()):
-            relevant_docs.extend(docs)
-    
-    # Return top_k documents
-    result = relevant_docs[:top_k]
+    index = get_dense_index() if mode == "dense" else get_knowledge_index()
+    cache = get_retrieval_cache()
+    cached = cache.get(mode, query, top_k, index) if cache else None
+    embedding = None
+    scoring_ms = 0.0
+    if cached:
+        hits, result = cached["hits"], cached["documents"]
+    elif mode == "dense":
+        query_vector = query
+        if hasattr(index.embedder, "embed_with_stats"):
+            vectors, embedding = index.embedder.embed_with_stats([query])
+            query_vector = vectors[0]
+        hits, scoring_ms = timed_search(index, query_vector, top_k)
+        result = [index.passage(doc_id) for doc_id, _ in hits]
+    else:
+        hits, scoring_ms = timed_search(index, query, top_k)
+        result = [index.passage(doc_id) for doc_id, _ in hits]
+    if cache and not cached:
+        cache.put(mode, query, top_k, index, hits, result)
+    confidence = retrieval_confidence([score for _, score in hits], mode)
     
     if retrieval_span:
-        retrieval_span.update(output=result, metadata={"total_docs": len(result)})
+        metadata = {
+            "mode": mode,
+            "total_docs": len(result),
+            "doc_ids": [doc_id for doc_id, _ in hits],
+            "scores": [round(score, 4) for _, score in hits],
+            "index_size": index.stats(),
+            "scoring_ms": round(scoring_ms, 3),
+            "cache_hit": bool(cached),
+            "confidence": round(confidence, 4)
+        }
+        if cached and cached["revalidated"]:
+            # Served across an index version change after checking the new segments
+            metadata["cache_revalidated"] = True
+        if embedding is not None:
+            # Query embedding cache hits/misses and the batch sizes its misses were embedded in
+            metadata["embedding"] = embedding
+        retrieval_span.update(output=result, metadata=metadata)
         retrieval_span.end()
     
-    return result
+    record_stage("document_retrieval", time.perf_counter() - started)
+    return result, confidence
 
-def assemble_context(documents: List[str], query: str, trace=None) -> str:
+def assemble_context(documents: List[str], query: str, trace=None, token_budget: int = None,
+                     model: str = "gpt-3.5-turbo") -> str:
     """
-    Assemble retrieved documents into context for the LLM
+    Pack ranked documents into the LLM prompt within the model's token budget
     """
+    started = time.perf_counter()
     # Create a span for context assembly
     context_span = trace.start_span(name="context_assembly", input={"documents": documents, "query": query}) if trace else None
     
-    context = "Relevant information:\n\n"
-    for i, doc in enumerate(documents, 1):
-        context += f"{i}. {doc}\n\n"
-    
-    context += f"Question: {query}\n\n"
-    context += "Please answer the question based on the provided information. If the information doesn't contain enough details, say so."
+    if token_budget is None:
+        token_budget = CONTEXT_TOKEN_BUDGET or default_token_budget(
+            model, max_tokens=600, reserved=count_tokens(ANSWER_SYSTEM_PROMPT, model)
+        )
+    from retrieval_cache import get_retrieval_cache
+    cache = get_retrieval_cache()
+    cache_key = cache.context_key(documents, query, token_budget, model) if cache else None
+    packed = cache.get_context(cache_key) if cache else None
+    cache_hit = packed is not None
+    if not cache_hit:
+        packed = pack_context(documents, query, token_budget, model)
+        if cache:
+            cache.put_context(cache_key, packed)
     
     if context_span:
-        context_span.update(output=context, metadata={"doc_count": len(documents)})
+        context_span.update(
+            output=packed.prompt,
+            metadata={
+                "doc_count": len(packed.documents),
+                "tokens_used": packed.tokens_used,
+                "token_budget": token_budget,
+                "dropped_documents": packed.dropped_count,
+                "dropped_duplicates": packed.dropped_duplicates,
+                "dropped_over_budget": packed.dropped_over_budget,
+                "cache_hit": cache_hit
+            }
+        )
         context_span.end()
     
-    return context
+    record_stage("context_assembly", time.perf_counter() - started)
+    return packed.prompt
+
+# Failed generations are returned as an answer starting with this
+ANSWER_ERROR_PREFIX = "Error generating answer"
+
+ANSWER_SYSTEM_PROMPT = "You are a helpful AI assistant that answers questions based on provided context. Be accurate and cite specific information when possible."
+
+def _answer_messages(context: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": context}
+    ]
 
-def generate_answer(context: str, model: str = "gpt-3.5-turbo", trace=None) -> str:
+def _answer_failed(generation_span, error: Exception) -> None:
+    if generation_span:
+        generation_span.update(output=f"{ANSWER_ERROR_PREFIX}: {str(error)}", level="ERROR")
+        generation_span.end()
+
+def generate_answer(context: str, model: str = None, trace=None, on_token=None,
+                    retrieval_confidence: float = None) -> str:
     """
-    Generate answer using LLM with retrieved context
+    Generate answer using LLM with retrieved context; pass on_token to stream tokens as they arrive
+
+    Without an explicit model the router picks one from the prompt size and
+    the retrieval confidence, and may escalate a rejected answer.
     """
-    # Create a generation observation
-    generation_span = trace.start_observation(name="llm_generation", model=model, input=context, as_type="generation") if trace else None
-    
-    try:
-        response = openai.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant that answers questions based on provided context. Be accurate and cite specific information when possible."},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.3,  # Lower temperature for more factual responses
-            max_tokens=600
-        )
-        
-        result = response.choices[0].message.content
-        
+    started = time.perf_counter()
+    router = get_router()
+    decision = router.route(ANSWER_SYSTEM_PROMPT + "\n" + context, max_tokens=600,
+                            confidence=retrieval_confidence, model=model)
+
+    def attempt(model: str, parent) -> str:
+        # Create a generation observation
+        generation_span = parent.start_observation(name="llm_generation", model=model, input=context, as_type="generation") if parent else None
+        try:
+            result = chat_completion(
+                model=model,
+                messages=_answer_messages(context),
+                temperature=0.3,  # Lower temperature for more factual responses
+                max_tokens=600,
+                generation=generation_span,
+                on_token=on_token
+            )
+        except Exception as e:
+            _answer_failed(generation_span, e)
+            raise
         if generation_span:
             generation_span.update(output=result)
             generation_span.end()
-        
+        return result
+    
+    try:
+        result = router.run(decision, attempt, context, trace, reference=context, verify=on_token is None)
+        record_stage("llm_generation", time.perf_counter() - started)
         return result
     except Exception as e:
-        error_msg = f"Error generating answer: {str(e)}"
-        if generation_span:
-            generation_span.update(output=error_msg, level="ERROR")
-            generation_span.end()
-        return error_msg
+        record_stage("llm_generation", time.perf_counter() - started, error=True)
+        return f"{ANSWER_ERROR_PREFIX}: {str(e)}"
 
-def rag_pipeline(query: str) -> Dict[str, any]:
+def rag_pipeline(query: str, on_token=None) -> Dict[str, any]:
     """
     Complete RAG pipeline with tracing
     """
+    started = time.perf_counter()
+    failed = True
     # Start main span for RAG pipeline
-    trace = langfuse.start_span(name="rag_pipeline", input=query)
+    trace = start_trace(get_langfuse(), "rag_pipeline", input=query)
     
     try:
         print(f"🔍 Processing query: {query}")
         
         # Step 1: Retrieve relevant documents
         print("📚 Retrieving relevant documents...")
-        documents = retrieve_relevant_documents(query, trace=trace)
+        documents, confidence = retrieve_with_confidence(query, trace=trace)
         print(f"Found {len(documents)} relevant documents")
         
         # Step 2: Assemble context
@@ -143,7 +277,7 @@ def rag_pipeline(query: str) -> Dict[str, any]:
         
         # Step 3: Generate answer
         print("🤖 Generating answer...")
-        answer = generate_answer(context, trace=trace)
+        answer = generate_answer(context, trace=trace, on_token=on_token, retrieval_confidence=confidence)
         
         result = {
             "query": query,
@@ -154,12 +288,127 @@ def rag_pipeline(query: str) -> Dict[str, any]:
         
         # Update trace with final result
         trace.update(name="rag_pipeline", output=result, metadata={"doc_count": len(documents)})
+        failed = answer.startswith(ANSWER_ERROR_PREFIX)
         
         return result
     finally:
         trace.end()
+        record_stage("rag_pipeline", time.perf_counter() - started, error=failed)
+
+# Async variants
+#
+# Spans are always started from an explicit parent object (never from the
+# ambient "current span"), so concurrent tasks cannot adopt each other's
+# spans and every child stays under its own rag_pipeline trace. asyncio is
+# imported inside them so the synchronous demo never pays for loading it.
+
+async def async_retrieve_relevant_documents(query: str, top_k: int = 3, trace=None, mode: str = None) -> List[str]:
+    """
+    Retrieval off the event loop, so index scoring does not stall other in-flight queries
+    """
+    return (await async_retrieve_with_confidence(query, top_k, trace, mode))[0]
+
+async def async_retrieve_with_confidence(query: str, top_k: int = 3, trace=None,
+                                         mode: str = None) -> Tuple[List[str], float]:
+    import asyncio
+    import contextvars
+    import functools
+    # What asyncio.to_thread() does: the default executor, running in a copy of the caller's context
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(context.run, retrieve_with_confidence, query, top_k, trace, mode))
+
+async def async_generate_answer(context: str, client, model: str = None, trace=None,
+                                retrieval_confidence: float = None) -> str:
+    """
+    Generate answer with a shared AsyncOpenAI client
+    """
+    started = time.perf_counter()
+    router = get_router()
+    decision = router.route(ANSWER_SYSTEM_PROMPT + "\n" + context, max_tokens=600,
+                            confidence=retrieval_confidence, model=model)
+
+    async def attempt(model: str, parent) -> str:
+        generation_span = parent.start_observation(name="llm_generation", model=model, input=context, as_type="generation") if parent else None
+        try:
+            result = await async_chat_completion(
+                model=model,
+                messages=_answer_messages(context),
+                client=client,
+                temperature=0.3,
+                max_tokens=600,
+                generation=generation_span
+            )
+        except Exception as e:
+            _answer_failed(generation_span, e)
+            raise
+        if generation_span:
+            generation_span.update(output=result)
+            generation_span.end()
+        return result
+    
+    try:
+        result = await router.arun(decision, attempt, context, client, trace, reference=context)
+        record_stage("llm_generation", time.perf_counter() - started)
+        return result
+    except Exception as e:
+        record_stage("llm_generation", time.perf_counter() - started, error=True)
+        return f"{ANSWER_ERROR_PREFIX}: {str(e)}"
+
+async def async_rag_pipeline(query: str, client, semaphore: "asyncio.Semaphore" = None) -> Dict[str, any]:
+    """
+    Complete RAG pipeline with tracing, bounded by an optional concurrency semaphore
+    """
+    import asyncio
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+    
+    async with semaphore:
+        started = time.perf_counter()
+        failed = True
+        trace = start_trace(get_langfuse(), "rag_pipeline", input=query, metadata={"async": True})
+        
+        try:
+            print(f"🔍 Processing query: {query}")
+            documents, confidence = await async_retrieve_with_confidence(query, trace=trace)
+            context = assemble_context(documents, query, trace=trace)
+            answer = await async_generate_answer(context, client, trace=trace, retrieval_confidence=confidence)
+            
+            result = {
+                "query": query,
+                "retrieved_documents": documents,
+                "context": context,
+                "answer": answer
+            }
+            
+            trace.update(name="rag_pipeline", output=result, metadata={"doc_count": len(documents), "async": True})
+            failed = answer.startswith(ANSWER_ERROR_PREFIX)
+            
+            return result
+        finally:
+            trace.end()
+            record_stage("rag_pipeline", time.perf_counter() - started, error=failed)
 
-def run_rag_demo():
+async def async_rag_batch(queries: List[str], concurrency: int = 4) -> List[Dict[str, any]]:
+    """
+    Run many queries concurrently over one AsyncOpenAI client; results come back in input order
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    client = get_async_openai()
+    try:
+        return await asyncio.gather(*(async_rag_pipeline(query, client, semaphore) for query in queries))
+    finally:
+        await close_async_openai()
+
+def run_rag_batch(queries: List[str], concurrency: int = 4) -> List[Dict[str, any]]:
+    """
+    Synchronous entry point for async_rag_batch
+    """
+    import asyncio
+    return asyncio.run(async_rag_batch(queries, concurrency))
+
+def run_rag_demo(concurrency: int = None):
     """
     Run RAG demo with sample queries
     """
@@ -173,16 +422,35 @@ def run_rag_demo():
         "Explain the benefits and challenges of microservices architecture"
     ]
     
+    if concurrency is None:
+        concurrency = int(os.getenv("RAG_CONCURRENCY", "1"))
+    
+    if concurrency > 1:
+        # Run all queries concurrently instead of one blocking call at a time
+        results = run_rag_batch(sample_queries, concurrency)
+    else:
+        results = None
+    
     for i, query in enumerate(sample_queries, 1):
         print(f"\n{'='*20} Query {i} {'='*20}")
         
-        # Add realistic delay
-        time.sleep(random.uniform(2, 4))
-        
-        result = rag_pipeline(query)
+        if results is not None:
+            result = results[i - 1]
+            print(f"\n📝 Answer:")
+            print(result["answer"])
+        else:
+            # Add realistic delay
+            time.sleep(random.uniform(2, 4))
+            
+            if streaming_enabled():
+                print("\n📝 Answer:")
+                result = rag_pipeline(query, on_token=print_token)
+                print()
+            else:
+                result = rag_pipeline(query)
+                print(f"\n📝 Answer:")
+                print(result["answer"])
         
-        print(f"\n📝 Answer:")
-        print(result["answer"])
         print(f"\n📊 Retrieved {len(result['retrieved_documents'])} documents")
         print("-" * 60)
     
@@ -201,4 +469,4 @@ if __name__ == "__main__":
     run_rag_demo()
     
     # Flush any remaining traces
-    langfuse.flush()
+    shutdown()
@@ -0,0 +1,405 @@
+"""
+Adaptive Rate Limiter and Retry Scheduler
+Client-side requests/min and tokens/min buckets, AIMD concurrency control and jittered retries for every LLM call.
+
+Each call first reserves one request and its estimated tokens (prompt plus
+max_tokens) from the token buckets, then waits for a concurrency slot; every
+retry is admitted through the buckets again. A streamed call holds its slot
+until the stream is consumed or closed, so long streams count as in flight
+and their full duration feeds the latency signal. The concurrency limit
+grows by one per window of successful calls and halves on a 429 or when
+latency passes the target (AIMD). Retryable failures (429, 5xx, timeouts,
+connection errors) are retried with full jitter, or after Retry-After when
+the server sends it. Each attempt of a retried call is recorded as a child
+observation of the call's generation.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+RETRYABLE_STATUS = (408, 409, 429)
+
+
+class TokenBucket:
+    """
+    Bucket refilled at rate_per_minute; reserve() goes into debt so waiters are served in order
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount now and return the seconds to wait before using it
+        """
+        with self._lock:
+            self._refill()
+            self._level -= amount
+            return 0.0 if self._level >= 0 else -self._level / self.rate
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level + amount)
+
+
+class AIMDConcurrency:
+    """
+    Concurrency limit with additive increase on healthy calls and multiplicative decrease on overload
+
+    Sync and async callers queue in one FIFO; a freed slot is handed straight
+    to the longest waiter, so a newly arriving caller cannot jump the queue.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32, backoff: float = 0.5,
+                 cooldown: float = 2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        # One grant callback per queued caller
+        self._waiters: Deque[Callable[[], None]] = deque()
+        self._lock = threading.Lock()
+
+    def _try_take(self) -> bool:
+        # Called with _lock held
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            return self._try_take()
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._try_take():
+                return
+            granted = threading.Event()
+            self._waiters.append(granted.set)
+        granted.wait()
+
+    async def acquire_async(self) -> None:
+        """
+        acquire() for coroutines: waits on a future that release() resolves, without blocking the event loop
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant() -> None:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            if self._try_take():
+                return
+            self._waiters.append(grant)
+        try:
+            await future
+        except BaseException:
+            with self._lock:
+                if grant in self._waiters:
+                    self._waiters.remove(grant)
+                else:
+                    # The slot was handed over as the wait was cancelled; pass it on
+                    self.in_flight -= 1
+                    self._hand_over()
+            raise
+
+    def _hand_over(self) -> None:
+        # Called with _lock held; free slots go to waiters in arrival order
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._waiters.popleft()()
+
+    def release(self, overloaded: bool, adjust: bool = True) -> None:
+        """
+        Free a slot; adjust=False for calls that were abandoned and say nothing about upstream health
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if adjust and overloaded:
+                # One decrease per cooldown, so a burst of 429s from one overload halves the limit once
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif adjust:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._hand_over()
+
+
+def classify_error(error: Exception) -> Dict[str, Any]:
+    """
+    Whether an OpenAI SDK error is worth retrying, its HTTP status and any Retry-After delay
+    """
+    import openai
+
+    status = getattr(error, "status_code", None)
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except ValueError:
+            retry_after = None
+    retryable = (
+        isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+        or status in RETRYABLE_STATUS or (status is not None and status >= 500)
+    )
+    return {"retryable": retryable, "status": status, "rate_limited": status == 429, "retry_after": retry_after}
+
+
+class HeldSlot:
+    """
+    A concurrency slot kept after call()/acall(hold=True) returns, e.g. while a stream is read; release it once
+    """
+
+    def __init__(self, scheduler: "LLMScheduler", started: float):
+        self.scheduler = scheduler
+        self.started = started
+        self.released = False
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        """
+        Free the slot; an error mid-stream is judged like a failed call, an abandoned stream says nothing
+        """
+        if self.released:
+            return
+        self.released = True
+        concurrency = self.scheduler.concurrency
+        if error is None:
+            concurrency.release(overloaded=self.scheduler._overloaded((time.perf_counter() - self.started) * 1000))
+        elif isinstance(error, Exception):
+            concurrency.release(overloaded=classify_error(error)["rate_limited"])
+        else:
+            concurrency.release(overloaded=False, adjust=False)
+
+
+class LLMScheduler:
+    """
+    Shared admission control and retry loop for LLM calls
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, max_retries: int = 4,
+                 base_delay: float = 0.5, max_delay: float = 30.0, latency_target_ms: float = 0,
+                 concurrency: Optional[AIMDConcurrency] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target_ms = latency_target_ms
+        self.concurrency = concurrency or AIMDConcurrency()
+        self.retries = 0
+        self.rate_limited = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            requests_per_minute=float(os.getenv("LLM_RPM_LIMIT", "0")),
+            tokens_per_minute=float(os.getenv("LLM_TPM_LIMIT", "0")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5")),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_SECONDS", "30")),
+            latency_target_ms=float(os.getenv("LLM_LATENCY_TARGET_MS", "15000")),
+            concurrency=AIMDConcurrency(
+                initial=int(os.getenv("LLM_INITIAL_CONCURRENCY", "4")),
+                minimum=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+                maximum=int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+            )
+        )
+
+    def estimate_tokens(self, messages: List[Dict[str, str]], model: str, max_tokens: int) -> int:
+        """
+        Prompt tokens plus max_tokens; 0 without a tokens/min limit, so unlimited setups skip tokenizing
+        """
+        if self.tokens is None:
+            return 0
+        from context_packer import count_tokens
+        return sum(count_tokens(m.get("content") or "", model) for m in messages) + max_tokens
+
+    def admission_delay(self, estimated_tokens: int) -> float:
+        """
+        Reserve one request and estimated_tokens; returns the seconds to wait before sending
+        """
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.reserve(1)
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(estimated_tokens))
+        return delay
+
+    def settle_tokens(self, estimated_tokens: int, used_tokens: Optional[int]) -> None:
+        """
+        Return the unused part of a token reservation once actual usage is known
+        """
+        if self.tokens is not None and used_tokens is not None and used_tokens < estimated_tokens:
+            self.tokens.refund(estimated_tokens - used_tokens)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        # Full jitter: uniform over the exponential window
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _retry_delay(self, attempt: int, error: Dict[str, Any], estimated_tokens: int) -> float:
+        """
+        Backoff before a retry, or longer if the buckets say so; a retry resends the whole prompt, so it is admitted again
+        """
+        return max(self.backoff_delay(attempt, error["retry_after"]), self.admission_delay(estimated_tokens))
+
+    def _overloaded(self, elapsed_ms: float) -> bool:
+        return self.latency_target_ms > 0 and elapsed_ms > self.latency_target_ms
+
+    def _record_attempt(self, generation, attempt: int, started: float, error: Optional[Dict[str, Any]] = None,
+                        message: str = None, delay: float = None):
+        if not generation:
+            return
+        metadata = {"attempt": attempt, "concurrency_limit": round(self.concurrency.limit, 2),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+        span = generation.start_observation(name="llm_attempt", as_type="span", metadata=metadata)
+        if error is not None:
+            span.update(level="WARNING", status_message=message, metadata={
+                "status_code": error["status"], "retry_after_s": error["retry_after"],
+                "backoff_s": round(delay, 3) if delay is not None else None
+            })
+        span.end()
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int = 0, generation=None, hold: bool = False) -> Any:
+        """
+        Run fn under the rate limits, retrying retryable failures; fn's last error is raised when retries run out
+
+        With hold=True the concurrency slot stays taken after fn returns and
+        (result, HeldSlot) is returned; the caller releases it when done.
+        """
+        waited = self.admission_delay(estimated_tokens)
+        if waited > 0:
+            time.sleep(waited)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.concurrency.acquire()
+            started = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                error = classify_error(e)
+                self.concurrency.release(overloaded=error["rate_limited"])
+                if not error["retryable"] or attempt > self.max_retries:
+                    if attempt > 1:
+                        self._record_attempt(generation, attempt, started, error, str(e))
+                    raise
+                delay = self._retry_delay(attempt, error, estimated_tokens)
+                self._count_retry(error)
+                self._record_attempt(generation, attempt, started, error, str(e), delay)
+                time.sleep(delay)
+                waited += delay
+                continue
+            except BaseException:
+                self.concurrency.release(overloaded=False, adjust=False)
+                raise
+            if attempt > 1:
+                self._record_attempt(generation, attempt, started)
+            self._annotate(generation, attempt, waited)
+            if hold:
+                return result, HeldSlot(self, started)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.concurrency.release(overloaded=self._overloaded(elapsed_ms))
+            return result
+
+    async def acall(self, fn: Callable[[], Any], estimated_tokens: int = 0, generation=None, hold: bool = False) -> Any:
+        """
+        Async variant of call(); fn returns an awaitable
+        """
+        import asyncio
+
+        waited = self.admission_delay(estimated_tokens)
+        if waited > 0:
+            await asyncio.sleep(waited)
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.concurrency.acquire_async()
+            started = time.perf_counter()
+            try:
+                result = await fn()
+            except Exception as e:
+                error = classify_error(e)
+                self.concurrency.release(overloaded=error["rate_limited"])
+                if not error["retryable"] or attempt > self.max_retries:
+                    if attempt > 1:
+                        self._record_attempt(generation, attempt, started, error, str(e))
+                    raise
+                delay = self._retry_delay(attempt, error, estimated_tokens)
+                self._count_retry(error)
+                self._record_attempt(generation, attempt, started, error, str(e), delay)
+                await asyncio.sleep(delay)
+                waited += delay
+                continue
+            except BaseException:
+                # Cancelled (e.g. the losing side of a hedged request); the slot must not leak
+                self.concurrency.release(overloaded=False, adjust=False)
+                raise
+            if attempt > 1:
+                self._record_attempt(generation, attempt, started)
+            self._annotate(generation, attempt, waited)
+            if hold:
+                return result, HeldSlot(self, started)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.concurrency.release(overloaded=self._overloaded(elapsed_ms))
+            return result
+
+    def _count_retry(self, error: Dict[str, Any]) -> None:
+        self.retries += 1
+        if error["rate_limited"]:
+            self.rate_limited += 1
+
+    def _annotate(self, generation, attempts: int, waited: float) -> None:
+        if generation:
+            generation.update(metadata={"attempts": attempts, "rate_limit_wait_ms": round(waited * 1000, 1)})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """
+    Process-wide scheduler configured from LLM_* environment variables
+    """
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler.from_env()
+        return _scheduler
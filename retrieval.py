@@ -0,0 +1,571 @@
+"""
+Retrieval Engine for the RAG Demo
+A tokenized inverted index with BM25 scoring, plus a dense mode over a memory-mapped embedding matrix.
+"""
+
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import re
+import shutil
+import time
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Very common English words carry no ranking signal and only lengthen postings lists
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in into is it its me my
+of on or our so that the their them then there these they this to was we what when
+where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase, split on non-alphanumerics and drop stopwords
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class InvertedIndex:
+    """
+    Inverted index with precomputed BM25 impact scores
+
+    Postings are appended to compact arrays while documents are added and are
+    converted to NumPy arrays of (doc id, BM25 impact) on first search, so a
+    query only has to sum the impacts of its terms and pick the top-k.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.passages: List[str] = []
+        self.topics: List[str] = []
+        self._doc_lengths = array("I")
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._impacts: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._posting_count = 0
+        self._deleted = None
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def passage(self, doc_id: int) -> str:
+        return self.passages[doc_id]
+
+    def live_count(self) -> int:
+        """
+        Documents not deleted
+        """
+        if self._deleted is None:
+            return len(self.passages)
+        return len(self.passages) - int(self._deleted.sum())
+
+    def delete(self, doc_id: int) -> None:
+        """
+        Tombstone a document: it keeps its id and postings but never matches again
+        """
+        deleted = self._deleted
+        if deleted is None or len(deleted) < len(self.passages):
+            deleted = np.zeros(len(self.passages), dtype=bool)
+            if self._deleted is not None:
+                deleted[:len(self._deleted)] = self._deleted
+        deleted[doc_id] = True
+        self._deleted = deleted
+
+    def is_deleted(self, doc_id: int) -> bool:
+        return self._deleted is not None and doc_id < len(self._deleted) and bool(self._deleted[doc_id])
+
+    def add(self, text: str, topic: str = "") -> int:
+        """
+        Tokenize a passage and append it to the postings lists, returning its doc id
+        """
+        doc_id = len(self.passages)
+        self.passages.append(text)
+        self.topics.append(topic)
+
+        terms = Counter(tokenize(text))
+        self._doc_lengths.append(sum(terms.values()))
+        self._posting_count += len(terms)
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(doc_id)
+            postings[1].append(min(tf, 0xFFFF))
+
+        self._dirty = True
+        return doc_id
+
+    def add_many(self, passages: Iterable[Tuple[str, str]]) -> None:
+        """
+        Add (topic, passage) pairs in bulk
+        """
+        for topic, text in passages:
+            self.add(text, topic)
+
+    def _finalize(self) -> None:
+        """
+        Convert raw term frequencies into BM25 impact scores
+        """
+        doc_count = len(self.passages)
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32).astype(np.float32)
+        avg_length = float(doc_lengths.mean()) if doc_count else 0.0
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / max(avg_length, 1.0))
+
+        impacts = {}
+        for term, (doc_ids, tfs) in self._postings.items():
+            ids = np.frombuffer(doc_ids, dtype=np.uint32).copy()
+            tf = np.frombuffer(tfs, dtype=np.uint16).astype(np.float32)
+            df = len(ids)
+            idf = np.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            impacts[term] = (ids, (idf * tf * (self.k1 + 1) / (tf + length_norm[ids])).astype(np.float32))
+
+        self._impacts = impacts
+        self._dirty = False
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Return up to top_k (doc id, BM25 score) pairs, best first
+        """
+        if self._dirty:
+            self._finalize()
+
+        postings = [self._impacts[term] for term in set(tokenize(query)) if term in self._impacts]
+        if not postings or top_k <= 0:
+            return []
+
+        # Only documents sharing at least one term with the query are candidates
+        deleted = self._deleted
+        if len(postings) == 1 and deleted is None:
+            candidates, candidate_scores = postings[0]
+        else:
+            scores = np.zeros(len(self.passages), dtype=np.float32)
+            for ids, impacts in postings:
+                scores[ids] += impacts
+            if deleted is not None:
+                # BM25 impacts are positive, so a zero score drops tombstoned documents from the candidates
+                scores[:len(deleted)][deleted] = 0
+            candidates = np.flatnonzero(scores)
+            candidate_scores = scores[candidates]
+
+        if len(candidates) > top_k:
+            # Partial sort: O(n) selection of the k best, then sort only those
+            best = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(-candidate_scores[best], kind="stable")]
+
+        return [(int(candidates[i]), float(candidate_scores[i])) for i in best]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Index size figures for tracing metadata
+        """
+        return {
+            "documents": self.live_count(),
+            "terms": len(self._postings),
+            "postings": self._posting_count,
+        }
+
+
+def build_index(knowledge_base: Dict[str, List[str]]) -> InvertedIndex:
+    """
+    Build an inverted index over every passage of a topic -> passages mapping
+    """
+    index = InvertedIndex()
+    index.add_many((topic, doc) for topic, docs in knowledge_base.items() for doc in docs)
+    return index
+
+
+def merge_indexes(parts: Sequence[Tuple[InvertedIndex, Sequence[int]]]) -> InvertedIndex:
+    """
+    New index holding the listed documents of each index, in order, without re-tokenizing
+
+    Postings are remapped to the new doc ids and concatenated, so merging
+    costs a few array operations per term instead of re-reading every passage.
+    """
+    merged = InvertedIndex(parts[0][0].k1, parts[0][0].b) if parts else InvertedIndex()
+    chunks: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    for index, doc_ids in parts:
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        remap = np.full(len(index), -1, dtype=np.int64)
+        remap[doc_ids] = np.arange(len(merged.passages), len(merged.passages) + len(doc_ids))
+        merged.passages.extend(index.passages[doc_id] for doc_id in doc_ids)
+        merged.topics.extend(index.topics[doc_id] for doc_id in doc_ids)
+        merged._doc_lengths.frombytes(np.frombuffer(index._doc_lengths, dtype=np.uint32)[doc_ids].tobytes())
+        for term, (ids, tfs) in index._postings.items():
+            new_ids = remap[np.frombuffer(ids, dtype=np.uint32)]
+            keep = new_ids >= 0
+            if keep.any():
+                chunks.setdefault(term, []).append(
+                    (new_ids[keep].astype(np.uint32), np.frombuffer(tfs, dtype=np.uint16)[keep])
+                )
+    for term, pieces in chunks.items():
+        ids, tfs = array("I"), array("H")
+        for piece_ids, piece_tfs in pieces:
+            ids.frombytes(piece_ids.tobytes())
+            tfs.frombytes(piece_tfs.tobytes())
+        merged._postings[term] = (ids, tfs)
+        merged._posting_count += len(ids)
+    merged._dirty = True
+    return merged
+
+
+def save_index(index: InvertedIndex, path: str) -> None:
+    """
+    Write a finalized index to path, atomically
+
+    All postings and impacts go into a few flat arrays with per-term offsets,
+    which pickles far faster than one small array per term.
+    """
+    if index._dirty:
+        index._finalize()
+    terms = list(index._impacts)
+    lengths = [len(index._impacts[term][0]) for term in terms]
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    state = {
+        "k1": index.k1,
+        "b": index.b,
+        "passages": index.passages,
+        "topics": index.topics,
+        "doc_lengths": index._doc_lengths.tobytes(),
+        "terms": terms,
+        "offsets": offsets,
+        "ids": np.concatenate([index._impacts[term][0] for term in terms]) if terms else np.zeros(0, np.uint32),
+        "tfs": np.concatenate([np.frombuffer(index._postings[term][1], dtype=np.uint16) for term in terms])
+        if terms else np.zeros(0, np.uint16),
+        "impacts": np.concatenate([index._impacts[term][1] for term in terms]) if terms else np.zeros(0, np.float32),
+        "deleted": index._deleted,
+    }
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_index(path: str) -> InvertedIndex:
+    """
+    Read an index written by save_index; it is ready to search without finalizing
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    index = InvertedIndex(state["k1"], state["b"])
+    index.passages = state["passages"]
+    index.topics = state["topics"]
+    index._doc_lengths.frombytes(state["doc_lengths"])
+    offsets, ids, tfs, impacts = state["offsets"], state["ids"], state["tfs"], state["impacts"]
+    for i, term in enumerate(state["terms"]):
+        start, end = offsets[i], offsets[i + 1]
+        index._postings[term] = (array("I", ids[start:end].tobytes()), array("H", tfs[start:end].tobytes()))
+        index._impacts[term] = (ids[start:end], impacts[start:end])
+    index._posting_count = len(ids)
+    index._deleted = state["deleted"]
+    return index
+
+
+class SegmentedIndex:
+    """
+    Read-only view that searches several InvertedIndex segments as one index
+
+    Doc ids are global: a segment's local ids are offset by the number of
+    documents in the segments before it. Each segment scores with its own
+    BM25 statistics, as shards of a distributed index do, so merging small
+    segments also evens out their scores.
+    """
+
+    def __init__(self, segments: Sequence[InvertedIndex], version: int = 0):
+        self.segments = list(segments)
+        self.version = version
+        self._bases = []
+        total = 0
+        for segment in self.segments:
+            self._bases.append(total)
+            total += len(segment)
+        self._size = total
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _locate(self, doc_id: int) -> Tuple[InvertedIndex, int]:
+        i = bisect.bisect_right(self._bases, doc_id) - 1
+        return self.segments[i], doc_id - self._bases[i]
+
+    def passage(self, doc_id: int) -> str:
+        segment, local_id = self._locate(doc_id)
+        return segment.passages[local_id]
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Top_k (global doc id, BM25 score) pairs across all segments, best first
+        """
+        hits = []
+        for base, segment in zip(self._bases, self.segments):
+            hits.extend((base + doc_id, score) for doc_id, score in segment.search(query, top_k))
+        hits.sort(key=lambda hit: -hit[1])
+        return hits[:top_k]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": sum(segment.live_count() for segment in self.segments),
+            "segments": len(self.segments),
+            "terms": sum(len(segment._postings) for segment in self.segments),
+            "postings": sum(segment._posting_count for segment in self.segments),
+            "version": self.version,
+        }
+
+
+# A dense index at path lives in path.v<fingerprint>/ directories; path.current names the live one
+DENSE_POINTER_SUFFIX = ".current"
+DENSE_OPEN_RETRIES = 3
+# Superseded versions younger than this are kept for readers that just resolved the pointer to them
+DENSE_VERSION_GRACE_SECONDS = 600
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: signed feature hashing of unigrams and bigrams
+
+    Needs no model download or network access, and gives the same vectors in
+    every process, so an index built by one worker is valid for all of them.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed a batch of texts into L2-normalized float32 rows
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class DenseIndex:
+    """
+    Read-only dense index backed by files on disk
+
+    The embedding matrix is a float32 .npy opened with mmap_mode="r" and the
+    passage texts live in a flat UTF-8 file addressed by an offsets array, so
+    loading copies nothing into RAM and every worker process shares the same
+    page cache. All four files come from the version the pointer names when
+    the index is opened.
+    """
+
+    def __init__(self, path: str, embedder=None):
+        self.path = path
+        for retry in range(DENSE_OPEN_RETRIES):
+            self.version_path = current_dense_version(path)
+            if self.version_path is None:
+                raise FileNotFoundError(f"No dense index at {path}")
+            try:
+                self._open_version(self.version_path)
+                break
+            except FileNotFoundError:
+                # A rebuild swapped the pointer and removed this version between reading and opening it
+                if retry == DENSE_OPEN_RETRIES - 1:
+                    raise
+        self.embedder = embedder or HashingEmbedder(self.meta["dim"])
+
+    def _open_version(self, version_path: str) -> None:
+        # The text file is opened first: once it is open, removing the version cannot pull the data away
+        self._text_file = open(os.path.join(version_path, "passages.txt"), "rb")
+        try:
+            with open(os.path.join(version_path, "meta.json")) as f:
+                self.meta = json.load(f)
+            self.matrix = np.load(os.path.join(version_path, "embeddings.npy"), mmap_mode="r")
+            self._offsets = np.load(os.path.join(version_path, "offsets.npy"), mmap_mode="r")
+        except BaseException:
+            self._text_file.close()
+            raise
+        self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ) if self.meta["documents"] else b""
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def passage(self, doc_id: int) -> str:
+        start, end = int(self._offsets[doc_id]), int(self._offsets[doc_id + 1])
+        return self._text[start:end].decode("utf-8")
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Score every passage with one matrix-vector product and return the top_k by cosine similarity
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        return self.search_vector(self.embedder.embed([query])[0], top_k)
+
+    def search_vector(self, vector: np.ndarray, top_k: int = 3) -> List[Tuple[int, float]]:
+        """
+        search() for a query that is already embedded
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        scores = self.matrix @ np.asarray(vector, dtype=np.float32)
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best]
+
+    def stats(self) -> Dict[str, int]:
+        return {"documents": len(self), "dim": int(self.matrix.shape[1])}
+
+    def close(self) -> None:
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text_file.close()
+
+
+def corpus_fingerprint(passages: Sequence[str], embedder) -> str:
+    """
+    Hash of the passages and embedder settings, used to detect a stale on-disk index
+    """
+    digest = hashlib.sha256(f"{embedder.name}:{embedder.dim}".encode("utf-8"))
+    for text in passages:
+        digest.update(b"\0" + text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def current_dense_version(path: str) -> Optional[str]:
+    """
+    Directory of the dense index version that path's pointer file names, or None when there is none
+    """
+    try:
+        with open(f"{path}{DENSE_POINTER_SUFFIX}") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(os.path.dirname(path), version) if version else None
+
+
+def _dense_versions(path: str) -> List[str]:
+    directory = os.path.dirname(path) or "."
+    prefix = f"{os.path.basename(path)}.v"
+    return [os.path.join(os.path.dirname(path), name) for name in os.listdir(directory) if name.startswith(prefix)]
+
+
+def build_dense_index(passages: Sequence[str], path: str, embedder=None, batch_size: int = 1024) -> None:
+    """
+    Embed passages in batches straight into an on-disk .npy and write the passage store
+
+    Each build fills a directory of its own (path.v<fingerprint>) and then
+    atomically replaces the path.current pointer file naming the live
+    version, so a reader resolves the pointer once and always gets the
+    embeddings, offsets, passages and metadata of a single build. The version
+    it replaced is kept, and other versions are removed once they have gone
+    DENSE_VERSION_GRACE_SECONDS without being published; readers that already
+    opened a removed version keep their data.
+    """
+    embedder = embedder or HashingEmbedder()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fingerprint = corpus_fingerprint(passages, embedder)
+    version = f"{os.path.basename(path)}.v{fingerprint[:16]}"
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    matrix = np.lib.format.open_memmap(os.path.join(tmp, "embeddings.npy"), mode="w+", dtype=np.float32,
+                                       shape=(len(passages), embedder.dim))
+    for start in range(0, len(passages), batch_size):
+        batch = passages[start:start + batch_size]
+        matrix[start:start + len(batch)] = embedder.embed(batch)
+    matrix.flush()
+    del matrix
+
+    offsets = np.zeros(len(passages) + 1, dtype=np.int64)
+    with open(os.path.join(tmp, "passages.txt"), "wb") as f:
+        for i, text in enumerate(passages):
+            offsets[i + 1] = offsets[i] + f.write(text.encode("utf-8"))
+    np.save(os.path.join(tmp, "offsets.npy"), offsets)
+
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({
+            "documents": len(passages),
+            "dim": embedder.dim,
+            "embedder": embedder.name,
+            "fingerprint": fingerprint
+        }, f)
+
+    version_path = os.path.join(directory, version)
+    try:
+        os.rename(tmp, version_path)
+    except OSError:
+        # Another worker finished the same build first; its files are identical
+        if not os.path.isdir(version_path):
+            raise
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    previous = current_dense_version(path)
+    # The version's age counts from when it was last published
+    os.utime(version_path)
+    pointer = f"{path}{DENSE_POINTER_SUFFIX}"
+    with open(f"{pointer}.tmp{os.getpid()}", "w") as f:
+        f.write(version)
+    os.replace(f"{pointer}.tmp{os.getpid()}", pointer)
+
+    # A reader may be about to open the version it just read from the pointer, and a concurrent
+    # build of another corpus may have just published its own, so only long-superseded versions go
+    now = time.time()
+    for stale in _dense_versions(path):
+        if stale in (version_path, previous):
+            continue
+        try:
+            if now - os.path.getmtime(stale) < DENSE_VERSION_GRACE_SECONDS:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def open_dense_index(passages: Sequence[str], path: str, embedder=None) -> DenseIndex:
+    """
+    Open the dense index at path, rebuilding it first if it is missing or stale
+    """
+    embedder = embedder or HashingEmbedder()
+    fingerprint = corpus_fingerprint(passages, embedder)
+    version_path = current_dense_version(path)
+    try:
+        with open(os.path.join(version_path, "meta.json")) as f:
+            current = json.load(f).get("fingerprint") == fingerprint
+    except (TypeError, OSError, ValueError):
+        current = False
+    if not current:
+        build_dense_index(passages, path, embedder)
+    return DenseIndex(path, embedder)
+
+
+def timed_search(index, query: Union[str, np.ndarray], top_k: int) -> Tuple[List[Tuple[int, float]], float]:
+    """
+    Search an inverted or dense index and return the hits together with the scoring time in milliseconds
+
+    A dense index also accepts an embedded query vector.
+    """
+    start = time.perf_counter()
+    hits = index.search(query, top_k) if isinstance(query, str) else index.search_vector(query, top_k)
+    return hits, (time.perf_counter() - start) * 1000
@@ -0,0 +1,230 @@
+"""
+Retrieval Result Cache
+LRU cache of ranked retrieval hits and packed contexts, bounded by entry count and bytes and tied to the index version.
+
+Retrieval entries are keyed by (mode, normalized query, top_k). The
+normalization (case, whitespace, surrounding punctuation) only removes what
+retrieval.tokenize() ignores anyway, so a hit returns exactly what a search
+would. When an ingested SegmentedIndex moves to a new version, an entry is
+kept if none of its passages were deleted, none of its segments were merged
+away, and none of the new segments has a passage that would now outrank it.
+Each segment keeps its own BM25 statistics, so that check only searches the
+new segments and is exact. Any other index change (a rebuilt dense index,
+a switch to an ingested index) clears the entries of that mode.
+
+Packed contexts are keyed by the exact query, token budget, model and
+documents, so they can never go stale.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Rough per-entry overhead of the dicts, tuples and key, in bytes
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def normalize_query(query: str) -> str:
+    """
+    Lowercase, collapse whitespace and strip surrounding punctuation
+    """
+    return " ".join(query.lower().split()).strip(" \t\n?!.,;:'\"")
+
+
+def index_version(index) -> Any:
+    """
+    Token that changes whenever the index's results may change
+    """
+    if hasattr(index, "segments"):
+        return index.version
+    meta = getattr(index, "meta", None)
+    if meta is not None:
+        return ("dense", meta.get("fingerprint"))
+    # The built-in knowledge index never changes while it is loaded
+    return ("static", id(index))
+
+
+class RetrievalCache:
+    """
+    One LRU over retrieval entries and packed contexts, evicted by entry count and by approximate bytes
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.invalidated = 0
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._versions: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    # Retrieval results
+
+    def get(self, mode: str, query: str, top_k: int, index) -> Optional[Dict[str, Any]]:
+        """
+        Cached {"hits", "documents", "revalidated"} for the query on this index, or None on a miss
+        """
+        key = ("retrieval", mode, normalize_query(query), top_k)
+        version = index_version(index)
+        with self._lock:
+            self._check_version(mode, index, version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            revalidated = False
+            if entry["version"] != version:
+                hits = self._revalidate(entry, index, key[2], top_k)
+                if hits is None:
+                    self._drop(key)
+                    self.invalidated += 1
+                    self.misses += 1
+                    return None
+                entry["hits"] = hits
+                entry["version"] = version
+                entry["segments"] = [weakref.ref(segment) for segment in index.segments]
+                self.revalidated += 1
+                revalidated = True
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {"hits": list(entry["hits"]), "documents": list(entry["documents"]), "revalidated": revalidated}
+
+    def put(self, mode: str, query: str, top_k: int, index, hits: List[Tuple[int, float]], documents: List[str]) -> None:
+        key = ("retrieval", mode, normalize_query(query), top_k)
+        entry = {
+            "version": index_version(index),
+            "hits": list(hits),
+            "documents": list(documents),
+            "bytes": ENTRY_OVERHEAD_BYTES + len(key[2]) + sum(len(doc) for doc in documents)
+        }
+        if hasattr(index, "segments"):
+            # Weak references, so entries never keep merged-away segments in memory
+            entry["segments"] = [weakref.ref(segment) for segment in index.segments]
+            entry["locations"] = [(weakref.ref(segment), local_id)
+                                  for segment, local_id in (index._locate(doc_id) for doc_id, _ in hits)]
+        with self._lock:
+            self._store(key, entry)
+
+    def _check_version(self, mode: str, index, version: Any) -> None:
+        previous = self._versions.get(mode)
+        self._versions[mode] = version
+        if previous is None or previous == version:
+            return
+        if isinstance(previous, int) and isinstance(version, int):
+            # Ingested index moved on; entries are revalidated one by one as they are looked up
+            return
+        stale = [key for key in self._entries if key[0] == "retrieval" and key[1] == mode]
+        for key in stale:
+            self._drop(key)
+        self.invalidated += len(stale)
+
+    @staticmethod
+    def _revalidate(entry: Dict[str, Any], index, query: str, top_k: int) -> Optional[List[Tuple[int, float]]]:
+        """
+        The entry's hits with doc ids remapped to the new index, or None if the new version could rank differently
+        """
+        if "segments" not in entry or not hasattr(index, "segments"):
+            return None
+        current = {id(segment): segment for segment in index.segments}
+        old = [ref() for ref in entry["segments"]]
+        if any(segment is None or current.get(id(segment)) is not segment for segment in old):
+            return None
+        located = [(ref(), local_id) for ref, local_id in entry["locations"]]
+        if any(segment.is_deleted(local_id) for segment, local_id in located):
+            return None
+
+        # New segments sort after the existing ones, so they lose ties
+        floor = entry["hits"][-1][1] if len(entry["hits"]) >= top_k else float("-inf")
+        old_ids = {id(segment) for segment in old}
+        for segment in index.segments:
+            if id(segment) not in old_ids and any(score > floor for _, score in segment.search(query, top_k)):
+                return None
+
+        bases = {id(segment): base for segment, base in zip(index.segments, index._bases)}
+        return [(bases[id(segment)] + local_id, score)
+                for (segment, local_id), (_, score) in zip(located, entry["hits"])]
+
+    # Packed contexts
+
+    @staticmethod
+    def context_key(documents: List[str], query: str, token_budget: int, model: str) -> tuple:
+        payload = json.dumps([query, token_budget, model, documents], separators=(",", ":"))
+        return ("context", hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+    def get_context(self, key: tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["packed"]
+
+    def put_context(self, key: tuple, packed) -> None:
+        size = ENTRY_OVERHEAD_BYTES + len(packed.prompt) + sum(len(doc) for doc in packed.documents)
+        with self._lock:
+            self._store(key, {"packed": packed, "bytes": size})
+
+    # Bookkeeping
+
+    def _store(self, key: tuple, entry: Dict[str, Any]) -> None:
+        if entry["bytes"] > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = entry
+        self.bytes += entry["bytes"]
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted["bytes"]
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry["bytes"]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "revalidated": self.revalidated,
+            "invalidated": self.invalidated,
+            "entries": len(self._entries),
+            "bytes": self.bytes
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.bytes = 0
+
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """
+    Process-wide cache, or None when RETRIEVAL_CACHE_ENABLED=false
+    """
+    global _retrieval_cache
+    if os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "false":
+        return None
+    if _retrieval_cache is None:
+        with _retrieval_cache_lock:
+            if _retrieval_cache is None:
+                _retrieval_cache = RetrievalCache(
+                    max_entries=int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1024")),
+                    max_bytes=int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+                )
+    return _retrieval_cache
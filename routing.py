@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+Cost- and Latency-Aware Model Routing
+Picks a chat model per request from cheapest-first tiers and escalates to a stronger tier when a cheap verifier rejects the answer.
+
+With LLM_ROUTER_POLICY=cascade a request starts on the first tier in
+LLM_ROUTER_TIERS and moves up one tier for a prompt of at least
+LLM_ROUTER_LONG_PROMPT_TOKENS and one more when retrieval confidence is below
+LLM_ROUTER_MIN_CONFIDENCE. Tiers whose context window cannot hold the prompt
+are skipped, and with a latency SLO the choice steps back down until its
+expected latency (a moving average per model) fits. LLM_ROUTER_VERIFY checks
+each answer that could still be escalated: "heuristic" rejects empty,
+refusing or ungrounded answers, "llm" also asks the first tier for a YES/NO
+verdict. If the escalated attempt fails, the rejected answer is kept.
+Streamed answers are never escalated, since their tokens are already on
+screen. The default fixed policy sends everything to
+LLM_ROUTER_DEFAULT_MODEL, as before, without counting tokens.
+
+Under the cascade policy each request gets a model_routing span holding the
+decision, with one generation per attempt beneath it and the escalation path
+as output. Replay a workload against the local mock to compare policies:
+
+    python routing.py --workload workload.jsonl --policies fixed:gpt-4o-mini,fixed:gpt-4o,cascade,cascade+verify
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# USD per million (input, output) tokens
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4": (30.00, 60.00),
+}
+
+# Starting point for each model's expected latency until requests have been observed
+DEFAULT_LATENCY_MS = {
+    "gpt-4o-mini": 3000,
+    "gpt-3.5-turbo": 4000,
+    "gpt-4o": 8000,
+    "gpt-4": 15000,
+}
+UNKNOWN_MODEL_LATENCY_MS = 5000
+LATENCY_EWMA_ALPHA = 0.2
+
+# Top retrieval scores that map to a confidence of 0.5; BM25 scores are unbounded, cosine scores are not
+CONFIDENCE_HALF_SCORES = {"keyword": 2.0, "dense": 0.15}
+
+MIN_ANSWER_WORDS = 3
+REFUSAL_PHRASES = (
+    "i don't know", "i do not know", "i'm not sure", "i am not sure", "i cannot answer", "i can't answer",
+    "doesn't contain enough", "does not contain enough", "not enough information", "no information about",
+)
+VERIFIER_SYSTEM_PROMPT = ("You check answers. Reply YES if the answer addresses the question and is supported by "
+                          "any context given, otherwise reply NO.")
+
+_WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9'-]{3,}")
+
+
+def retrieval_confidence(scores: Sequence[float], mode: str = "keyword") -> float:
+    """
+    Confidence in [0, 1) that retrieval found relevant passages, from the top score
+    """
+    if not scores:
+        return 0.0
+    top = max(0.0, max(scores))
+    half = CONFIDENCE_HALF_SCORES.get(mode, CONFIDENCE_HALF_SCORES["keyword"])
+    return top / (top + half)
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    List price of a completion in USD; unknown models cost nothing
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def grounding(answer: str, reference: str) -> float:
+    """
+    Share of the answer's content words that also occur in the reference text
+    """
+    words = _WORD_PATTERN.findall(answer.lower())
+    if not words:
+        return 0.0
+    known = set(_WORD_PATTERN.findall(reference.lower()))
+    return sum(word in known for word in words) / len(words)
+
+
+@dataclass
+class RouteDecision:
+    model: str
+    policy: str
+    # Index into the router's tiers, or -1 for a model outside them
+    tier: int
+    reasons: List[str] = field(default_factory=list)
+    prompt_tokens: int = 0
+    max_tokens: int = 0
+    confidence: Optional[float] = None
+    expected_latency_ms: float = 0.0
+
+    def metadata(self) -> Dict[str, Any]:
+        metadata = {
+            "route_model": self.model,
+            "route_policy": self.policy,
+            "route_tier": self.tier,
+            "route_reasons": self.reasons,
+            "prompt_tokens": self.prompt_tokens,
+            "expected_latency_ms": round(self.expected_latency_ms, 1),
+            "estimated_max_cost_usd": round(estimate_cost(self.model, self.prompt_tokens, self.max_tokens), 6)
+        }
+        if self.confidence is not None:
+            metadata["retrieval_confidence"] = round(self.confidence, 4)
+        return metadata
+
+
+class _Cascade:
+    """
+    One request's walk up the tiers: the attempts made, their verdicts and where it stopped
+    """
+
+    def __init__(self, router: "ModelRouter", decision: RouteDecision, parent):
+        self.router = router
+        self.decision = decision
+        self.model = decision.model
+        self.tier = decision.tier
+        self.path: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+        self.span = None
+        if parent and decision.policy == "cascade":
+            self.span = parent.start_span(name="model_routing", input={"prompt_tokens": decision.prompt_tokens},
+                                          metadata=decision.metadata())
+        self.parent = self.span or parent
+
+    def record(self, answer: str, started: float) -> Optional[int]:
+        """
+        Record an attempt; returns the tier an escalation would move to, or None when this answer is final
+        """
+        seconds = time.perf_counter() - started
+        step = {"model": self.model, "latency_ms": round(seconds * 1000, 1), "cost_usd": 0.0}
+        self.path.append(step)
+        if self.router.track_costs:
+            from context_packer import count_tokens
+            step["output_tokens"] = count_tokens(answer, self.model)
+            step["cost_usd"] = estimate_cost(self.model, self.decision.prompt_tokens, step["output_tokens"])
+        if self.router.policy != "cascade":
+            return None
+        from llm import served_upstream
+        # Cache hits and coalesced followers say nothing about how fast the model is
+        if served_upstream():
+            self.router.observe(self.model, seconds)
+        if self.decision.policy != "cascade" or self.router.verifier == "off":
+            return None
+        next_tier, blocked = self.router.next_tier(self.decision, self.tier, len(self.path) - 1,
+                                                   time.perf_counter() - self.started)
+        if next_tier is None:
+            step["escalation_blocked"] = blocked
+        return next_tier
+
+    def judge(self, accepted: bool, reason: str, next_tier: int, cost: float = 0.0) -> bool:
+        """
+        Record the verifier's verdict; a rejection moves the cascade to next_tier. Returns whether to stop
+        """
+        step = self.path[-1]
+        step["verdict"] = "accepted" if accepted else "rejected"
+        step["verdict_reason"] = reason
+        step["cost_usd"] += cost
+        if accepted:
+            return True
+        step["escalated_to"] = self.router.tiers[next_tier]
+        self.tier = next_tier
+        self.model = self.router.tiers[next_tier]
+        return False
+
+    def fall_back(self, error: Exception) -> bool:
+        """
+        Keep the rejected answer when the escalated attempt fails; returns False for a first attempt, whose error stands
+        """
+        if not self.path:
+            return False
+        step = self.path[-1]
+        step["escalation_failed"] = f"{type(error).__name__}: {error}"
+        self.model = step["model"]
+        self.tier = self.router.tiers.index(self.model) if self.model in self.router.tiers else -1
+        return True
+
+    def finish(self, error: BaseException = None) -> None:
+        cost = sum(step["cost_usd"] for step in self.path)
+        self.router.tally(self.decision, self.path, error is None)
+        if self.span:
+            metadata = {
+                "final_model": self.model if error is None else None,
+                "escalations": max(0, len(self.path) - 1),
+                "estimated_cost_usd": round(cost, 6),
+                "total_latency_ms": round((time.perf_counter() - self.started) * 1000, 1)
+            }
+            path = [dict(step, cost_usd=round(step["cost_usd"], 6)) for step in self.path]
+            if error is not None:
+                self.span.update(output={"path": path}, metadata=metadata, level="ERROR", status_message=str(error))
+            else:
+                self.span.update(output={"path": path}, metadata=metadata)
+            self.span.end()
+
+
+class ModelRouter:
+    """
+    Routing policy, per-model latency estimates and the cascade between tiers
+    """
+
+    def __init__(self, policy: str = "fixed", tiers: Sequence[str] = ("gpt-4o-mini", "gpt-3.5-turbo", "gpt-4o"),
+                 default_model: str = "gpt-3.5-turbo", long_prompt_tokens: int = 2000, min_confidence: float = 0.5,
+                 latency_slo_ms: float = 0, verifier: str = "off", max_escalations: int = 1,
+                 min_grounding: float = 0.2, track_costs: Optional[bool] = None):
+        if policy not in ("fixed", "cascade"):
+            raise ValueError(f"Unknown routing policy {policy!r}; expected 'fixed' or 'cascade'")
+        if verifier not in ("off", "heuristic", "llm"):
+            raise ValueError(f"Unknown verifier {verifier!r}; expected 'off', 'heuristic' or 'llm'")
+        if not tiers:
+            raise ValueError("At least one model tier is required")
+        self.policy = policy
+        self.tiers = list(tiers)
+        self.default_model = default_model
+        self.long_prompt_tokens = long_prompt_tokens
+        self.min_confidence = min_confidence
+        self.latency_slo_ms = latency_slo_ms
+        self.verifier = verifier
+        self.max_escalations = max_escalations
+        self.min_grounding = min_grounding
+        # Token counts and cost estimates; the fixed policy skips them unless it is being evaluated
+        self.track_costs = policy == "cascade" if track_costs is None else track_costs
+        self.requests = 0
+        self.failures = 0
+        self.escalations = 0
+        self.rejections = 0
+        self.cost_usd = 0.0
+        self.routed: Dict[str, int] = {}
+        self.answered: Dict[str, int] = {}
+        self._latency_ms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        tiers = [model.strip() for model in os.getenv("LLM_ROUTER_TIERS", "gpt-4o-mini,gpt-3.5-turbo,gpt-4o").split(",")]
+        return cls(
+            policy=os.getenv("LLM_ROUTER_POLICY", "fixed").lower(),
+            tiers=[model for model in tiers if model],
+            default_model=os.getenv("LLM_ROUTER_DEFAULT_MODEL", "gpt-3.5-turbo"),
+            long_prompt_tokens=int(os.getenv("LLM_ROUTER_LONG_PROMPT_TOKENS", "2000")),
+            min_confidence=float(os.getenv("LLM_ROUTER_MIN_CONFIDENCE", "0.5")),
+            latency_slo_ms=float(os.getenv("LLM_ROUTER_LATENCY_SLO_MS", "0")),
+            verifier=os.getenv("LLM_ROUTER_VERIFY", "off").lower(),
+            max_escalations=int(os.getenv("LLM_ROUTER_MAX_ESCALATIONS", "1")),
+            min_grounding=float(os.getenv("LLM_ROUTER_MIN_GROUNDING", "0.2"))
+        )
+
+    # Latency estimates
+
+    def expected_latency_ms(self, model: str) -> float:
+        with self._lock:
+            latency = self._latency_ms.get(model)
+        return latency if latency is not None else DEFAULT_LATENCY_MS.get(model, UNKNOWN_MODEL_LATENCY_MS)
+
+    def observe(self, model: str, seconds: float) -> None:
+        with self._lock:
+            previous = self._latency_ms.get(model)
+            latency = seconds * 1000
+            self._latency_ms[model] = latency if previous is None else \
+                previous + LATENCY_EWMA_ALPHA * (latency - previous)
+
+    # Routing
+
+    def _fits(self, model: str, prompt_tokens: int, max_tokens: int) -> bool:
+        from context_packer import DEFAULT_CONTEXT_WINDOW, MODEL_CONTEXT_WINDOWS
+        return prompt_tokens + max_tokens <= MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+    def route(self, prompt: str, max_tokens: int = 500, confidence: Optional[float] = None,
+              model: Optional[str] = None) -> RouteDecision:
+        """
+        Choose the model for a prompt; an explicit model is always honoured
+        """
+        from context_packer import count_tokens
+        if model or self.policy == "fixed":
+            policy = "explicit" if model else "fixed"
+            model = model or self.default_model
+            return RouteDecision(model, policy, self.tiers.index(model) if model in self.tiers else -1, [policy],
+                                 count_tokens(prompt) if self.track_costs else 0, max_tokens, confidence,
+                                 self.expected_latency_ms(model))
+
+        prompt_tokens = count_tokens(prompt)
+
+        reasons = []
+        tier = 0
+        if prompt_tokens >= self.long_prompt_tokens:
+            tier += 1
+            reasons.append("long_prompt")
+        if confidence is not None and confidence < self.min_confidence:
+            tier += 1
+            reasons.append("low_retrieval_confidence")
+        tier = min(tier, len(self.tiers) - 1)
+
+        fitting = [i for i, name in enumerate(self.tiers) if self._fits(name, prompt_tokens, max_tokens)]
+        if fitting and tier not in fitting:
+            # The smallest tier above that holds the prompt, else the largest below
+            tier = next((i for i in fitting if i > tier), fitting[-1])
+            reasons.append("context_window")
+        if self.latency_slo_ms:
+            while tier > 0 and self.expected_latency_ms(self.tiers[tier]) > self.latency_slo_ms:
+                lower = [i for i in fitting if i < tier]
+                if not lower:
+                    break
+                tier = lower[-1]
+                if "latency_slo" not in reasons:
+                    reasons.append("latency_slo")
+
+        model = self.tiers[tier]
+        return RouteDecision(model, "cascade", tier, reasons or ["cheapest"], prompt_tokens, max_tokens,
+                             confidence, self.expected_latency_ms(model))
+
+    def next_tier(self, decision: RouteDecision, tier: int, escalations: int,
+                  elapsed: float) -> Tuple[Optional[int], str]:
+        """
+        The tier an escalation from tier would use, or (None, why not)
+        """
+        stronger = [i for i in range(tier + 1, len(self.tiers))
+                    if self._fits(self.tiers[i], decision.prompt_tokens, decision.max_tokens)]
+        if tier < 0 or not stronger:
+            return None, "top_tier"
+        if escalations >= self.max_escalations:
+            return None, "max_escalations"
+        if self.latency_slo_ms and \
+                elapsed * 1000 + self.expected_latency_ms(self.tiers[stronger[0]]) > self.latency_slo_ms:
+            return None, "latency_slo"
+        return stronger[0], ""
+
+    # Verification
+
+    def check(self, answer: str, reference: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Heuristic verdict: reject empty or very short answers, refusals, and answers not grounded in the reference
+        """
+        text = answer.strip()
+        if len(text.split()) < MIN_ANSWER_WORDS:
+            return False, "too_short"
+        lowered = text.lower()
+        if any(phrase in lowered for phrase in REFUSAL_PHRASES):
+            return False, "refusal"
+        if reference and grounding(text, reference) < self.min_grounding:
+            return False, "ungrounded"
+        return True, "heuristic"
+
+    def _verifier_messages(self, prompt: str, answer: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": VERIFIER_SYSTEM_PROMPT},
+            {"role": "user", "content": f"{prompt}\n\nAnswer:\n{answer}"}
+        ]
+
+    def _llm_verdict(self, reply: str, generation) -> Tuple[bool, str]:
+        # Anything but an explicit NO passes, so an unparseable reply never costs an escalation
+        accepted = not reply.strip().lower().startswith("no")
+        if generation:
+            generation.update(output=reply, metadata={"verdict": "accepted" if accepted else "rejected"})
+            generation.end()
+        return accepted, "llm"
+
+    def _verifier_generation(self, parent, messages: List[Dict[str, str]]):
+        if not parent:
+            return None
+        return parent.start_observation(name="answer_verification", model=self.tiers[0], input=messages,
+                                        as_type="generation")
+
+    def _verifier_cost(self, messages: List[Dict[str, str]], reply: str) -> float:
+        from context_packer import count_tokens
+        prompt_tokens = sum(count_tokens(message["content"], self.tiers[0]) for message in messages)
+        return estimate_cost(self.tiers[0], prompt_tokens, count_tokens(reply, self.tiers[0]))
+
+    def verify(self, prompt: str, answer: str, reference: Optional[str] = None,
+               parent=None) -> Tuple[bool, str, float]:
+        """
+        (accepted, reason, verifier cost in USD) for an answer
+        """
+        accepted, reason = self.check(answer, reference)
+        if not accepted or self.verifier != "llm":
+            return accepted, reason, 0.0
+        from llm import chat_completion
+        messages = self._verifier_messages(prompt, answer)
+        generation = self._verifier_generation(parent, messages)
+        reply = chat_completion(messages, model=self.tiers[0], temperature=0.0, max_tokens=3, generation=generation)
+        return (*self._llm_verdict(reply, generation), self._verifier_cost(messages, reply))
+
+    async def averify(self, prompt: str, answer: str, client, reference: Optional[str] = None,
+                      parent=None) -> Tuple[bool, str, float]:
+        accepted, reason = self.check(answer, reference)
+        if not accepted or self.verifier != "llm":
+            return accepted, reason, 0.0
+        from llm import async_chat_completion
+        messages = self._verifier_messages(prompt, answer)
+        generation = self._verifier_generation(parent, messages)
+        reply = await async_chat_completion(messages, client, model=self.tiers[0], temperature=0.0, max_tokens=3,
+                                            generation=generation)
+        return (*self._llm_verdict(reply, generation), self._verifier_cost(messages, reply))
+
+    # Running a request
+
+    def run(self, decision: RouteDecision, attempt: Callable[[str, Any], str], prompt: str, parent=None,
+            reference: Optional[str] = None, verify: bool = True) -> str:
+        """
+        Call attempt(model, parent) on the routed model, escalating while the verifier rejects its answer
+
+        attempt creates its own generation under the parent it is given. When an
+        escalated attempt fails, the rejected answer is returned instead and its
+        path step records escalation_failed. Pass verify=False for streamed answers, which cannot be taken back.
+        """
+        cascade = _Cascade(self, decision, parent)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    answer = attempt(cascade.model, cascade.parent)
+                except Exception as e:
+                    if not cascade.fall_back(e):
+                        raise
+                    break
+                next_tier = cascade.record(answer, started)
+                if next_tier is None or not verify:
+                    break
+                accepted, reason, cost = self.verify(prompt, answer, reference, cascade.parent)
+                if cascade.judge(accepted, reason, next_tier, cost):
+                    break
+        except BaseException as e:
+            cascade.finish(e)
+            raise
+        cascade.finish()
+        return answer
+
+    async def arun(self, decision: RouteDecision, attempt: Callable[[str, Any], Awaitable[str]], prompt: str,
+                   client, parent=None, reference: Optional[str] = None, verify: bool = True) -> str:
+        """
+        run() for async callers; attempt(model, parent) is awaited and an LLM verifier uses client
+        """
+        cascade = _Cascade(self, decision, parent)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    answer = await attempt(cascade.model, cascade.parent)
+                except Exception as e:
+                    if not cascade.fall_back(e):
+                        raise
+                    break
+                next_tier = cascade.record(answer, started)
+                if next_tier is None or not verify:
+                    break
+                accepted, reason, cost = await self.averify(prompt, answer, client, reference, cascade.parent)
+                if cascade.judge(accepted, reason, next_tier, cost):
+                    break
+        except BaseException as e:
+            cascade.finish(e)
+            raise
+        cascade.finish()
+        return answer
+
+    # Bookkeeping
+
+    def tally(self, decision: RouteDecision, path: List[Dict[str, Any]], answered: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.routed[decision.model] = self.routed.get(decision.model, 0) + 1
+            self.escalations += max(0, len(path) - 1)
+            self.rejections += sum(step.get("verdict") == "rejected" for step in path)
+            self.cost_usd += sum(step["cost_usd"] for step in path)
+            if answered:
+                final = path[-1]["model"]
+                self.answered[final] = self.answered.get(final, 0) + 1
+            else:
+                self.failures += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "verifier": self.verifier,
+                "requests": self.requests,
+                "failures": self.failures,
+                "escalations": self.escalations,
+                "escalation_rate": round(self.escalations / self.requests, 4) if self.requests else 0.0,
+                "rejections": self.rejections,
+                "routed": dict(self.routed),
+                "answered": dict(self.answered),
+                "estimated_cost_usd": round(self.cost_usd, 6),
+                "expected_latency_ms": {model: round(latency, 1) for model, latency in self._latency_ms.items()}
+            }
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """
+    Process-wide router, configured from LLM_ROUTER_* variables
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter.from_env()
+    return _router
+
+
+# Offline evaluation
+
+def parse_policy(spec: str) -> ModelRouter:
+    """
+    Router for a policy spec: "fixed:<model>", "cascade", "cascade+verify" (heuristic) or "cascade+llm"
+    """
+    base = ModelRouter.from_env()
+    name, _, argument = spec.partition(":")
+    if name == "fixed":
+        return ModelRouter("fixed", base.tiers, argument or base.default_model, track_costs=True)
+    policy, _, verifier = name.partition("+")
+    if policy != "cascade" or verifier not in ("", "verify", "llm"):
+        raise ValueError(f"Unknown policy spec {spec!r}")
+    return ModelRouter("cascade", base.tiers, base.default_model, base.long_prompt_tokens, base.min_confidence,
+                       base.latency_slo_ms, {"": "off", "verify": "heuristic", "llm": "llm"}[verifier],
+                       base.max_escalations, base.min_grounding)
+
+
+def evaluate_policy(router: ModelRouter, workload: List[Dict[str, str]], concurrency: int = 4) -> Dict[str, Any]:
+    """
+    Replay the chat and RAG records of a workload with router as the process router; latency and cost per request
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from contextlib import redirect_stdout
+    from histogram import LatencyHistogram
+    import rag_demo
+    import routing
+    import simple_chat_demo
+
+    def run(record: Dict[str, str]) -> Tuple[float, bool]:
+        started = time.perf_counter()
+        if record["pipeline"] == "chat":
+            answer = simple_chat_demo.chat_with_llm(record["query"])
+            failed = answer.startswith(simple_chat_demo.CHAT_ERROR_PREFIX)
+        else:
+            answer = rag_demo.rag_pipeline(record["query"])["answer"]
+            failed = answer.startswith(rag_demo.ANSWER_ERROR_PREFIX)
+        return (time.perf_counter() - started) * 1000, failed
+
+    records = [record for record in workload if record["pipeline"] in ("chat", "rag")]
+    # The demos import this module by name, which is a different module object when it runs as a script
+    previous, routing._router = routing._router, router
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull), \
+                ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            results = list(pool.map(run, records))
+    finally:
+        routing._router = previous
+
+    histogram = LatencyHistogram()
+    for latency_ms, _ in results:
+        histogram.record(latency_ms)
+    report = histogram.summary((50, 95, 99))
+    stats = router.stats()
+    report.update({
+        "errors": sum(failed for _, failed in results),
+        "cost_usd": stats["estimated_cost_usd"],
+        "cost_per_1k_requests_usd": round(stats["estimated_cost_usd"] / len(records) * 1000, 4) if records else 0.0,
+        "escalation_rate": stats["escalation_rate"],
+        "answered": stats["answered"]
+    })
+    return report
+
+
+def main():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compare model routing policies on a replayed workload against the local mock")
+    parser.add_argument("--workload", default="workload.jsonl", help="JSONL file of {pipeline, query} records")
+    parser.add_argument("--policies", default="fixed:gpt-4o-mini,fixed:gpt-3.5-turbo,fixed:gpt-4o,cascade,cascade+verify",
+                        help="Comma-separated policy specs: fixed:<model>, cascade, cascade+verify, cascade+llm")
+    parser.add_argument("--repeat", type=int, default=3, help="Replay the workload this many times per policy")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-scale", type=float, default=0.2, help="Multiply all mock delays")
+    parser.add_argument("--model-time-scales", default="gpt-4o-mini=0.6,gpt-3.5-turbo=1.0,gpt-4o=1.8",
+                        help="Per-model mock delay factors, model=factor,...")
+    parser.add_argument("--output", help="Write the comparison as JSON to this path")
+    args = parser.parse_args()
+
+    from load_test import load_workload
+    from mock_servers import OpenAIMockConfig, start_mock_servers
+
+    model_time_scales = {}
+    for item in filter(None, args.model_time_scales.split(",")):
+        model, _, factor = item.partition("=")
+        model_time_scales[model.strip()] = float(factor)
+    servers = start_mock_servers(OpenAIMockConfig(seed=args.seed, time_scale=args.time_scale,
+                                                  model_time_scales=model_time_scales), openai_port=0, langfuse_port=0)
+    os.environ.update(servers.environment())
+    # Every policy must pay for its own completions
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["LLM_COALESCE_ENABLED"] = "false"
+
+    workload = load_workload(args.workload) * max(1, args.repeat)
+    results = {}
+    try:
+        # Warm up clients, connections and the retrieval index so the first policy is not penalised
+        evaluate_policy(parse_policy("fixed"), [record for record in workload if record["pipeline"] in ("chat", "rag")][:2],
+                        concurrency=1)
+        for spec in (spec.strip() for spec in args.policies.split(",") if spec.strip()):
+            print(f"▶️  {spec}", file=sys.stderr)
+            results[spec] = evaluate_policy(parse_policy(spec), workload, args.concurrency)
+    finally:
+        from clients import shutdown
+        shutdown()
+        servers.stop()
+
+    print(f"\n{'policy':<22} {'count':>6} {'err':>4} {'mean':>9} {'p50':>9} {'p95':>9} {'$/1k req':>10} {'escal%':>7}  models")
+    for spec, r in results.items():
+        if not r["count"]:
+            continue
+        models = ", ".join(f"{model}={count}" for model, count in sorted(r["answered"].items()))
+        print(f"{spec:<22} {r['count']:>6} {r['errors']:>4} {r['mean_ms']:>7.0f}ms {r['p50_ms']:>7.0f}ms "
+              f"{r['p95_ms']:>7.0f}ms {r['cost_per_1k_requests_usd']:>10.4f} {r['escalation_rate'] * 100:>6.1f}%  {models}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"workload": args.workload, "repeat": args.repeat, "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
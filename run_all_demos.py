@@ -2,16 +2,30 @@
 """
 Run All Demos Script
 This script runs all the demo applications in sequence for easy testing.
+
+With --workers N the demos (or --replicas copies of each) run in a pool of N
+worker processes instead, and the per-worker timings, success counts and
+token usage are collected into one summary table and an optional JSON report:
+
+    python run_all_demos.py --workers 4 --replicas 4 --output parallel.json
 """
 
+import argparse
+import json
 import os
 import sys
 import time
-from dotenv import load_dotenv
+from clients import load_env, shutdown
+
+DEMOS = [
+    ("simple_chat_demo", "Simple Chat Demo"),
+    ("rag_demo", "RAG (Retrieval Augmented Generation) Demo"),
+    ("langchain_demo", "LangChain Integration Demo")
+]
 
 def check_environment():
     """Check if all required environment variables are set"""
-    load_dotenv()
+    load_env()
     
     required_vars = [
         "LANGFUSE_PUBLIC_KEY",
@@ -62,8 +76,171 @@ def run_demo(script_name, description):
         print(f"❌ Error running {description}: {e}")
         return False
 
+class _Tee:
+    """File-like object that writes to several streams"""
+    def __init__(self, *streams):
+        self.streams = streams
+    
+    def write(self, text):
+        for stream in self.streams:
+            stream.write(text)
+        return len(text)
+    
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+def _request_errors():
+    """Errors recorded by the demo pipeline stages in this process"""
+    from metrics import get_metrics
+    return sum(get_metrics().collect()[1].values())
+
+def run_demo_worker(script_name, description, replica, verbose=False):
+    """Run one demo replica in a worker process and report its timing and token usage"""
+    import io
+    from contextlib import redirect_stdout
+    from llm import usage_totals
+    
+    if os.getenv("TRACE_SPOOL_DIR"):
+        # Workers inherit the parent's spool directory, which only one process may open
+        from span_spool import use_worker_slot
+        use_worker_slot()
+    
+    if os.getenv("PREWARM", "false").lower() == "true":
+        from rag_demo import prewarm_rag_demo
+        prewarm_rag_demo()
+    
+    output = io.StringIO()
+    errors_before = _request_errors()
+    start = time.perf_counter()
+    # Output is always captured, since failed steps show up there as ❌ lines
+    with redirect_stdout(_Tee(output, sys.stdout) if verbose else output):
+        completed = run_demo(script_name, description)
+    seconds = time.perf_counter() - start
+    failed_requests = _request_errors() - errors_before
+    
+    # The worker owns its clients, so its traces are flushed before the process is retired
+    flush_start = time.perf_counter()
+    shutdown()
+    # The demos catch LLM failures and carry on, so "no exception" alone is not success
+    errors = [line.strip() for line in output.getvalue().splitlines() if line.startswith("❌")]
+    if failed_requests and not errors:
+        errors.append(f"{failed_requests} pipeline stage error(s)")
+    return {
+        "demo": script_name,
+        "replica": replica,
+        "pid": os.getpid(),
+        "success": completed and not errors,
+        "seconds": round(seconds, 3),
+        "flush_seconds": round(time.perf_counter() - flush_start, 3),
+        "usage": usage_totals(),
+        "error": errors[0] if errors else None
+    }
+
+def summarize_results(results, wall_seconds, workers):
+    """Aggregate worker results per demo and overall"""
+    demos = {}
+    for result in results:
+        demo = demos.setdefault(result["demo"], {
+            "runs": 0, "successes": 0, "seconds": [], "calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0
+        })
+        demo["runs"] += 1
+        demo["successes"] += int(result["success"])
+        demo["seconds"].append(result["seconds"])
+        usage = result.get("usage") or {}
+        demo["calls"] += usage.get("calls", 0)
+        demo["input_tokens"] += usage.get("input", 0)
+        demo["output_tokens"] += usage.get("output", 0)
+        demo["total_tokens"] += usage.get("total", 0)
+    for demo in demos.values():
+        seconds = demo.pop("seconds")
+        demo["mean_seconds"] = round(sum(seconds) / len(seconds), 3)
+        demo["max_seconds"] = round(max(seconds), 3)
+    
+    busy_seconds = sum(result["seconds"] for result in results)
+    return {
+        "workers": workers,
+        "runs": len(results),
+        "successes": sum(int(result["success"]) for result in results),
+        "wall_seconds": round(wall_seconds, 3),
+        "busy_seconds": round(busy_seconds, 3),
+        # Demo time done per second of wall time; close to the worker count when the stack scales across cores
+        "parallel_speedup": round(busy_seconds / wall_seconds, 2) if wall_seconds else 0.0,
+        "total_tokens": sum(demo["total_tokens"] for demo in demos.values()),
+        "demos": demos,
+        "results": results
+    }
+
+def run_in_fresh_process(context, job, verbose=False):
+    """Run one demo replica in a process of its own and return its result"""
+    from concurrent.futures import ProcessPoolExecutor
+    
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_demo_worker, *job, verbose).result()
+
+def run_parallel(workers, replicas, verbose=False):
+    """Run every demo `replicas` times across a pool of worker processes"""
+    import multiprocessing
+    from concurrent.futures import ThreadPoolExecutor
+    
+    jobs = [(script_name, description, replica) for replica in range(replicas) for script_name, description in DEMOS]
+    print(f"🧵 Running {len(jobs)} demo runs on {workers} worker processes...")
+    
+    start = time.perf_counter()
+    # A fresh spawned process per run gives each run its own Langfuse and OpenAI clients;
+    # at most `workers` of them run at once
+    context = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_in_fresh_process, context, job, verbose) for job in jobs]
+        results = []
+        for (script_name, _, replica), future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({
+                    "demo": script_name, "replica": replica, "pid": None, "success": False, "seconds": 0.0,
+                    "flush_seconds": 0.0, "usage": None, "error": f"worker failed: {e}"
+                })
+    return summarize_results(results, time.perf_counter() - start, workers)
+
+def print_parallel_summary(report):
+    """Print the per-demo table for a parallel run"""
+    print(f"\n{'='*60}")
+    print("📊 Parallel Demo Summary")
+    print(f"{'='*60}")
+    print(f"{'demo':<18} {'ok':>7} {'mean':>8} {'max':>8} {'calls':>6} {'tokens':>8}")
+    for name, demo in report["demos"].items():
+        print(f"{name:<18} {demo['successes']:>3}/{demo['runs']:<3} {demo['mean_seconds']:>7.2f}s "
+              f"{demo['max_seconds']:>7.2f}s {demo['calls']:>6} {demo['total_tokens']:>8}")
+    print(f"\n✅ Successful: {report['successes']}/{report['runs']}")
+    print(f"⏱️  Wall time: {report['wall_seconds']:.2f}s, demo time: {report['busy_seconds']:.2f}s "
+          f"({report['parallel_speedup']}x on {report['workers']} workers)")
+    for result in report["results"]:
+        if result["error"]:
+            print(f"   {result['demo']} #{result['replica']}: {result['error']}")
+
 def main():
     """Main function to run all demos"""
+    parser = argparse.ArgumentParser(description="Run the Langfuse demo applications")
+    parser.add_argument("--workers", type=int, default=0, help="Run demos in this many worker processes (0 = in sequence)")
+    parser.add_argument("--replicas", type=int, default=1, help="Runs of each demo in parallel mode")
+    parser.add_argument("--output", help="Write the parallel run report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="Show the demos' own output in parallel mode")
+    args = parser.parse_args()
+    
+    if args.workers > 0:
+        if not check_environment():
+            sys.exit(1)
+        report = run_parallel(args.workers, args.replicas, args.verbose)
+        print_parallel_summary(report)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"📝 Report written to {args.output}")
+        if report["successes"] < report["runs"]:
+            sys.exit(1)
+        return
+    
     print("🎯 Langfuse Demo Suite")
     print("=====================")
     print("This script will run all demo applications in sequence.")
@@ -74,12 +251,12 @@ def main():
     if not check_environment():
         sys.exit(1)
     
-    # Define demos to run
-    demos = [
-        ("simple_chat_demo", "Simple Chat Demo"),
-        ("rag_demo", "RAG (Retrieval Augmented Generation) Demo"),
-        ("langchain_demo", "LangChain Integration Demo")
-    ]
+    # Optionally pay client and index start-up costs before the first demo request
+    if os.getenv("PREWARM", "false").lower() == "true":
+        from rag_demo import prewarm_rag_demo
+        prewarm_rag_demo()
+    
+    demos = DEMOS
     
     # Run each demo
     successful_demos = 0
@@ -109,6 +286,9 @@ def main():
         print(f"\n⚠️  {total_demos - successful_demos} demo(s) failed.")
         print("Check the error messages above for details.")
     
+    # Flush every demo's traces through the one shared client
+    shutdown()
+    
     print("\n📸 Screenshot Tips:")
     print("- Dashboard: Overview of all traces")
     print("- Trace Details: Individual request/response data")
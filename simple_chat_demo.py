@@ -5,59 +5,70 @@ This demonstrates basic LLM tracing with a simple chat interface.
 """
 
 import os
-from dotenv import load_dotenv
-from langfuse import Langfuse
-import openai
+from clients import get_langfuse, load_env, shutdown
+from tracing import start_trace
+from llm import chat_completion, print_token, streaming_enabled
+from metrics import record_stage
+from routing import get_router
 import time
 import random
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-# Initialize Langfuse
-langfuse = Langfuse(
-    public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
-    host=os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")
-)
+# Failed completions are returned to the user as a message starting with this
+CHAT_ERROR_PREFIX = "Sorry, I encountered an error"
 
-# Initialize OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+CHAT_SYSTEM_PROMPT = "You are a helpful AI assistant specializing in cloud-native technologies and DevOps."
 
-def chat_with_llm(user_message: str, model: str = "gpt-3.5-turbo") -> str:
+def chat_with_llm(user_message: str, model: str = None, on_token=None) -> str:
     """
-    Simple chat completion with tracing
+    Simple chat completion with tracing; pass on_token to stream tokens as they arrive
+
+    Without an explicit model the router picks one and may escalate a rejected answer.
     """
+    started = time.perf_counter()
     # Start a span for this chat completion
-    span = langfuse.start_span(name="chat_completion", input=user_message)
-    try:
-        # Start a generation observation
-        generation = langfuse.start_observation(name="llm_call", model=model, input=user_message, as_type="generation")
-        
-        response = openai.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant specializing in cloud-native technologies and DevOps."},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        result = response.choices[0].message.content
+    span = start_trace(get_langfuse(), "chat_completion", input=user_message)
+    router = get_router()
+    decision = router.route(CHAT_SYSTEM_PROMPT + "\n" + user_message, max_tokens=500, model=model)
+
+    def attempt(model: str, parent) -> str:
+        # Start a generation observation under the chat span
+        generation = parent.start_observation(name="llm_call", model=model, input=user_message, as_type="generation")
+        try:
+            result = chat_completion(
+                model=model,
+                messages=[
+                    {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_message}
+                ],
+                temperature=0.7,
+                max_tokens=500,
+                generation=generation,
+                on_token=on_token
+            )
+        except Exception as e:
+            generation.update(output=f"{CHAT_ERROR_PREFIX}: {str(e)}", level="ERROR")
+            generation.end()
+            raise
         generation.update(output=result)
         generation.end()
+        return result
+
+    try:
+        result = router.run(decision, attempt, user_message, span, verify=on_token is None)
         span.update(output=result)
         span.end()
+        record_stage("chat_completion", time.perf_counter() - started)
         
         return result
     except Exception as e:
         print(f"Error in chat completion: {e}")
-        error_msg = f"Sorry, I encountered an error: {str(e)}"
-        generation.update(output=error_msg, level="ERROR")
-        generation.end()
+        error_msg = f"{CHAT_ERROR_PREFIX}: {str(e)}"
         span.update(output=error_msg, level="ERROR")
         span.end()
+        record_stage("chat_completion", time.perf_counter() - started, error=True)
         return error_msg
 
 def run_conversation():
@@ -65,7 +76,7 @@ def run_conversation():
     Run a sample conversation with multiple exchanges
     """
     # Start a span for the entire conversation session
-    session_span = langfuse.start_span(name="conversation_session")
+    session_span = start_trace(get_langfuse(), "conversation_session")
     
     print("🤖 Starting CloudRaft AI Assistant Demo")
     print("=" * 50)
@@ -88,9 +99,14 @@ def run_conversation():
             # Add some realistic delay
             time.sleep(random.uniform(1, 3))
             
-            response = chat_with_llm(topic)
+            if streaming_enabled():
+                print("🤖 Answer: ", end="", flush=True)
+                response = chat_with_llm(topic, on_token=print_token)
+                print()
+            else:
+                response = chat_with_llm(topic)
+                print(f"🤖 Answer: {response}")
             responses.append({"question": topic, "answer": response})
-            print(f"🤖 Answer: {response}")
             print("-" * 30)
         
         # Update session span with summary
@@ -116,4 +132,4 @@ if __name__ == "__main__":
     run_conversation()
     
     # Flush any remaining traces
-    langfuse.flush()
+    shutdown()
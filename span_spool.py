@@ -0,0 +1,570 @@
+"""
+Durable Span Spool
+Finished spans are appended to a compressed, segmented log on disk and shipped to Langfuse in bulk by a background thread.
+
+With TRACE_SPOOL_DIR set, the Langfuse export processor is replaced by one
+whose exporter only appends to the local log, so a slow or unreachable
+Langfuse never holds up span.end() or the exit flush. The shipper reads the
+log from a persisted cursor, so spans left over from a crash or an outage
+are sent on the next start.
+
+Log layout: seg-<n>.log files of records, each a 16-byte header (payload
+length, CRC32, unix timestamp) followed by one zlib-compressed OTLP
+ExportTraceServiceRequest. cursor.json holds the segment and offset
+shipped so far. Serialized requests concatenate into a valid request, so a
+bulk upload is simply the decompressed records joined together. A spool
+directory belongs to one process at a time, enforced with an flock on its
+lock file; worker processes each claim a worker-<n> slot under it
+(use_worker_slot()).
+
+Usage:
+    python span_spool.py status
+    python span_spool.py drain
+"""
+
+import gzip
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # No flock on Windows; a spool directory is then unguarded
+    fcntl = None
+
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+RECORD_HEADER = struct.Struct(">IId")
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".log"
+LANGFUSE_TRACER_NAME = "langfuse-sdk"
+LOCK_FILE = "spool.lock"
+WORKER_SLOT_PREFIX = "worker-"
+
+
+class SpoolLocked(RuntimeError):
+    """
+    Another process has the spool directory open
+    """
+
+
+class SpanSpool:
+    """
+    Append-only segmented log of serialized span batches with a persisted read cursor
+    """
+
+    def __init__(self, path: str, segment_bytes: int = 4 * 1024 * 1024, max_bytes: int = 512 * 1024 * 1024,
+                 fsync: bool = False):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.appended_records = 0
+        self.shipped_records = 0
+        self.shipped_bytes = 0
+        self.dropped_records = 0
+        self._lock = threading.Lock()
+        self.has_data = threading.Condition(self._lock)
+        os.makedirs(path, exist_ok=True)
+        # Taken before anything is read, so a tail repair can never cut into another process's append
+        self._lock_fd = self._acquire_lock()
+
+        self._cursor = self._load_cursor()
+        segments = self._segments()
+        self._active_seq = segments[-1] if segments else self._cursor[0]
+        self._active = open(self._segment_path(self._active_seq), "ab")
+        self._repair_tail()
+        # Records left over from a previous run count towards the queue depth
+        self._pending = sum(1 for seq in segments if seq >= self._cursor[0]
+                            for _ in self._scan(seq, self._cursor[1] if seq == self._cursor[0] else 0))
+
+    def _acquire_lock(self) -> Optional[int]:
+        if fcntl is None:
+            return None
+        fd = os.open(os.path.join(self.path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise SpoolLocked(f"Span spool {self.path} is in use by another process; "
+                              "give each process its own TRACE_SPOOL_DIR") from None
+        return fd
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, "cursor.json")) as f:
+                cursor = json.load(f)
+            return cursor["segment"], cursor["offset"]
+        except (OSError, ValueError, KeyError):
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _save_cursor(self) -> None:
+        tmp_path = os.path.join(self.path, "cursor.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": self._cursor[0], "offset": self._cursor[1]}, f)
+        os.replace(tmp_path, os.path.join(self.path, "cursor.json"))
+
+    def _repair_tail(self) -> None:
+        """
+        Cut off a record torn by a crash mid-append, so new records start on a boundary
+        """
+        path = self._segment_path(self._active_seq)
+        valid = 0
+        for offset, _, _ in self._scan(self._active_seq, 0):
+            valid = offset
+        if os.path.getsize(path) != valid:
+            self._active.truncate(valid)
+
+    def _scan(self, seq: int, offset: int):
+        """
+        Yield (end_offset, timestamp, payload) for each intact record from offset on
+        """
+        try:
+            f = open(self._segment_path(seq), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                length, crc, timestamp = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                offset += RECORD_HEADER.size + length
+                yield offset, timestamp, payload
+
+    def append(self, data: bytes) -> None:
+        payload = zlib.compress(data, 1)
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload), time.time()) + payload
+        with self._lock:
+            self._active.write(record)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self.appended_records += 1
+            self._pending += 1
+            if self._active.tell() >= self.segment_bytes:
+                self._rotate()
+            self.has_data.notify_all()
+
+    def _rotate(self) -> None:
+        # Called with _lock held
+        self._active.close()
+        self._active_seq += 1
+        self._active = open(self._segment_path(self._active_seq), "ab")
+        self._enforce_limit()
+
+    def _enforce_limit(self) -> None:
+        """
+        Bound disk use by dropping the oldest unshipped segment; called with _lock held
+        """
+        segments = [seq for seq in self._segments() if seq >= self._cursor[0]]
+        sizes = {seq: os.path.getsize(self._segment_path(seq)) for seq in segments}
+        while len(segments) > 1 and sum(sizes.values()) > self.max_bytes:
+            oldest = segments.pop(0)
+            dropped = sum(1 for _ in self._scan(oldest, self._cursor[1] if oldest == self._cursor[0] else 0))
+            self.dropped_records += dropped
+            self._pending -= dropped
+            os.remove(self._segment_path(oldest))
+            del sizes[oldest]
+            self._cursor = (segments[0], 0)
+            self._save_cursor()
+
+    def read_batch(self, max_bytes: int) -> Tuple[List[bytes], Tuple[int, int], Optional[float]]:
+        """
+        Next unshipped records up to max_bytes (at least one), the cursor after them and the oldest timestamp
+        """
+        with self._lock:
+            seq, offset = self._cursor
+            active_seq = self._active_seq
+        records: List[bytes] = []
+        size = 0
+        oldest = None
+        while seq <= active_seq:
+            for end, timestamp, payload in self._scan(seq, offset):
+                data = zlib.decompress(payload)
+                if records and size + len(data) > max_bytes:
+                    return records, (seq, offset), oldest
+                records.append(data)
+                size += len(data)
+                offset = end
+                oldest = timestamp if oldest is None else oldest
+            if seq == active_seq:
+                break
+            seq, offset = seq + 1, 0
+        return records, (seq, offset), oldest
+
+    def commit(self, cursor: Tuple[int, int], records: int, size: int, shipped: bool = True) -> None:
+        """
+        Advance past records that were shipped (or rejected) and delete fully consumed segments
+        """
+        with self._lock:
+            if cursor < self._cursor:
+                # The segment was dropped by _enforce_limit while being shipped
+                return
+            self._cursor = cursor
+            self._save_cursor()
+            self._pending -= records
+            if shipped:
+                self.shipped_records += records
+                self.shipped_bytes += size
+            else:
+                self.dropped_records += records
+            for seq in self._segments():
+                if seq < cursor[0]:
+                    os.remove(self._segment_path(seq))
+
+    def _oldest_timestamp(self) -> Optional[float]:
+        # Called with _lock held
+        seq, offset = self._cursor
+        while seq <= self._active_seq:
+            for _, timestamp, _ in self._scan(seq, offset):
+                return timestamp
+            seq, offset = seq + 1, 0
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Queue depth (unshipped records and bytes on disk) and lag (age of the oldest unshipped record)
+        """
+        with self._lock:
+            seq, offset = self._cursor
+            segments = [s for s in self._segments() if s >= seq]
+            depth_bytes = sum(os.path.getsize(self._segment_path(s)) for s in segments) - offset if segments else 0
+            oldest = self._oldest_timestamp()
+            return {
+                "queue_depth_records": self._pending,
+                "queue_depth_bytes": max(0, depth_bytes),
+                "segments": len(segments),
+                "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "appended_records": self.appended_records,
+                "shipped_records": self.shipped_records,
+                "shipped_bytes": self.shipped_bytes,
+                "dropped_records": self.dropped_records
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._active.close()
+            if self._lock_fd is not None:
+                # Closing the descriptor releases the flock
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+
+class SpoolExporter(SpanExporter):
+    """
+    Span exporter that writes each batch to the spool instead of the network
+    """
+
+    def __init__(self, spool: SpanSpool):
+        self.spool = spool
+
+    def export(self, spans) -> SpanExportResult:
+        try:
+            self.spool.append(encode_spans(spans).SerializeToString())
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+class SpoolSpanProcessor(BatchSpanProcessor):
+    """
+    Stand-in for the Langfuse export processor: same project filter, but batches go to the spool
+    """
+
+    def __init__(self, spool: SpanSpool, public_key: Optional[str]):
+        super().__init__(SpoolExporter(spool))
+        self.public_key = public_key
+
+    def on_end(self, span: ReadableSpan) -> None:
+        scope = span.instrumentation_scope
+        if scope is not None and scope.name == LANGFUSE_TRACER_NAME:
+            if (scope.attributes or {}).get("public_key") != self.public_key:
+                # Span of another Langfuse project in this process
+                return
+        super().on_end(span)
+
+
+class SpoolShipper:
+    """
+    Background thread that uploads spooled records to the Langfuse OTLP endpoint in bulk
+
+    Backpressure: at most one request is in flight, each capped at
+    max_batch_bytes. Failures back off exponentially with jitter, honoring
+    Retry-After, and the cursor only advances after a 2xx response. A batch
+    rejected with another 4xx is skipped and counted as dropped.
+    """
+
+    def __init__(self, spool: SpanSpool, endpoint: str, headers: Dict[str, str], max_batch_bytes: int = 1024 * 1024,
+                 idle_interval: float = 1.0, max_backoff: float = 30.0):
+        self.spool = spool
+        self.endpoint = endpoint
+        self.headers = dict(headers, **{"Content-Type": "application/x-protobuf", "Content-Encoding": "gzip"})
+        self.max_batch_bytes = max_batch_bytes
+        self.idle_interval = idle_interval
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_success: Optional[float] = None
+        self._backoff = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._client = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="span-spool-shipper", daemon=True)
+            self._thread.start()
+
+    def _post(self, body: bytes) -> Tuple[bool, Optional[float], bool]:
+        """
+        (shipped, retry_after, retryable) for one upload
+        """
+        import httpx
+
+        if self._client is None:
+            from clients import http_limits
+            self._client = httpx.Client(limits=http_limits(), timeout=httpx.Timeout(30.0, connect=5.0))
+        try:
+            response = self._client.post(self.endpoint, content=gzip.compress(body, 1), headers=self.headers)
+        except httpx.HTTPError as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            return False, None, True
+        if response.is_success:
+            return True, None, False
+        self.last_error = f"HTTP {response.status_code}"
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = None
+        return False, retry_after, response.status_code == 429 or response.status_code >= 500
+
+    def ship_once(self) -> int:
+        """
+        Upload the next batch; returns the number of records shipped (0 when idle or failing)
+        """
+        records, cursor, _ = self.spool.read_batch(self.max_batch_bytes)
+        if not records:
+            return 0
+        body = b"".join(records)
+        shipped, retry_after, retryable = self._post(body)
+        if shipped or not retryable:
+            self.spool.commit(cursor, len(records), len(body), shipped)
+            self._backoff = 0.0
+            if not shipped:
+                return 0
+            self.last_success = time.time()
+            return len(records)
+        self.failures += 1
+        self._backoff = min(self.max_backoff, max(0.5, self._backoff * 2))
+        delay = retry_after if retry_after is not None else self._backoff * random.uniform(0.5, 1.0)
+        self._stop.wait(delay)
+        return 0
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.ship_once():
+                continue
+            with self.spool.has_data:
+                self.spool.has_data.wait(self.idle_interval)
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Ship until the spool is empty or timeout seconds pass; True when everything was shipped
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            records, _, _ = self.spool.read_batch(1)
+            if not records:
+                return True
+            if self._thread is not None and self._thread.is_alive():
+                time.sleep(0.05)
+            else:
+                self.ship_once()
+        return False
+
+    def stop(self, drain_seconds: float = 0.0) -> None:
+        if drain_seconds > 0:
+            self.drain(drain_seconds)
+        self._stop.set()
+        with self.spool.has_data:
+            self.spool.has_data.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.spool.stats()
+        stats.update({
+            "ship_failures": self.failures,
+            "last_error": self.last_error,
+            "seconds_since_last_ship": round(time.time() - self.last_success, 3) if self.last_success else None
+        })
+        return stats
+
+
+def langfuse_endpoint() -> Tuple[str, Dict[str, str]]:
+    """
+    The Langfuse OTLP traces endpoint and auth headers from LANGFUSE_* environment variables
+    """
+    import base64
+
+    public_key = os.getenv("LANGFUSE_PUBLIC_KEY", "")
+    secret_key = os.getenv("LANGFUSE_SECRET_KEY", "")
+    host = os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com").rstrip("/")
+    token = base64.b64encode(f"{public_key}:{secret_key}".encode("utf-8")).decode("ascii")
+    return f"{host}/api/public/otel/v1/traces", {
+        "Authorization": f"Basic {token}",
+        "x-langfuse-sdk-name": "python",
+        "x-langfuse-public-key": public_key
+    }
+
+
+_spool: Optional[SpanSpool] = None
+_shipper: Optional[SpoolShipper] = None
+_worker_slot = False
+_lock = threading.Lock()
+
+
+def spool_enabled() -> bool:
+    return bool(os.getenv("TRACE_SPOOL_DIR"))
+
+
+def _spool_options() -> Dict[str, Any]:
+    return {
+        "segment_bytes": int(os.getenv("TRACE_SPOOL_SEGMENT_BYTES", str(4 * 1024 * 1024))),
+        "max_bytes": int(os.getenv("TRACE_SPOOL_MAX_BYTES", str(512 * 1024 * 1024))),
+        "fsync": os.getenv("TRACE_SPOOL_FSYNC", "false").lower() == "true"
+    }
+
+
+def worker_slot_dirs(base: str) -> List[str]:
+    """
+    The worker-<n> slot directories under a spool directory, in slot order
+    """
+    try:
+        names = os.listdir(base)
+    except FileNotFoundError:
+        return []
+    slots = sorted(int(name[len(WORKER_SLOT_PREFIX):]) for name in names
+                   if name.startswith(WORKER_SLOT_PREFIX) and name[len(WORKER_SLOT_PREFIX):].isdigit())
+    return [os.path.join(base, f"{WORKER_SLOT_PREFIX}{slot}") for slot in slots]
+
+
+def open_worker_slot(base: str, **options) -> SpanSpool:
+    """
+    Open the first worker-<n> slot under base that no other process holds
+    """
+    slot = 0
+    while True:
+        try:
+            return SpanSpool(os.path.join(base, f"{WORKER_SLOT_PREFIX}{slot}"), **options)
+        except SpoolLocked:
+            slot += 1
+
+
+def use_worker_slot() -> None:
+    """
+    Spool into a worker-<n> slot under TRACE_SPOOL_DIR instead of the directory itself
+
+    For worker processes that inherit their parent's TRACE_SPOOL_DIR; call it
+    before the first span ends. Whatever a worker leaves unshipped is sent by
+    the next worker to claim its slot, or by `python span_spool.py drain`.
+    """
+    global _worker_slot
+    _worker_slot = True
+
+
+def get_shipper() -> SpoolShipper:
+    """
+    Process-wide spool and shipper configured from TRACE_SPOOL_* environment variables
+    """
+    global _spool, _shipper
+    with _lock:
+        if _shipper is None:
+            path = os.getenv("TRACE_SPOOL_DIR", ".trace_spool")
+            _spool = open_worker_slot(path, **_spool_options()) if _worker_slot else SpanSpool(path, **_spool_options())
+            endpoint, headers = langfuse_endpoint()
+            _shipper = SpoolShipper(_spool, endpoint, headers,
+                                    max_batch_bytes=int(os.getenv("TRACE_SPOOL_BATCH_BYTES", str(1024 * 1024))))
+        return _shipper
+
+
+def spool_processor(langfuse_processor) -> SpoolSpanProcessor:
+    """
+    Replace the Langfuse export processor with a spooling one and start shipping
+    """
+    shipper = get_shipper()
+    processor = SpoolSpanProcessor(shipper.spool, getattr(langfuse_processor, "public_key", None))
+    # Its network exporter is never used; stop its worker thread
+    langfuse_processor.shutdown()
+    shipper.start()
+    return processor
+
+
+def shutdown_spool() -> None:
+    """
+    Give the shipper TRACE_SPOOL_EXIT_DRAIN_SECONDS to catch up, then stop; anything left ships on the next start
+    """
+    with _lock:
+        shipper = _shipper
+    if shipper is not None:
+        shipper.stop(float(os.getenv("TRACE_SPOOL_EXIT_DRAIN_SECONDS", "2")))
+        shipper.spool.close()
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in ("status", "drain"):
+        print("Usage: python span_spool.py status|drain")
+        sys.exit(2)
+
+    from clients import load_env
+    load_env()
+    base = os.getenv("TRACE_SPOOL_DIR", ".trace_spool")
+    endpoint, headers = langfuse_endpoint()
+    # The spool itself plus any slots left by worker processes (run_all_demos.py --workers)
+    for path in [base] + worker_slot_dirs(base):
+        try:
+            spool = SpanSpool(path, **_spool_options())
+        except SpoolLocked:
+            print(f"⏭️  {path} is in use by a running process")
+            continue
+        shipper = SpoolShipper(spool, endpoint, headers,
+                               max_batch_bytes=int(os.getenv("TRACE_SPOOL_BATCH_BYTES", str(1024 * 1024))))
+        print(f"📦 {path}")
+        if sys.argv[1] == "drain":
+            done = shipper.drain(timeout=float(os.getenv("TRACE_SPOOL_DRAIN_TIMEOUT_SECONDS", "300")))
+            print("✅ Spool drained" if done else f"⚠️  Spool not empty: {shipper.last_error}")
+        print(json.dumps(shipper.stats(), indent=2))
+        spool.close()
+
+
+if __name__ == "__main__":
+    main()
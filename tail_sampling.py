@@ -0,0 +1,110 @@
+"""
+Tail Sampling for Langfuse Export
+OpenTelemetry span processor and tracer provider behind tracing.py's tail sampling, kept apart so OpenTelemetry loads only when tracing starts.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+
+from span_spool import spool_enabled, spool_processor
+from tracing import LEVEL_ATTRIBUTE, TracingPolicy, get_policy
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """
+    Wraps the Langfuse export processor and holds back spans of head-dropped traces
+
+    Spans of traces registered with defer() are buffered until the trace's
+    root span ends, then forwarded if the trace had an ERROR observation or
+    was slower than slow_ms, and discarded otherwise. All other spans pass
+    straight through.
+    """
+
+    def __init__(self, inner: SpanProcessor, max_pending_traces: int = 1000):
+        self.inner = inner
+        self.max_pending_traces = max_pending_traces
+        self.policy: Optional[TracingPolicy] = None
+        self.kept = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._decided: "OrderedDict[int, bool]" = OrderedDict()
+
+    def defer(self, trace_id: int, root_span_id: int) -> None:
+        with self._lock:
+            self._pending[trace_id] = {"root": root_span_id, "spans": [], "error": False}
+            while len(self._pending) > self.max_pending_traces:
+                # Oldest trace never finished; give up on it
+                self._pending.popitem(last=False)
+                self.dropped += 1
+
+    def on_start(self, span, parent_context=None) -> None:
+        self.inner.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id
+        with self._lock:
+            pending = self._pending.get(trace_id)
+            if pending is None:
+                decision = self._decided.get(trace_id)
+                if decision is False:
+                    return
+                forward = [span]
+            else:
+                pending["spans"].append(span)
+                if span.attributes and span.attributes.get(LEVEL_ATTRIBUTE) == "ERROR":
+                    pending["error"] = True
+                if span.context.span_id != pending["root"]:
+                    return
+
+                del self._pending[trace_id]
+                duration_ms = (span.end_time - span.start_time) / 1e6
+                policy = self.policy
+                keep = bool(policy) and ((policy.keep_errors and pending["error"]) or
+                                         (policy.slow_ms > 0 and duration_ms >= policy.slow_ms))
+                self._decided[trace_id] = keep
+                while len(self._decided) > self.max_pending_traces:
+                    self._decided.popitem(last=False)
+                if not keep:
+                    self.dropped += 1
+                    return
+                self.kept += 1
+                forward = pending["spans"]
+
+        for finished in forward:
+            self.inner.on_end(finished)
+
+    def shutdown(self) -> None:
+        self.inner.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.inner.force_flush(timeout_millis)
+
+
+class SamplingTracerProvider(TracerProvider):
+    """
+    Tracer provider that wraps every registered processor for tail sampling
+
+    Passed to Langfuse(tracer_provider=...), it intercepts the Langfuse
+    export processor as Langfuse registers it. With TRACE_SPOOL_DIR set, that
+    processor is swapped for one that spools to disk (see span_spool.py).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tail_processors: List[TailSamplingSpanProcessor] = []
+
+    def add_span_processor(self, span_processor: SpanProcessor) -> None:
+        if spool_enabled():
+            span_processor = spool_processor(span_processor)
+        wrapped = TailSamplingSpanProcessor(span_processor)
+        wrapped.policy = get_policy()
+        self.tail_processors.append(wrapped)
+        super().add_span_processor(wrapped)
+
+    def defer(self, trace_id: int, root_span_id: int) -> None:
+        for processor in self.tail_processors:
+            processor.defer(trace_id, root_span_id)
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from coalescing import SingleFlight
+
+
+def test_followers_share_the_leaders_result_and_error():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait()
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", upstream)[0])) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flights.followers < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["answer"] * 4
+    assert len(calls) == 1
+
+    async def failing():
+        raise ValueError("upstream failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(flights.ado("other", failing))
+
+
+def test_cancelled_leader_does_not_cancel_its_followers():
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05 if len(calls) > 1 else 10)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado("key", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.ado("key", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        # The follower retries and leads a call of its own
+        result, _, is_leader = await asyncio.wait_for(follower, timeout=1)
+        assert leader.cancelled()
+        return result, is_leader
+
+    assert asyncio.run(main()) == ("answer", True)
+    assert len(calls) == 2
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_concurrent_first_callers_share_one_coalescer(monkeypatch):
+    import coalescing
+
+    monkeypatch.setattr(coalescing, "_single_flight", None)
+    barrier = threading.Barrier(8)
+    created = []
+
+    class SlowSingleFlight(coalescing.SingleFlight):
+        def __init__(self):
+            time.sleep(0.01)
+            created.append(self)
+            super().__init__()
+
+    monkeypatch.setattr(coalescing, "SingleFlight", SlowSingleFlight)
+
+    def first_call():
+        barrier.wait()
+        return coalescing.get_single_flight()
+
+    threads = [threading.Thread(target=first_call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
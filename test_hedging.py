@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from hedging import Hedger
+from rate_limiter import LLMScheduler
+
+
+class RecordingObservation:
+    def __init__(self, metadata=None):
+        self.metadata = dict(metadata or {})
+        self.children = []
+        self.ended = False
+
+    def start_observation(self, name, as_type=None, metadata=None):
+        child = RecordingObservation(metadata)
+        self.children.append(child)
+        return child
+
+    def update(self, metadata=None, **kwargs):
+        self.metadata.update(metadata or {})
+
+    def end(self):
+        self.ended = True
+
+
+def hedger() -> Hedger:
+    # Hedge after 20 ms, with budget for every request
+    return Hedger(initial_delay_ms=20, budget=1.0)
+
+
+def test_slow_primary_is_cancelled_when_the_hedge_wins():
+    cancelled = []
+
+    async def attempt(observation):
+        try:
+            await asyncio.sleep(10 if observation.metadata["hedge_role"] == "primary" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(observation.metadata["hedge_role"])
+            raise
+        return observation.metadata["hedge_role"]
+
+    generation = RecordingObservation()
+    h = hedger()
+    assert asyncio.run(h.arace("gpt-4o-mini", "response", attempt, generation)) == "hedge"
+    assert cancelled == ["primary"]
+    assert generation.metadata["hedged"] is True and generation.metadata["hedge_winner"] == "hedge"
+    outcomes = {child.metadata["hedge_role"]: child.metadata["hedge_outcome"] for child in generation.children}
+    assert outcomes == {"primary": "cancelled", "hedge": "won"}
+    assert all(child.ended for child in generation.children)
+    assert h.stats()["hedge_wins"] == 1
+    # The latency sample covers the primary's wait before the hedge started, not just the hedge's own time
+    assert list(h._latencies[("gpt-4o-mini", "response")])[0] >= 0.03
+
+
+def test_fast_primary_is_not_hedged():
+    async def attempt(observation):
+        return "primary"
+
+    generation = RecordingObservation()
+    assert asyncio.run(hedger().arace("gpt-4o-mini", "response", attempt, generation)) == "primary"
+    assert len(generation.children) == 1 and generation.metadata["hedged"] is False
+
+
+def test_failed_attempt_falls_back_to_the_other_and_all_failures_raise():
+    async def primary_fails(observation):
+        if observation.metadata["hedge_role"] == "primary":
+            await asyncio.sleep(0.05)
+            raise ConnectionError("primary failed")
+        await asyncio.sleep(0.1)
+        return "hedge"
+
+    assert asyncio.run(hedger().arace("gpt-4o-mini", "response", primary_fails, RecordingObservation())) == "hedge"
+
+    async def both_fail(observation):
+        await asyncio.sleep(0.05)
+        raise ConnectionError(observation.metadata["hedge_role"])
+
+    with pytest.raises(ConnectionError, match="primary"):
+        asyncio.run(hedger().arace("gpt-4o-mini", "response", both_fail, RecordingObservation()))
+
+
+def test_hedges_stay_within_budget():
+    async def slow(observation):
+        await asyncio.sleep(0.04)
+        return "done"
+
+    h = Hedger(initial_delay_ms=10, budget=0.5)
+
+    async def main():
+        for _ in range(4):
+            await h.arace("gpt-4o-mini", "response", slow)
+
+    asyncio.run(main())
+    assert h.stats()["hedges"] == 2
+
+
+def test_sync_race_runs_on_the_hedger_loop():
+    async def attempt(observation):
+        await asyncio.sleep(10 if observation.metadata["hedge_role"] == "primary" else 0.01)
+        return observation.metadata["hedge_role"]
+
+    assert hedger().race("gpt-4o-mini", "response", attempt, RecordingObservation()) == "hedge"
+
+
+def test_cancelled_loser_returns_its_concurrency_slot():
+    scheduler = LLMScheduler()
+
+    async def attempt(observation):
+        delay = 10 if observation.metadata["hedge_role"] == "primary" else 0.01
+
+        async def call():
+            await asyncio.sleep(delay)
+            return observation.metadata["hedge_role"]
+
+        return await scheduler.acall(call)
+
+    assert asyncio.run(hedger().arace("gpt-4o-mini", "response", attempt, RecordingObservation())) == "hedge"
+    assert scheduler.concurrency.in_flight == 0
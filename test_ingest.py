@@ -0,0 +1,14 @@
+from ingest import IndexStore
+
+
+def test_reingesting_an_emptied_file_deletes_its_passages(tmp_path):
+    source = tmp_path / "notes.md"
+    source.write_text("First paragraph about tracing.\n\nSecond about retrieval.\n\nThird about caching.\n")
+    store = IndexStore(str(tmp_path / "index"))
+    assert store.ingest([str(source)], workers=1, merge=False)["added"] == 3
+
+    source.write_text("")
+    counts = store.ingest([str(source)], workers=1, merge=False)
+    assert counts["deleted"] == 3
+    store.reload()
+    assert store.current().stats()["documents"] == 0
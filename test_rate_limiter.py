@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import httpx
+import openai
+
+from rate_limiter import AIMDConcurrency, LLMScheduler, TokenBucket
+
+
+def flaky(failures: int):
+    """
+    A call that fails with a retryable connection error `failures` times, then succeeds; records when each attempt ran
+    """
+    attempts = []
+
+    def call():
+        attempts.append(time.monotonic())
+        if len(attempts) <= failures:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://mock/v1/chat/completions"))
+        return "ok"
+
+    return call, attempts
+
+
+def one_request_per_second() -> LLMScheduler:
+    scheduler = LLMScheduler(max_retries=2, base_delay=0.01)
+    # A 60 RPM bucket that holds a single request, so the retry has to wait for a refill
+    scheduler.requests = TokenBucket(60, capacity=1)
+    return scheduler
+
+
+class RecordingGeneration:
+    def __init__(self):
+        self.metadata = {}
+
+    def update(self, metadata=None, **kwargs):
+        self.metadata.update(metadata or {})
+
+    def start_observation(self, **kwargs):
+        return self
+
+    def end(self):
+        pass
+
+
+def test_sync_retry_waits_for_the_request_bucket():
+    scheduler = one_request_per_second()
+    call, attempts = flaky(1)
+    assert scheduler.call(call) == "ok"
+    assert attempts[1] - attempts[0] >= 0.9
+
+
+def test_async_retry_waits_for_the_request_bucket():
+    scheduler = one_request_per_second()
+    call, attempts = flaky(1)
+
+    async def acall():
+        return call()
+
+    assert asyncio.run(scheduler.acall(acall)) == "ok"
+    assert attempts[1] - attempts[0] >= 0.9
+
+
+def test_retries_reserve_tokens_and_report_the_time_waited():
+    scheduler = LLMScheduler(max_retries=2, base_delay=0.01)
+    # 1000 tokens/s, holding two 1000-token requests
+    scheduler.tokens = TokenBucket(60000, capacity=2000)
+    call, attempts = flaky(2)
+    generation = RecordingGeneration()
+    started = time.monotonic()
+    scheduler.call(call, estimated_tokens=1000, generation=generation)
+    elapsed = time.monotonic() - started
+
+    # Three sends of a 1000-token request: the third only fits after the bucket refills
+    assert len(attempts) == 3
+    assert attempts[2] - attempts[0] >= 0.9
+    waited = generation.metadata["rate_limit_wait_ms"] / 1000
+    assert 0.9 <= waited <= elapsed
+
+
+
+def test_async_waiters_get_slots_in_arrival_order():
+    concurrency = AIMDConcurrency(initial=1, maximum=1)
+
+    async def main():
+        await concurrency.acquire_async()
+        order = []
+
+        async def waiter(name):
+            await concurrency.acquire_async()
+            order.append(name)
+            concurrency.release(overloaded=False)
+
+        first = asyncio.ensure_future(waiter("first"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(waiter("second"))
+        await asyncio.sleep(0)
+        concurrency.release(overloaded=False)
+        # A caller arriving after the release still queues behind the earlier waiters
+        assert not concurrency.try_acquire()
+        await asyncio.gather(first, second)
+        return order
+
+    assert asyncio.run(main()) == ["first", "second"]
+    assert concurrency.in_flight == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    concurrency = AIMDConcurrency(initial=1, maximum=1)
+
+    async def main():
+        await concurrency.acquire_async()
+        cancelled = asyncio.ensure_future(concurrency.acquire_async())
+        behind = asyncio.ensure_future(concurrency.acquire_async())
+        await asyncio.sleep(0)
+        # The slot is handed to the first waiter just as it is cancelled; it passes on to the next
+        concurrency.release(overloaded=False)
+        cancelled.cancel()
+        await asyncio.wait_for(behind, timeout=1)
+        concurrency.release(overloaded=False)
+
+    asyncio.run(main())
+    assert concurrency.in_flight == 0
+
+
+def test_held_slot_stays_in_flight_until_released():
+    scheduler = LLMScheduler()
+    result, slot = scheduler.call(lambda: "stream", hold=True)
+    assert result == "stream" and scheduler.concurrency.in_flight == 1
+
+    async def open_stream():
+        return "stream"
+
+    _, async_slot = asyncio.run(scheduler.acall(open_stream, hold=True))
+    assert scheduler.concurrency.in_flight == 2
+
+    slot.release()
+    async_slot.release(GeneratorExit())
+    slot.release()
+    assert scheduler.concurrency.in_flight == 0
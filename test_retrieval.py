@@ -0,0 +1,47 @@
+import os
+
+import retrieval
+from retrieval import DenseIndex, build_dense_index, current_dense_version, open_dense_index
+
+CATS = [f"passage {i} about cats" for i in range(20)]
+DOGS = [f"passage {i} about dogs and birds" for i in range(30)]
+BIRDS = [f"passage {i} about birds" for i in range(10)]
+
+
+def test_rebuild_swaps_the_whole_dense_index_at_once(tmp_path):
+    path = str(tmp_path / "knowledge")
+    old = open_dense_index(CATS, path)
+    assert open_dense_index(CATS, path).version_path == old.version_path
+
+    build_dense_index(DOGS, path)
+    new = DenseIndex(path)
+    # Every file of the new version belongs to the same build
+    assert len(new) == new.meta["documents"] == len(new._offsets) - 1 == len(DOGS)
+    assert new.passage(len(DOGS) - 1) == DOGS[-1]
+    assert current_dense_version(path) == new.version_path
+    # The replaced version stays for readers that resolved the old pointer
+    assert os.path.isdir(old.version_path)
+    old.close()
+    new.close()
+
+
+def test_superseded_versions_are_removed_after_the_grace_period(tmp_path, monkeypatch):
+    path = str(tmp_path / "knowledge")
+    build_dense_index(CATS, path)
+    cats = current_dense_version(path)
+    build_dense_index(DOGS, path)
+    dogs = current_dense_version(path)
+    reader = DenseIndex(path)
+
+    # Within the grace period nothing is removed, not even versions two builds old
+    build_dense_index(BIRDS, path)
+    assert os.path.isdir(cats) and os.path.isdir(dogs)
+
+    monkeypatch.setattr(retrieval, "DENSE_VERSION_GRACE_SECONDS", 0)
+    build_dense_index(CATS, path)
+    # Republishing CATS reuses its version; BIRDS is the one it replaced, DOGS is long superseded
+    assert current_dense_version(path) == cats
+    assert not os.path.exists(dogs)
+    # A reader that had already opened a removed version keeps working
+    assert reader.passage(3) == DOGS[3]
+    reader.close()
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import llm
+from routing import DEFAULT_LATENCY_MS, ModelRouter
+
+GROUNDED = "Langfuse records traces of every request"
+
+
+def cascade() -> ModelRouter:
+    return ModelRouter("cascade", verifier="heuristic", max_escalations=1)
+
+
+def test_failed_escalation_keeps_the_rejected_answer():
+    router = cascade()
+    decision = router.route("What does Langfuse record?")
+
+    def attempt(model, parent):
+        if model != decision.model:
+            raise ConnectionError("upstream down")
+        return "I don't know"
+
+    assert router.run(decision, attempt, "What does Langfuse record?", reference=GROUNDED) == "I don't know"
+    stats = router.stats()
+    assert stats["failures"] == 0 and stats["answered"] == {decision.model: 1}
+
+
+def test_failed_first_attempt_still_raises():
+    router = cascade()
+
+    async def attempt(model, parent):
+        raise ConnectionError("upstream down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(router.arun(router.route("question"), attempt, "question", client=None))
+    assert router.stats()["failures"] == 1
+
+
+def test_latency_is_only_observed_for_upstream_calls():
+    router = cascade()
+    decision = router.route("question")
+
+    def cached(model, parent):
+        llm._served_upstream.set(False)
+        return GROUNDED
+
+    router.run(decision, cached, "question", reference=GROUNDED)
+    assert router.stats()["expected_latency_ms"] == {}
+
+    def upstream(model, parent):
+        llm._served_upstream.set(True)
+        return GROUNDED
+
+    router.run(decision, upstream, "question", reference=GROUNDED)
+    assert router.expected_latency_ms(decision.model) < DEFAULT_LATENCY_MS[decision.model]
+
+
+def test_fixed_policy_does_not_count_tokens(monkeypatch):
+    import context_packer
+
+    def count_tokens(*args):
+        raise AssertionError("the fixed policy should not tokenize")
+
+    monkeypatch.setattr(context_packer, "count_tokens", count_tokens)
+    router = ModelRouter("fixed")
+    decision = router.route("question")
+    assert router.run(decision, lambda model, parent: "answer", "question") == "answer"
+    assert router.stats()["answered"] == {router.default_model: 1}
+    assert router.stats()["expected_latency_ms"] == {}
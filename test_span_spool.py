@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from span_spool import RECORD_HEADER, SpanSpool, SpoolLocked, open_worker_slot, worker_slot_dirs
+
+
+def test_second_spool_on_same_directory_fails_fast(tmp_path):
+    first = SpanSpool(str(tmp_path))
+    first.append(b"owned by the first spool")
+    with pytest.raises(SpoolLocked):
+        SpanSpool(str(tmp_path))
+    first.close()
+
+    # The lock goes with close(), and nothing the first spool wrote was touched
+    second = SpanSpool(str(tmp_path))
+    records, _, _ = second.read_batch(1024)
+    assert records == [b"owned by the first spool"]
+    second.close()
+
+
+def test_torn_tail_is_repaired_and_intact_records_survive(tmp_path):
+    spool = SpanSpool(str(tmp_path))
+    spool.append(b"one")
+    spool.append(b"two")
+    segment = spool._segment_path(spool._active_seq)
+    spool.close()
+    intact_size = os.path.getsize(segment)
+    with open(segment, "ab") as f:
+        # A crash halfway through the next append
+        f.write(RECORD_HEADER.pack(100, 0, 0.0) + b"partial")
+
+    spool = SpanSpool(str(tmp_path))
+    assert os.path.getsize(segment) == intact_size
+    assert spool.stats()["queue_depth_records"] == 2
+    spool.append(b"three")
+    records, _, _ = spool.read_batch(1024)
+    assert records == [b"one", b"two", b"three"]
+    spool.close()
+
+
+def test_commit_persists_cursor_and_deletes_shipped_segments(tmp_path):
+    spool = SpanSpool(str(tmp_path), segment_bytes=64)
+    for i in range(6):
+        spool.append(f"record-{i}".encode() * 8)
+    assert len(spool._segments()) > 2
+
+    records, cursor, _ = spool.read_batch(200)
+    spool.commit(cursor, len(records), sum(map(len, records)))
+    assert all(seq >= cursor[0] for seq in spool._segments())
+    spool.close()
+
+    # A restart resumes after the committed records, so nothing is shipped twice
+    spool = SpanSpool(str(tmp_path), segment_bytes=64)
+    rest, _, _ = spool.read_batch(10 ** 6)
+    assert records + rest == [f"record-{i}".encode() * 8 for i in range(6)]
+    assert spool.stats()["queue_depth_records"] == len(rest)
+    spool.close()
+
+
+def test_worker_slots_give_each_process_its_own_spool(tmp_path):
+    first = open_worker_slot(str(tmp_path))
+    second = open_worker_slot(str(tmp_path))
+    assert first.path != second.path
+    first.append(b"from the first worker")
+    first.close()
+
+    # A freed slot is reclaimed, so its leftovers are shipped by the next worker
+    third = open_worker_slot(str(tmp_path))
+    assert third.path == first.path
+    assert third.read_batch(1024)[0] == [b"from the first worker"]
+    assert worker_slot_dirs(str(tmp_path)) == [first.path, second.path]
+    second.close()
+    third.close()
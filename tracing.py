@@ -0,0 +1,429 @@
+"""
+Tracing Controls for the Demos
+Head and tail trace sampling plus per-field payload truncation and hashing, applied in front of Langfuse.
+
+Every demo starts its traces with start_trace(). Three controls apply:
+- Head sampling keeps a configurable share of traces per trace name. A
+  dropped trace gets a falsy NoopSpan, so the demos skip all span and
+  payload work for it.
+- Tail sampling still records head-dropped traces. Their spans are held
+  back and exported only if the trace had an ERROR observation or ran
+  longer than the slow threshold.
+- Payload limits cap each input/output/metadata field at a byte budget.
+  Oversized values are truncated and tagged with their size and SHA-256.
+
+With TRACE_BLOB_DIR set, large payloads are instead written once to a local
+content-addressed blob store and spans carry a small {"$blob": ...}
+reference. The RAG context, for example, appears in three observations per
+trace but is serialized and exported as a reference each time.
+resolve_trace() (or "python tracing.py resolve <trace_id>") rebuilds the
+full view when a trace is read back.
+"""
+
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+LEVEL_ATTRIBUTE = "langfuse.observation.level"
+
+
+def parse_spec(spec: str) -> Dict[str, float]:
+    """
+    Parse "name=value,name=value" into a dict
+    """
+    result = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            result[name.strip()] = float(value)
+    return result
+
+
+class NoopSpan:
+    """
+    Stand-in for a span of a trace that is not recorded
+
+    It is falsy, so code guarded by "if trace:" skips instrumentation
+    entirely; the methods exist for code that calls them unconditionally.
+    """
+
+    id = None
+    trace_id = None
+
+    def __bool__(self):
+        return False
+
+    def start_span(self, **kwargs):
+        return self
+
+    def start_observation(self, **kwargs):
+        return self
+
+    def update(self, **kwargs):
+        return self
+
+    def end(self, **kwargs):
+        return self
+
+
+NOOP_SPAN = NoopSpan()
+
+BLOB_KEY = "$blob"
+
+
+class BlobStore:
+    """
+    Content-addressed payload store: each distinct payload is written once, zlib-compressed, as <path>/<aa>/<sha256>
+
+    Strings are stored as text. Lists and dicts are stored as JSON after
+    their own large members have been replaced by references, so a passage
+    shared by several containers is still stored only once.
+    """
+
+    def __init__(self, path: str, min_bytes: int = 256, max_memo_entries: int = 4096):
+        self.path = path
+        self.min_bytes = min_bytes
+        self.max_memo_entries = max_memo_entries
+        self.blobs_written = 0
+        self.references = 0
+        self.bytes_referenced = 0
+        self._lock = threading.Lock()
+        self._known = set()
+        # Recently referenced strings; the demos pass the same string object
+        # to several observations, so a hit costs one identity comparison
+        self._memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._known:
+                return digest
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data, 1))
+            os.replace(tmp_path, path)
+            self.blobs_written += 1
+        with self._lock:
+            self._known.add(digest)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def _reference(self, data: bytes, kind: str, preview: str = None) -> Dict[str, Any]:
+        ref = {BLOB_KEY: f"sha256:{self.put(data)}", "kind": kind, "bytes": len(data)}
+        if preview:
+            ref["preview"] = preview
+        self.references += 1
+        self.bytes_referenced += len(data)
+        return ref
+
+    def dedup(self, value: Any) -> Any:
+        """
+        Replace value, or its large members, with blob references when they reach min_bytes
+        """
+        if isinstance(value, str):
+            if len(value) * 4 < self.min_bytes:
+                return value
+            ref = self._memo.get(value)
+            if ref is not None:
+                self.references += 1
+                self.bytes_referenced += ref["bytes"]
+                return ref
+            data = value.encode("utf-8")
+            if len(data) < self.min_bytes:
+                return value
+            ref = self._reference(data, "text", value[:64])
+            with self._lock:
+                self._memo[value] = ref
+                while len(self._memo) > self.max_memo_entries:
+                    self._memo.popitem(last=False)
+            return ref
+
+        if isinstance(value, dict):
+            if BLOB_KEY in value:
+                return value
+            value = {key: self.dedup(member) for key, member in value.items()}
+        elif isinstance(value, (list, tuple)):
+            value = [self.dedup(member) for member in value]
+        else:
+            return value
+        data = json.dumps(value, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(data) < self.min_bytes:
+            return value
+        return self._reference(data, "json")
+
+    def resolve(self, value: Any) -> Any:
+        """
+        Inverse of dedup: expand every blob reference in value
+        """
+        if isinstance(value, dict):
+            ref = value.get(BLOB_KEY)
+            if isinstance(ref, str) and ref.startswith("sha256:"):
+                data = self.get(ref[len("sha256:"):])
+                if value.get("kind") == "json":
+                    return self.resolve(json.loads(data))
+                return data.decode("utf-8")
+            return {key: self.resolve(member) for key, member in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(member) for member in value]
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "blobs_written": self.blobs_written,
+            "references": self.references,
+            "bytes_referenced": self.bytes_referenced
+        }
+
+
+class TracingPolicy:
+    """
+    Sampling and payload settings, normally read from TRACE_* environment variables
+    """
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None, default_sample_rate: float = 1.0,
+                 keep_errors: bool = True, slow_ms: float = 0.0, field_budgets: Optional[Dict[str, int]] = None,
+                 default_field_budget: int = 8192, seed: Optional[int] = None,
+                 blob_store: Optional[BlobStore] = None):
+        self.sample_rates = sample_rates or {}
+        self.default_sample_rate = default_sample_rate
+        self.keep_errors = keep_errors
+        self.slow_ms = slow_ms
+        self.field_budgets = field_budgets or {}
+        self.default_field_budget = default_field_budget
+        self.blob_store = blob_store
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls) -> "TracingPolicy":
+        rates = parse_spec(os.getenv("TRACE_SAMPLE_RATES", ""))
+        default_rate = rates.pop("*", 1.0)
+        blob_dir = os.getenv("TRACE_BLOB_DIR", "")
+        return cls(
+            sample_rates=rates,
+            default_sample_rate=default_rate,
+            keep_errors=os.getenv("TRACE_KEEP_ERRORS", "true").lower() != "false",
+            slow_ms=float(os.getenv("TRACE_SLOW_MS", "0")),
+            field_budgets={k: int(v) for k, v in parse_spec(os.getenv("TRACE_FIELD_BUDGETS", "")).items()},
+            default_field_budget=int(os.getenv("TRACE_FIELD_BUDGET_BYTES", "8192")),
+            blob_store=BlobStore(blob_dir, int(os.getenv("TRACE_BLOB_MIN_BYTES", "256"))) if blob_dir else None
+        )
+
+    @property
+    def tail_sampling(self) -> bool:
+        return self.keep_errors or self.slow_ms > 0
+
+    def head_sample(self, name: str) -> bool:
+        rate = self.sample_rates.get(name, self.default_sample_rate)
+        return rate >= 1.0 or self._random.random() < rate
+
+    def budget(self, span_name: str, field: str) -> int:
+        """
+        Byte budget for a field: "span.field", then "field", then the default; negative means unlimited
+        """
+        for key in (f"{span_name}.{field}", field):
+            if key in self.field_budgets:
+                return self.field_budgets[key]
+        if field.startswith("metadata.") and "metadata" in self.field_budgets:
+            return self.field_budgets["metadata"]
+        return self.default_field_budget
+
+    def limit(self, span_name: str, field: str, value: Any) -> Any:
+        """
+        Truncate a field that exceeds its budget; a budget of 0 keeps only the size and hash
+
+        With a blob store, large values are moved to the store in full and
+        replaced by a reference instead of being truncated.
+        """
+        if value is None:
+            return value
+        budget = self.budget(span_name, field)
+        if budget != 0 and self.blob_store is not None:
+            value = self.blob_store.dedup(value)
+            if isinstance(value, dict) and BLOB_KEY in value:
+                return value
+        if budget < 0:
+            return value
+        if isinstance(value, str):
+            if len(value) <= budget // 4:
+                # At most 4 bytes per character, so it fits without encoding
+                return value
+            data = value.encode("utf-8")
+        elif isinstance(value, (int, float, bool)):
+            return value
+        else:
+            data = json.dumps(value, default=str, ensure_ascii=False).encode("utf-8")
+        if len(data) <= budget:
+            return value
+
+        digest = hashlib.sha256(data).hexdigest()
+        if budget == 0:
+            return {"sha256": digest, "bytes": len(data)}
+        preview = data[:budget].decode("utf-8", errors="ignore")
+        return f"{preview}… [truncated {len(data)} bytes, sha256:{digest[:16]}]"
+
+    def limit_metadata(self, span_name: str, metadata: Any) -> Any:
+        if not isinstance(metadata, dict):
+            return self.limit(span_name, "metadata", metadata)
+        return {key: self.limit(span_name, f"metadata.{key}", value) for key, value in metadata.items()}
+
+
+def limit_kwargs(policy: TracingPolicy, name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply payload limits to the input/output/metadata arguments of a span call
+    """
+    for field in ("input", "output"):
+        if kwargs.get(field) is not None:
+            kwargs[field] = policy.limit(name, field, kwargs[field])
+    if kwargs.get("metadata") is not None:
+        kwargs["metadata"] = policy.limit_metadata(name, kwargs["metadata"])
+    return kwargs
+
+
+class LimitedSpan:
+    """
+    Proxy for a Langfuse span that applies payload limits to everything recorded on it
+    """
+
+    def __init__(self, span, name: str, policy: TracingPolicy):
+        self._span = span
+        self._name = name
+        self._policy = policy
+
+    def __getattr__(self, attr):
+        return getattr(self._span, attr)
+
+    def __bool__(self):
+        return True
+
+    def start_span(self, name: str, **kwargs) -> "LimitedSpan":
+        return LimitedSpan(self._span.start_span(name=name, **limit_kwargs(self._policy, name, kwargs)), name, self._policy)
+
+    def start_observation(self, name: str, **kwargs) -> "LimitedSpan":
+        return LimitedSpan(self._span.start_observation(name=name, **limit_kwargs(self._policy, name, kwargs)), name, self._policy)
+
+    def update(self, **kwargs) -> "LimitedSpan":
+        self._span.update(**limit_kwargs(self._policy, kwargs.get("name") or self._name, kwargs))
+        return self
+
+    def end(self, **kwargs) -> "LimitedSpan":
+        self._span.end(**kwargs)
+        return self
+
+
+_policy = None
+_tracer_provider = None
+_lock = threading.Lock()
+
+
+def get_policy() -> TracingPolicy:
+    global _policy
+    with _lock:
+        if _policy is None:
+            _policy = TracingPolicy.from_env()
+        return _policy
+
+
+def set_policy(policy: TracingPolicy) -> None:
+    global _policy
+    with _lock:
+        _policy = policy
+    if _tracer_provider is not None:
+        for processor in _tracer_provider.tail_processors:
+            processor.policy = policy
+
+
+def get_tracer_provider():
+    """
+    Process-wide tracer provider to hand to Langfuse(tracer_provider=...)
+
+    It is also installed as the global OpenTelemetry provider, because
+    Langfuse.flush() flushes whatever provider is global. OpenTelemetry is
+    only imported here, on first use.
+    """
+    global _tracer_provider
+    with _lock:
+        if _tracer_provider is None:
+            from opentelemetry import trace as otel_trace
+            from opentelemetry.sdk.resources import Resource
+            from tail_sampling import SamplingTracerProvider
+
+            attributes = {
+                "langfuse.environment": os.getenv("LANGFUSE_TRACING_ENVIRONMENT"),
+                "langfuse.release": os.getenv("LANGFUSE_RELEASE"),
+            }
+            _tracer_provider = SamplingTracerProvider(
+                resource=Resource.create({k: v for k, v in attributes.items() if v is not None})
+            )
+            otel_trace.set_tracer_provider(_tracer_provider)
+        return _tracer_provider
+
+
+def start_trace(client, name: str, **kwargs):
+    """
+    Start a root span subject to sampling and payload limits
+
+    Returns a LimitedSpan when the trace is recorded (head-sampled, or
+    buffered for tail sampling) and NOOP_SPAN when it is dropped outright.
+    """
+    policy = get_policy()
+    sampled = policy.head_sample(name)
+    if not sampled and not policy.tail_sampling:
+        return NOOP_SPAN
+
+    if not sampled:
+        kwargs["metadata"] = dict(kwargs.get("metadata") or {}, head_sampled=False)
+    root = LimitedSpan(client.start_span(name=name, **limit_kwargs(policy, name, kwargs)), name, policy)
+    if not sampled and _tracer_provider is not None:
+        _tracer_provider.defer(int(root.trace_id, 16), int(root.id, 16))
+    return root
+
+
+def _resolve_payloads(item: Dict[str, Any], store: BlobStore) -> Dict[str, Any]:
+    for field in ("input", "output", "metadata"):
+        if item.get(field) is not None:
+            item[field] = store.resolve(item[field])
+    return item
+
+
+def resolve_trace(client, trace_id: str, store: Optional[BlobStore] = None) -> Dict[str, Any]:
+    """
+    Fetch a trace from Langfuse and expand the blob references in it and its observations
+    """
+    store = store or get_policy().blob_store
+    if store is None:
+        raise ValueError("No blob store configured; set TRACE_BLOB_DIR")
+    trace = client.api.trace.get(trace_id).dict()
+    _resolve_payloads(trace, store)
+    for observation in trace.get("observations") or []:
+        _resolve_payloads(observation, store)
+    return trace
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != "resolve":
+        print("Usage: python tracing.py resolve <trace_id>")
+        sys.exit(2)
+
+    from clients import get_langfuse, load_env
+    load_env()
+    trace = resolve_trace(get_langfuse(), sys.argv[2])
+    print(json.dumps(trace, indent=2, default=str, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
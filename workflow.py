@@ -0,0 +1,152 @@
+"""
+DAG Workflow Engine
+Runs workflow steps as a dependency graph, executing independent steps concurrently with one Langfuse span per step.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+@dataclass
+class Step:
+    name: str
+    fn: Callable[[Dict[str, Any], Any], Any]
+    deps: Sequence[str] = ()
+    input: Any = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class StepResult:
+    name: str
+    status: str  # "ok", "error" or "cancelled"
+    output: Any = None
+    error: Optional[str] = None
+    queue_wait_ms: float = 0.0
+    run_ms: float = 0.0
+
+
+class Workflow:
+    """
+    A set of steps with dependencies, run with bounded parallelism
+
+    Each step function receives a dict of its dependencies' outputs and its
+    own Langfuse span, and returns its output. A step becomes ready once all
+    of its dependencies succeeded; if one fails, only the steps downstream
+    of it are cancelled and everything else keeps running. Every step span
+    is started and ended exactly once, with queue_wait_ms (ready until a
+    worker picked it up) and run_ms recorded separately.
+    """
+
+    def __init__(self, name: str = "workflow", parallelism: int = 4):
+        self.name = name
+        self.parallelism = max(1, parallelism)
+        self.steps: Dict[str, Step] = {}
+
+    def add(self, name: str, fn: Callable[[Dict[str, Any], Any], Any], deps: Sequence[str] = (),
+            input: Any = None, metadata: Optional[Dict[str, Any]] = None) -> "Workflow":
+        if name in self.steps:
+            raise ValueError(f"Duplicate workflow step: {name}")
+        self.steps[name] = Step(name, fn, tuple(deps), input, metadata or {})
+        return self
+
+    def _validate(self) -> None:
+        for step in self.steps.values():
+            for dep in step.deps:
+                if dep not in self.steps:
+                    raise ValueError(f"Step {step.name!r} depends on unknown step {dep!r}")
+
+        # Kahn's algorithm: any step left unvisited sits on a cycle
+        indegree = {name: len(step.deps) for name, step in self.steps.items()}
+        ready = [name for name, count in indegree.items() if count == 0]
+        visited = 0
+        while ready:
+            current = ready.pop()
+            visited += 1
+            for step in self.steps.values():
+                if current in step.deps:
+                    indegree[step.name] -= 1
+                    if indegree[step.name] == 0:
+                        ready.append(step.name)
+        if visited != len(self.steps):
+            raise ValueError("Workflow contains a dependency cycle")
+
+    def _run_step(self, step: Step, inputs: Dict[str, Any], ready_at: float, parent) -> StepResult:
+        started = time.perf_counter()
+        queue_wait_ms = (started - ready_at) * 1000
+        span = parent.start_span(name=step.name, input=step.input, metadata=step.metadata) if parent else None
+        try:
+            output = step.fn(inputs, span)
+            run_ms = (time.perf_counter() - started) * 1000
+            if span:
+                span.update(output=output, metadata={"queue_wait_ms": round(queue_wait_ms, 1), "run_ms": round(run_ms, 1)})
+            return StepResult(step.name, "ok", output, None, queue_wait_ms, run_ms)
+        except Exception as e:
+            run_ms = (time.perf_counter() - started) * 1000
+            error = f"{type(e).__name__}: {e}"
+            if span:
+                span.update(
+                    output=error,
+                    level="ERROR",
+                    status_message=error,
+                    metadata={"queue_wait_ms": round(queue_wait_ms, 1), "run_ms": round(run_ms, 1)}
+                )
+            return StepResult(step.name, "error", None, error, queue_wait_ms, run_ms)
+        finally:
+            if span:
+                span.end()
+
+    def run(self, parent=None) -> Dict[str, StepResult]:
+        """
+        Execute the graph; step spans are children of parent when one is given
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        self._validate()
+        results: Dict[str, StepResult] = {}
+        dependents: Dict[str, List[str]] = {name: [] for name in self.steps}
+        remaining = {}
+        for step in self.steps.values():
+            remaining[step.name] = len(step.deps)
+            for dep in step.deps:
+                dependents[dep].append(step.name)
+
+        def cancel_downstream(name: str, reason: str) -> None:
+            for child in dependents[name]:
+                if child not in results:
+                    results[child] = StepResult(child, "cancelled", error=reason)
+                    if parent:
+                        span = parent.start_span(name=child, input=self.steps[child].input)
+                        span.update(level="WARNING", status_message=reason, metadata={"cancelled": True})
+                        span.end()
+                    cancel_downstream(child, reason)
+
+        with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix=self.name) as pool:
+            running = {}
+
+            def submit(name: str) -> None:
+                step = self.steps[name]
+                inputs = {dep: results[dep].output for dep in step.deps}
+                future = pool.submit(self._run_step, step, inputs, time.perf_counter(), parent)
+                running[future] = name
+
+            for name, count in remaining.items():
+                if count == 0:
+                    submit(name)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    results[name] = result
+                    if result.status != "ok":
+                        cancel_downstream(name, f"upstream step {name!r} failed: {result.error}")
+                        continue
+                    for child in dependents[name]:
+                        remaining[child] -= 1
+                        if remaining[child] == 0 and child not in results:
+                            submit(child)
+
+        return results